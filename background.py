@@ -0,0 +1,142 @@
+import queue
+import threading
+
+# How often the Tk thread checks for worker messages
+POLL_INTERVAL_MS = 100
+
+
+class TaskCancelled(Exception):
+    """Raised inside a worker once its task has been cancelled or superseded"""
+
+
+class BackgroundTask:
+    """Handle given to a worker function for progress reports and cancellation checks"""
+
+    def __init__(self, runner, key, generation):
+        self.key = key
+        self.generation = generation
+        self._runner = runner
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def check(self):
+        """Raise TaskCancelled if the task should stop"""
+        if self._cancelled.is_set():
+            raise TaskCancelled(self.key)
+
+    def progress(self, text):
+        """Report progress text to the Tk thread; also a cancellation point"""
+        self.check()
+        self._runner._post(self, 'progress', text)
+
+
+class TaskRunner:
+    """Runs long app stages on worker threads and delivers their results on the Tk thread
+
+    There is at most one live task per key: starting a task cancels the previous one with
+    the same key. Workers never touch Tk; they post messages to a queue that the Tk thread
+    drains with root.after polling. Results of a task that is no longer the live one for
+    its key are never delivered, so a cancelled or superseded run cannot overwrite newer
+    state; they go to on_discard instead so files and other resources can be released.
+    """
+
+    def __init__(self, root, poll_ms=POLL_INTERVAL_MS):
+        self.root = root
+        self.poll_ms = poll_ms
+        self._queue = queue.Queue()
+        self._live = {}
+        self._callbacks = {}
+        self._generation = 0
+        self._polling = False
+
+    @property
+    def busy(self):
+        return bool(self._live)
+
+    def is_running(self, key):
+        return key in self._live
+
+    def start(self, key, work, on_done, on_error=None, on_progress=None, on_discard=None):
+        """Run work(task) on a worker thread and call on_done(result) on the Tk thread
+
+        on_error(exception) and on_progress(text) are also called on the Tk thread.
+        on_discard(result) receives the result of a run that finished after being
+        cancelled or superseded.
+        """
+        self.cancel(key)
+        self._generation += 1
+        task = BackgroundTask(self, key, self._generation)
+        self._live[key] = task
+        self._callbacks[task.generation] = (on_done, on_error, on_progress, on_discard)
+        threading.Thread(target=self._run, args=(task, work), daemon=True).start()
+        self._schedule_poll()
+        return task
+
+    def cancel(self, key=None):
+        """Cancel the live task for key, or every live task when key is None; returns how many"""
+        keys = list(self._live) if key is None else [key] if key in self._live else []
+        for k in keys:
+            self._live.pop(k).cancel()
+        return len(keys)
+
+    def _run(self, task, work):
+        try:
+            result = work(task)
+        except TaskCancelled:
+            self._post(task, 'cancelled', None)
+        except Exception as e:
+            self._post(task, 'error', e)
+        else:
+            self._post(task, 'done', result)
+
+    def _post(self, task, kind, payload):
+        self._queue.put((task, kind, payload))
+
+    def _schedule_poll(self):
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.poll_ms, self._poll)
+
+    def _poll(self):
+        self._polling = False
+        while True:
+            try:
+                task, kind, payload = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            self._deliver(task, kind, payload)
+        if self._live or self._callbacks:
+            self._schedule_poll()
+
+    def _deliver(self, task, kind, payload):
+        on_done, on_error, on_progress, on_discard = self._callbacks.get(task.generation, (None,) * 4)
+        live = self._live.get(task.key) is task
+        if kind == 'progress':
+            if live and on_progress is not None:
+                on_progress(payload)
+            return
+
+        # The worker has finished one way or another
+        self._callbacks.pop(task.generation, None)
+        if not live:
+            if kind == 'done' and on_discard is not None:
+                on_discard(payload)
+            return
+        del self._live[task.key]
+        if kind == 'done':
+            on_done(payload)
+        elif kind == 'error' and on_error is not None:
+            on_error(payload)
+
+
+def report_blocks(task, blocks, total, label):
+    """Pass (start, block) pairs through, reporting rows done to task after each one"""
+    for start, block in blocks:
+        yield start, block
+        task.progress(f"{label}: {min(start + len(block), total):,}/{total:,} rows")
@@ -0,0 +1,509 @@
+import argparse
+import json
+import os
+import re
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from multiprocessing import get_context, util
+
+import numpy as np
+import pandas as pd
+
+from coordinate_store import CoordinateStore, open_coordinate_file
+from distance_engine import (
+    butcher_labels, fill_distance_sink, open_distance_sink, save_distance_matrix, temp_sink_path
+)
+from ingest import ingest_csv, ingest_excel, ingest_locations
+
+# Defaults
+OUTPUT_DIR = 'batch_output'
+MATRIX_FORMATS = ('csv', 'parquet', 'feather', 'xlsx')
+MAP_TYPES = ('clusters', 'markers', 'heatmap', 'none')
+IMAGE_MODES = ('static', 'browser', 'none')
+IMAGE_SIZE = (1200, 800)
+SERVICE_RADIUS_KM = 5
+DISTANCE_CHUNK_SIZE = 50_000
+BUTCHER_COLUMNS = ['butcher_id', 'latitude', 'longitude']
+
+
+class StageTimer:
+    """Wall-clock time of each named stage of a run, plus whatever counts the stage records"""
+
+    def __init__(self, echo=True):
+        self.stages = []
+        self.echo = echo
+
+    @contextmanager
+    def stage(self, name):
+        """Time the enclosed block; the yielded dict is stored with the timing"""
+        record = {'stage': name}
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = round(time.perf_counter() - start, 3)
+            self.stages.append(record)
+            if self.echo:
+                print(f"{name}: {record['seconds']:.2f}s", file=sys.stderr)
+
+
+def _peak_rss_mb():
+    """Peak resident memory of this process in MB, where the platform reports it"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KB, macOS bytes
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def load_customers(path):
+    """CoordinateStore and row counts for a customer .coords, CSV or Excel file"""
+    if path.endswith('.coords'):
+        store = open_coordinate_file(path)
+        return store, {'rows': len(store), 'rejected': 0, 'backfilled': 0}
+    columns = ['customer_id', 'latitude', 'longitude']
+    df, stats = ingest_csv(path, columns) if path.endswith('.csv') else ingest_excel(path, columns)
+    if df.empty:
+        raise ValueError(f"No rows with valid latitude/longitude values in {path}")
+    counts = {'rows': stats.count, 'rejected': stats.rows_read - stats.count, 'backfilled': stats.backfilled}
+    return CoordinateStore.from_frame(df, 'customer_id'), counts
+
+
+def load_butchers(path):
+    """Cleaned butcher frame (optional butcher_name column kept) and its CoordinateStore"""
+    df, stats = ingest_locations(path, BUTCHER_COLUMNS)
+    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+    if df.empty:
+        raise ValueError(f"No rows with valid latitude/longitude values in {path}")
+    return df, CoordinateStore.from_frame(df, 'butcher_id'), {'rows': len(df), 'rejected': stats.rows_read - len(df)}
+
+
+def compute_distances(customer_store, butcher_store, column_labels, sink_path, workers=1):
+    """Write the customer x butcher matrix into a sink at sink_path, in bounded memory
+
+    With workers > 1, large matrices have their row blocks computed and written by a
+    process pool; small ones stay in this process, where they finish faster.
+    """
+    sink = open_distance_sink(sink_path, customer_store.ids, column_labels)
+    try:
+        fill_distance_sink(customer_store, butcher_store, sink, workers, DISTANCE_CHUNK_SIZE)
+    except BaseException:
+        sink.discard()
+        raise
+    return sink
+
+
+def coverage_summary(customer_store, butcher_df, butcher_store, radius_km=SERVICE_RADIUS_KM):
+    """Service coverage numbers: customers near any butcher, per-butcher counts, nearest-butcher distances"""
+    from spatial_index import GeoIndex
+
+    customer_index = GeoIndex.from_store(customer_store)
+    butcher_index = GeoIndex.from_store(butcher_store)
+    within = int(customer_index.within_radius_of_any(butcher_store.lat, butcher_store.lon, radius_km).sum())
+    counts = customer_index.count_radius(butcher_store.lat, butcher_store.lon, radius_km)
+    nearest, _ = butcher_index.query_nearest(customer_store.lat, customer_store.lon)
+    nearest = nearest[:, 0]
+    labels = butcher_labels(butcher_df, 'butcher_name', 'butcher_id')
+
+    return {
+        'customers': len(customer_store),
+        'butchers': len(butcher_store),
+        'radius_km': radius_km,
+        'customers_within_radius': within,
+        'coverage_percent': round(100 * within / len(customer_store), 2),
+        'customers_per_butcher': {str(label): int(count) for label, count in zip(labels, counts)},
+        'nearest_butcher_km': {
+            'mean': round(float(nearest.mean()), 3),
+            'median': round(float(np.median(nearest)), 3),
+            'p90': round(float(np.percentile(nearest, 90)), 3),
+            'max': round(float(nearest.max()), 3)
+        }
+    }
+
+
+def build_map(customer_store, butcher_df, map_type):
+    """Folium map of customers (as map_type) with butcher markers"""
+    import folium
+    from folium.plugins import HeatMap
+    from map_layers import bulk_markers, heat_rows
+
+    m = folium.Map(
+        location=[customer_store.mean_lat, customer_store.mean_lon],
+        zoom_start=12,
+        tiles='OpenStreetMap',
+        control_scale=True
+    )
+    if map_type == 'clusters':
+        bulk_markers(customer_store, "Customer ID: ", name="Customers").add_to(m)
+    elif map_type == 'markers':
+        bulk_markers(customer_store, "Customer ID: ", name="Customers", cluster=False).add_to(m)
+    elif map_type == 'heatmap':
+        HeatMap(heat_rows(customer_store), name="Customer Density", radius=15).add_to(m)
+
+    butchers = folium.FeatureGroup(name="Butchers").add_to(m)
+    for name, lat, lon in zip(butcher_labels(butcher_df, 'butcher_name', 'butcher_id'),
+                              butcher_df['latitude'], butcher_df['longitude']):
+        folium.Marker(
+            location=[lat, lon],
+            popup=f"Butcher: {name}",
+            icon=folium.Icon(color='red', icon='cutlery')
+        ).add_to(butchers)
+    folium.LayerControl().add_to(m)
+    return m
+
+
+def save_map_image(image_mode, path, customer_store, butcher_store, butcher_names, radius_km, size,
+                   map_path=None):
+    """Write a map image drawn with static_map, or captured from map_path by this process's browser"""
+    if image_mode == 'browser':
+        _browser(size).export('file://' + os.path.abspath(map_path), path)
+    else:
+        from static_map import render_static_map, save_image
+
+        save_image(render_static_map(customer_store, butcher_store, butcher_names, size, radius_km), path)
+
+
+_EXPORTER = None
+
+
+def _browser(size):
+    """MapExporter kept for the life of this process, so each pool worker starts one browser"""
+    global _EXPORTER
+    if _EXPORTER is None:
+        from map_export import MapExporter
+
+        _EXPORTER = MapExporter(window_size=size)
+        # Pool workers leave through multiprocessing's exit handlers, not atexit
+        util.Finalize(None, _EXPORTER.close, exitpriority=10)
+    return _EXPORTER
+
+
+def run(customers_path, butchers_path, output_dir=OUTPUT_DIR, matrix_format='csv', map_type='clusters',
+        workers=1, radius_km=SERVICE_RADIUS_KM, image_mode='none', image_size=IMAGE_SIZE):
+    """Load both files, compute distances and coverage, write the map and matrix; returns the run summary"""
+    os.makedirs(output_dir, exist_ok=True)
+    timer = StageTimer()
+    summary = {
+        'customers_file': os.path.abspath(customers_path),
+        'butchers_file': os.path.abspath(butchers_path),
+        'output_dir': os.path.abspath(output_dir),
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'stages': timer.stages,
+        'outputs': {},
+        'status': 'failed'
+    }
+    run_start = time.perf_counter()
+    sink = None
+    try:
+        with timer.stage('load_customers') as record:
+            customer_store, counts = load_customers(customers_path)
+            record.update(counts)
+        with timer.stage('load_butchers') as record:
+            butcher_df, butcher_store, counts = load_butchers(butchers_path)
+            record.update(counts)
+
+        with timer.stage('distances') as record:
+            column_labels = [f"Dist to {name} (km)" for name in butcher_labels(butcher_df, 'butcher_name', 'butcher_id')]
+            sink = compute_distances(customer_store, butcher_store, column_labels, temp_sink_path(), workers)
+            record['cells'] = sink.shape[0] * sink.shape[1]
+
+        with timer.stage('insights'):
+            summary['coverage'] = coverage_summary(customer_store, butcher_df, butcher_store, radius_km)
+
+        if map_type != 'none':
+            with timer.stage('map') as record:
+                html = build_map(customer_store, butcher_df, map_type).get_root().render()
+                map_path = os.path.join(output_dir, 'customer_map.html')
+                with open(map_path, 'wb') as f:
+                    f.write(html.encode('utf8'))
+                record['bytes'] = len(html)
+                summary['outputs']['map'] = os.path.abspath(map_path)
+
+        if image_mode != 'none':
+            with timer.stage('image'):
+                image_path = os.path.join(output_dir, 'customer_map.png')
+                save_map_image(
+                    image_mode, image_path, customer_store, butcher_store,
+                    butcher_labels(butcher_df, 'butcher_name', 'butcher_id'), radius_km, image_size,
+                    summary['outputs'].get('map')
+                )
+                summary['outputs']['image'] = os.path.abspath(image_path)
+
+        with timer.stage('export_matrix') as record:
+            matrix_path = os.path.join(output_dir, f"distance_matrix.{matrix_format}")
+            save_distance_matrix(sink, matrix_path, 'Customer ID', DISTANCE_CHUNK_SIZE)
+            record['bytes'] = os.path.getsize(matrix_path)
+            summary['outputs']['distance_matrix'] = os.path.abspath(matrix_path)
+        summary['status'] = 'ok'
+    except Exception as e:
+        summary['error'] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    finally:
+        if sink is not None:
+            sink.discard()
+        summary['total_seconds'] = round(time.perf_counter() - run_start, 3)
+        summary['peak_rss_mb'] = _peak_rss_mb()
+    return summary
+
+
+def load_regions(path):
+    """Regions listed in a .json or .csv file, as dicts with a name and either a bbox or customer_ids
+
+    JSON: a list of {"name": ..., "bbox": [min_lat, min_lon, max_lat, max_lon]} or
+    {"name": ..., "customer_ids": [...]} objects. CSV: one row per region with region,
+    min_lat, min_lon, max_lat and max_lon columns, or region and customer_id columns with
+    a row per customer, grouping customers into regions (e.g. by district or pincode).
+    """
+    if path.endswith('.json'):
+        with open(path) as f:
+            specs = json.load(f)
+        regions = []
+        for spec in specs:
+            if 'bbox' in spec:
+                regions.append({'name': str(spec['name']), 'bbox': tuple(float(v) for v in spec['bbox'])})
+            elif 'customer_ids' in spec:
+                regions.append({'name': str(spec['name']), 'customer_ids': [str(i) for i in spec['customer_ids']]})
+            else:
+                raise ValueError(f"Region {spec.get('name')!r} in {path} has neither a bbox nor customer_ids")
+        return regions
+
+    df = pd.read_csv(path, dtype=str)
+    df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+    if 'region' not in df.columns:
+        raise ValueError(f"Missing column in {path}: region")
+    if 'customer_id' in df.columns:
+        return [
+            {'name': str(name), 'customer_ids': group['customer_id'].str.strip().tolist()}
+            for name, group in df.groupby('region', sort=False)
+        ]
+    bbox_columns = ['min_lat', 'min_lon', 'max_lat', 'max_lon']
+    missing = set(bbox_columns) - set(df.columns)
+    if missing:
+        raise ValueError(f"Missing columns in {path}: {', '.join(sorted(missing))} (or customer_id)")
+    return [
+        {'name': str(row['region']), 'bbox': tuple(float(row[c]) for c in bbox_columns)}
+        for _, row in df.iterrows()
+    ]
+
+
+class RegionSelector:
+    """Rows of a CoordinateStore inside a region's bounding box or matching its customer ids
+
+    The store is sorted by latitude and its ids are indexed once, on first use, so each
+    region costs time in proportion to its own rows rather than to the whole store.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._order = None
+        self._sorted_lat = None
+        self._id_index = None
+
+    def rows(self, region):
+        """(sorted row indices, number of the region's customer ids not found)"""
+        if 'bbox' in region:
+            return self._in_bbox(*region['bbox']), 0
+        return self._with_ids(region['customer_ids'])
+
+    def _in_bbox(self, min_lat, min_lon, max_lat, max_lon):
+        if self._order is None:
+            self._order = np.argsort(self.store.lat, kind='stable')
+            self._sorted_lat = np.asarray(self.store.lat)[self._order]
+        start = np.searchsorted(self._sorted_lat, min_lat, side='left')
+        stop = np.searchsorted(self._sorted_lat, max_lat, side='right')
+        candidates = self._order[start:stop]
+        lon = self.store.lon[candidates]
+        return np.sort(candidates[(lon >= min_lon) & (lon <= max_lon)])
+
+    def _with_ids(self, customer_ids):
+        if self._id_index is None:
+            self._id_index = pd.Index(np.asarray(self.store.ids).astype(str))
+        if self._id_index.is_unique:
+            positions = self._id_index.get_indexer(customer_ids)
+            missing = int((positions < 0).sum())
+        else:
+            positions, not_found = self._id_index.get_indexer_non_unique(customer_ids)
+            missing = len(not_found)
+        return np.unique(positions[positions >= 0]), missing
+
+
+def butchers_near(butcher_df, bbox, radius_km):
+    """Butchers whose service radius reaches into bbox"""
+    min_lat, min_lon, max_lat, max_lon = bbox
+    pad_lat = radius_km / 111
+    pad_lon = radius_km / (111 * max(np.cos(np.radians((min_lat + max_lat) / 2)), 0.01))
+    near = (butcher_df['latitude'].between(min_lat - pad_lat, max_lat + pad_lat)
+            & butcher_df['longitude'].between(min_lon - pad_lon, max_lon + pad_lon))
+    return butcher_df[near].reset_index(drop=True)
+
+
+def _region_slug(name, used):
+    """File name stem for a region, unique among those already used"""
+    slug = re.sub(r'[^\w.-]+', '_', name).strip('._') or 'region'
+    candidate, n = slug, 2
+    while candidate.lower() in used:
+        candidate, n = f"{slug}_{n}", n + 1
+    used.add(candidate.lower())
+    return candidate
+
+
+def _export_region(slug, lat, lon, ids, butcher_df, output_dir, map_type, image_mode, radius_km, image_size):
+    """Pool worker: map page and image of one region; returns its outputs and stage timings"""
+    timer = StageTimer(echo=False)
+    result = {'outputs': {}, 'stages': timer.stages}
+    try:
+        customer_store = CoordinateStore(lat, lon, ids)
+        butcher_store = CoordinateStore.from_frame(butcher_df, 'butcher_id') if len(butcher_df) else None
+        map_path = None
+        if map_type != 'none':
+            with timer.stage('map') as record:
+                html = build_map(customer_store, butcher_df, map_type).get_root().render()
+                map_path = os.path.join(output_dir, f"{slug}.html")
+                with open(map_path, 'wb') as f:
+                    f.write(html.encode('utf8'))
+                record['bytes'] = len(html)
+                result['outputs']['map'] = os.path.abspath(map_path)
+        if image_mode != 'none':
+            with timer.stage('image'):
+                image_path = os.path.join(output_dir, f"{slug}.png")
+                save_map_image(
+                    image_mode, image_path, customer_store, butcher_store,
+                    butcher_labels(butcher_df, 'butcher_name', 'butcher_id'), radius_km, image_size, map_path
+                )
+                result['outputs']['image'] = os.path.abspath(image_path)
+        result['status'] = 'ok'
+    except Exception as e:
+        result['status'] = 'failed'
+        result['error'] = f"{type(e).__name__}: {e}"
+    result['seconds'] = round(sum(stage['seconds'] for stage in timer.stages), 3)
+    return result
+
+
+def run_regions(customers_path, butchers_path, regions_path, output_dir=OUTPUT_DIR, map_type='clusters',
+                image_mode='static', workers=1, radius_km=SERVICE_RADIUS_KM, image_size=IMAGE_SIZE):
+    """Map page and image for every region of regions_path, spread over worker processes; returns the manifest
+
+    Each region gets the customers inside its bounding box (or in its id group) and the
+    butchers whose service radius reaches it. The manifest lists every region in file
+    order with its counts, output files and per-stage timings.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    timer = StageTimer()
+    manifest = {
+        'customers_file': os.path.abspath(customers_path),
+        'butchers_file': os.path.abspath(butchers_path),
+        'regions_file': os.path.abspath(regions_path),
+        'output_dir': os.path.abspath(output_dir),
+        'started': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'stages': timer.stages,
+        'regions': [],
+        'status': 'failed'
+    }
+    run_start = time.perf_counter()
+    try:
+        with timer.stage('load_customers') as record:
+            customer_store, counts = load_customers(customers_path)
+            record.update(counts)
+        with timer.stage('load_butchers') as record:
+            butcher_df, _, counts = load_butchers(butchers_path)
+            record.update(counts)
+        with timer.stage('load_regions') as record:
+            regions = load_regions(regions_path)
+            record['regions'] = len(regions)
+
+        with timer.stage('select') as record:
+            selector = RegionSelector(customer_store)
+            entries, jobs, used = [], [], set()
+            for region in regions:
+                rows, missing = selector.rows(region)
+                entry = {'name': region['name'], 'customers': len(rows)}
+                if 'customer_ids' in region:
+                    entry['missing_ids'] = missing
+                entries.append(entry)
+                if not len(rows):
+                    entry.update(butchers=0, status='empty', outputs={}, stages=[], seconds=0)
+                    continue
+                lat = np.asarray(customer_store.lat[rows])
+                lon = np.asarray(customer_store.lon[rows])
+                bbox = (float(lat.min()), float(lon.min()), float(lat.max()), float(lon.max()))
+                region_butchers = butchers_near(butcher_df, bbox, radius_km)
+                entry['butchers'] = len(region_butchers)
+                jobs.append((entry, (
+                    _region_slug(region['name'], used), lat, lon, np.asarray(customer_store.ids[rows]),
+                    region_butchers, output_dir, map_type, image_mode, radius_km, image_size
+                )))
+            record['regions'] = len(jobs)
+            record['empty'] = len(entries) - len(jobs)
+
+        with timer.stage('render') as record:
+            record['workers'] = min(workers, len(jobs))
+            if workers > 1 and len(jobs) > 1:
+                # spawn rather than fork, as in tiles.build_tile_pyramid
+                with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+                    futures = {pool.submit(_export_region, *args): entry for entry, args in jobs}
+                    for future in as_completed(futures):
+                        futures[future].update(future.result())
+            else:
+                for entry, args in jobs:
+                    entry.update(_export_region(*args))
+
+        manifest['regions'] = entries
+        failed = sum(entry['status'] == 'failed' for entry in entries)
+        manifest['failed_regions'] = failed
+        manifest['status'] = 'ok' if not failed else 'failed'
+    except Exception as e:
+        manifest['error'] = f"{type(e).__name__}: {e}"
+        traceback.print_exc()
+    finally:
+        if _EXPORTER is not None:
+            _EXPORTER.close()
+        manifest['total_seconds'] = round(time.perf_counter() - run_start, 3)
+        manifest['peak_rss_mb'] = _peak_rss_mb()
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Run customer/butcher loading, distances, coverage insights, map and matrix export without the GUI"
+    )
+    parser.add_argument('customers', help="customer file (.csv, .xlsx or .coords)")
+    parser.add_argument('butchers', help="butcher file (.csv or .xlsx)")
+    parser.add_argument('-o', '--output-dir', default=OUTPUT_DIR)
+    parser.add_argument('--matrix-format', choices=MATRIX_FORMATS, default='csv')
+    parser.add_argument('--map-type', choices=MAP_TYPES, default='clusters')
+    parser.add_argument('--workers', type=int, default=1, help="processes for the distance matrix or for rendering regions")
+    parser.add_argument('--radius-km', type=float, default=SERVICE_RADIUS_KM, help="butcher service radius")
+    parser.add_argument('--regions', help="region file (.json or .csv): write a map and image per region "
+                                          "instead of the distance run, with a manifest of timings")
+    parser.add_argument('--image', choices=IMAGE_MODES,
+                        help="map image drawn directly or captured by a headless browser "
+                             "(default: static with --regions, none otherwise)")
+    parser.add_argument('--image-size', type=int, nargs=2, default=IMAGE_SIZE, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--summary', help="where to write the timing summary "
+                                          "(default: <output-dir>/summary.json, or manifest.json with --regions)")
+    args = parser.parse_args(argv)
+    image_mode = args.image or ('static' if args.regions else 'none')
+    if image_mode == 'browser' and args.map_type == 'none':
+        parser.error("--image browser captures the map page, so it needs a --map-type other than none")
+
+    if args.regions:
+        summary = run_regions(args.customers, args.butchers, args.regions, args.output_dir, args.map_type,
+                              image_mode, args.workers, args.radius_km, tuple(args.image_size))
+    else:
+        summary = run(args.customers, args.butchers, args.output_dir, args.matrix_format, args.map_type,
+                      args.workers, args.radius_km, image_mode, tuple(args.image_size))
+    summary_path = args.summary or os.path.join(args.output_dir, 'manifest.json' if args.regions else 'summary.json')
+    with open(summary_path, 'w') as f:
+        json.dump(summary, f, indent=2)
+    print(json.dumps(summary))
+    return 0 if summary['status'] == 'ok' else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
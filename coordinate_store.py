@@ -0,0 +1,221 @@
+import hashlib
+import os
+import sys
+from functools import cached_property
+
+import numpy as np
+
+
+class CoordinateStore:
+    """Contiguous float64 coordinate arrays with the derived values every distance path needs
+
+    Built once when a dataset is loaded, so radians, sin/cos of latitude and the bounding
+    box are not recomputed per pair or per insight. The derived arrays are computed on
+    first use.
+    """
+
+    def __init__(self, lat, lon, ids):
+        # Memory-mapped stores derive radians per block instead of caching full arrays
+        self.mapped = isinstance(lat, np.memmap)
+        if self.mapped:
+            self.lat, self.lon = lat, lon
+        else:
+            self.lat = np.ascontiguousarray(lat, dtype=np.float64)
+            self.lon = np.ascontiguousarray(lon, dtype=np.float64)
+        self.ids = id_array(ids)
+
+        # Bounding box and centre
+        self.min_lat = float(self.lat.min())
+        self.max_lat = float(self.lat.max())
+        self.min_lon = float(self.lon.min())
+        self.max_lon = float(self.lon.max())
+        self.mean_lat = float(self.lat.mean())
+        self.mean_lon = float(self.lon.mean())
+        self.cos_mid_lat = float(np.cos(np.radians((self.min_lat + self.max_lat) / 2)))
+
+    @cached_property
+    def lat_rad(self):
+        return np.radians(self.lat)
+
+    @cached_property
+    def lon_rad(self):
+        return np.radians(self.lon)
+
+    @cached_property
+    def sin_lat(self):
+        return np.sin(self.lat_rad)
+
+    @cached_property
+    def cos_lat(self):
+        return np.cos(self.lat_rad)
+
+    def radians_block(self, start=0, stop=None):
+        """(lat_rad, lon_rad, cos_lat) for rows start:stop
+
+        Served from the cached arrays for in-memory stores; computed for just the block
+        on mapped stores so the full derived arrays are never resident.
+        """
+        if self.mapped:
+            lat_rad = np.radians(self.lat[start:stop])
+            return lat_rad, np.radians(self.lon[start:stop]), np.cos(lat_rad)
+        rows = slice(start, stop)
+        return self.lat_rad[rows], self.lon_rad[rows], self.cos_lat[rows]
+
+    @classmethod
+    def from_frame(cls, df, id_col, lat_col='latitude', lon_col='longitude'):
+        """Build a store from a DataFrame with latitude/longitude columns"""
+        return cls(df[lat_col].to_numpy(), df[lon_col].to_numpy(), df[id_col].to_numpy())
+
+    def __len__(self):
+        return len(self.lat)
+
+    @property
+    def bbox(self):
+        """(min_lat, min_lon, max_lat, max_lon)"""
+        return self.min_lat, self.min_lon, self.max_lat, self.max_lon
+
+    @property
+    def lat_range(self):
+        return self.max_lat - self.min_lat
+
+    @property
+    def lon_range(self):
+        return self.max_lon - self.min_lon
+
+    def span_km(self, km_per_degree=111):
+        """Approximate north-south and east-west extent of the bounding box in km"""
+        return self.lat_range * km_per_degree, self.lon_range * km_per_degree * self.cos_mid_lat
+
+    def area_km2(self, km_per_degree=111):
+        """Approximate bounding box area in square kilometers"""
+        lat_span, lon_span = self.span_km(km_per_degree)
+        return abs(lat_span * lon_span)
+
+    def running_stats(self, chunk_size=100000):
+        """RunningCoordinateStats (counts, bbox, centroid, histograms) computed block by block"""
+        from ingest import RunningCoordinateStats
+
+        stats = RunningCoordinateStats()
+        for start in range(0, len(self), chunk_size):
+            stats.update(self.lat[start:start + chunk_size], self.lon[start:start + chunk_size])
+        return stats
+
+    @cached_property
+    def fingerprint(self):
+        """Content hash of the coordinates and ids, used to key caches of things derived from them"""
+        digest = hashlib.blake2b(digest_size=20)
+        digest.update(np.ascontiguousarray(self.lat, dtype='<f8'))
+        digest.update(np.ascontiguousarray(self.lon, dtype='<f8'))
+        if isinstance(self.ids, MappedIds):
+            digest.update(np.ascontiguousarray(self.ids._offsets))
+            digest.update(self.ids._blob)
+        else:
+            digest.update('\x1f'.join(map(str, self.ids.tolist())).encode('utf-8'))
+        return digest.hexdigest()
+
+    def to_frame(self, id_col, lat_col='latitude', lon_col='longitude'):
+        """DataFrame with id/latitude/longitude columns, for code paths that still need one"""
+        import pandas as pd
+
+        return pd.DataFrame({id_col: np.asarray(self.ids), lat_col: self.lat, lon_col: self.lon})
+
+
+# Binary coordinate files (.coords)
+#
+# Layout, all little-endian:
+#   header   magic (8 bytes), version uint32, reserved uint32, count uint64, id blob size uint64
+#   lat      float64[count]
+#   lon      float64[count]
+#   offsets  uint64[count + 1], byte offsets of each id inside the blob
+#   ids      UTF-8 id blob
+COORDS_MAGIC = b'CRDSTORE'
+COORDS_VERSION = 1
+_HEADER_DTYPE = np.dtype([
+    ('magic', 'S8'), ('version', '<u4'), ('reserved', '<u4'), ('count', '<u8'), ('id_bytes', '<u8')
+])
+
+
+class MappedIds:
+    """Read-only view of the ids stored in a coordinate file, decoded on access"""
+
+    def __init__(self, offsets, blob):
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _decode(self, i):
+        return bytes(self._blob[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return np.array([self._decode(i) for i in range(*key.indices(len(self)))], dtype=object)
+        if np.ndim(key):
+            return np.array([self._decode(i) for i in np.asarray(key).ravel()], dtype=object).reshape(np.shape(key))
+        return self._decode(int(key))
+
+    def __array__(self, dtype=None, copy=None):
+        return self[:] if dtype is None else self[:].astype(dtype)
+
+
+def id_array(ids):
+    """ids as an array, except MappedIds, which stay mapped and decode only the rows asked for"""
+    return ids if isinstance(ids, MappedIds) else np.asarray(ids)
+
+
+def write_coordinate_file(path, lat, lon, ids):
+    """Write coordinates and ids in the fixed-width binary layout read by open_coordinate_file"""
+    lat = np.ascontiguousarray(lat, dtype='<f8')
+    lon = np.ascontiguousarray(lon, dtype='<f8')
+    encoded = [str(i).encode('utf-8') for i in ids]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+
+    header = np.zeros(1, dtype=_HEADER_DTYPE)
+    header[0] = (COORDS_MAGIC, COORDS_VERSION, 0, len(lat), int(offsets[-1]))
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        f.write(lat.tobytes())
+        f.write(lon.tobytes())
+        f.write(offsets.tobytes())
+        f.write(b''.join(encoded))
+
+
+def open_coordinate_file(path):
+    """Open a .coords file as a CoordinateStore backed by numpy.memmap (zero copy)"""
+    header = np.fromfile(path, dtype=_HEADER_DTYPE, count=1)[0]
+    if header['magic'] != COORDS_MAGIC or header['version'] != COORDS_VERSION:
+        raise ValueError(f"{os.path.basename(path)} is not a coordinate file")
+
+    count = int(header['count'])
+    offset = _HEADER_DTYPE.itemsize
+    lat = np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(count,))
+    offset += 8 * count
+    lon = np.memmap(path, dtype='<f8', mode='r', offset=offset, shape=(count,))
+    offset += 8 * count
+    offsets = np.memmap(path, dtype='<u8', mode='r', offset=offset, shape=(count + 1,))
+    offset += 8 * (count + 1)
+    blob = np.memmap(path, dtype=np.uint8, mode='r', offset=offset, shape=(int(header['id_bytes']),))
+    return CoordinateStore(lat, lon, MappedIds(offsets, blob))
+
+
+def convert_to_coordinate_file(source, path, id_col='customer_id'):
+    """Clean a customer CSV/Excel file once and save it as a .coords file"""
+    from ingest import ingest_csv, ingest_excel
+
+    columns = [id_col, 'latitude', 'longitude']
+    if source.endswith('.csv'):
+        df, stats = ingest_csv(source, columns)
+    else:
+        df, stats = ingest_excel(source, columns)
+    write_coordinate_file(path, df['latitude'].to_numpy(), df['longitude'].to_numpy(), df[id_col])
+    return stats
+
+
+if __name__ == "__main__":
+    if len(sys.argv) != 3:
+        print("Usage: python coordinate_store.py <customers.csv|.xlsx> <output.coords>")
+        sys.exit(1)
+    stats = convert_to_coordinate_file(sys.argv[1], sys.argv[2])
+    print(f"Wrote {stats.count} customers to {sys.argv[2]} ({stats.rows_read - stats.count} invalid rows dropped)")
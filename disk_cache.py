@@ -0,0 +1,59 @@
+import os
+import shutil
+
+
+def entry_size(path):
+    """Bytes on disk of a cache entry: a single file, or every file under a directory"""
+    if not os.path.isdir(path):
+        return os.stat(path).st_size
+    total = 0
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.stat(os.path.join(dirpath, name)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def evict_lru(directory, max_bytes, suffix=None, keep=()):
+    """Delete least recently used entries of directory until it fits in max_bytes
+
+    Entries are the files whose names end in suffix or, with suffix None, the
+    subdirectories, each counted whole. Recency is the entry's modification time, so
+    caches refresh it (os.utime) on every hit. Paths in keep are never deleted. Entries
+    another process removes meanwhile are skipped, as are entries that cannot be deleted
+    yet, such as files still open on Windows; a later eviction retries them.
+    """
+    keep = {os.path.abspath(path) for path in keep}
+    entries = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for name in names:
+        entry = os.path.join(directory, name)
+        if suffix is None and not os.path.isdir(entry):
+            continue
+        if suffix is not None and not name.endswith(suffix):
+            continue
+        try:
+            entries.append((os.stat(entry).st_mtime, entry_size(entry), entry))
+        except FileNotFoundError:
+            continue
+    total = sum(size for _, size, _ in entries)
+    for _, size, entry in sorted(entries):
+        if total <= max_bytes:
+            break
+        if os.path.abspath(entry) in keep:
+            continue
+        try:
+            if os.path.isdir(entry):
+                shutil.rmtree(entry)
+            else:
+                os.remove(entry)
+        except FileNotFoundError:
+            pass
+        except OSError:
+            continue
+        total -= size
@@ -0,0 +1,462 @@
+import os
+import tempfile
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from multiprocessing import get_context
+import numpy as np
+import pandas as pd
+
+from coordinate_store import id_array
+
+# Constants
+EARTH_RADIUS_KM = 6371
+
+
+def haversine_matrix(lat1, lon1, lat2, lon2):
+    """Great circle distances in km between every point of set 1 and every point of set 2
+
+    Coordinates are given in degrees. Returns an array of shape (len(lat1), len(lat2))
+    computed in a single broadcast operation, using the same formula as the scalar
+    haversine helpers in the map apps.
+    """
+    lat1 = np.radians(np.asarray(lat1, dtype=np.float64)).reshape(-1, 1)
+    lon1 = np.radians(np.asarray(lon1, dtype=np.float64)).reshape(-1, 1)
+    lat2 = np.radians(np.asarray(lat2, dtype=np.float64)).reshape(1, -1)
+    lon2 = np.radians(np.asarray(lon2, dtype=np.float64)).reshape(1, -1)
+
+    return _haversine_rad(lat1, lon1, np.cos(lat1), lat2, lon2, np.cos(lat2))
+
+
+def _haversine_rad(lat1, lon1, cos_lat1, lat2, lon2, cos_lat2):
+    """Haversine formula on broadcastable radian arrays with cos(latitude) supplied by the caller"""
+    dlat = lat2 - lat1
+    dlon = lon2 - lon1
+
+    a = np.sin(dlat/2)**2 + cos_lat1 * cos_lat2 * np.sin(dlon/2)**2
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1-a))
+
+    return EARTH_RADIUS_KM * c
+
+
+def store_distance_matrix(store1, store2, start=0, stop=None):
+    """Distances between rows start:stop of store1 and every point of store2
+
+    Uses the radians and cos(latitude) cached on the CoordinateStores instead of
+    converting coordinates again.
+    """
+    lat1, lon1, cos_lat1 = store1.radians_block(start, stop)
+    lat2, lon2, cos_lat2 = store2.radians_block()
+    return _haversine_rad(
+        lat1[:, None], lon1[:, None], cos_lat1[:, None],
+        lat2[None, :], lon2[None, :], cos_lat2[None, :]
+    )
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    """Calculate the great circle distance between two points in kilometers"""
+    return float(haversine_matrix(lat1, lon1, lat2, lon2)[0, 0])
+
+
+def butcher_labels(butcher_df, name_col, id_col):
+    """Label for each butcher: its name when the column exists, otherwise its id"""
+    if name_col in butcher_df.columns:
+        return list(butcher_df[name_col])
+    return list(butcher_df[id_col])
+
+
+def _unique_columns(column_labels):
+    """(labels, column indices) with each label once"""
+    # Duplicate labels keep the last butcher's distances, like the old per-row dict did
+    columns = {}
+    for col_idx, label in enumerate(column_labels):
+        columns[label] = col_idx
+    return list(columns.keys()), list(columns.values())
+
+
+def distance_frame(customer_ids, id_header, column_labels, distances, decimals=2):
+    """Build the customer x butcher distance table used by the map apps"""
+    labels, indices = _unique_columns(column_labels)
+    values = np.round(distances[:, indices], decimals)
+
+    df = pd.DataFrame(values, columns=labels)
+    df.insert(0, id_header, list(customer_ids))
+    return df
+
+
+# Blocked (bounded-memory) computation
+DEFAULT_CHUNK_SIZE = 50000
+DISTANCE_BLOCK_THRESHOLD = 5_000_000  # Matrix cells above which the apps compute distances in blocks on disk
+
+
+def iter_distance_blocks(lat1, lon1, lat2, lon2, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield (start, block) pairs of the distance matrix, chunk_size rows of set 1 at a time"""
+    lat1 = np.asarray(lat1, dtype=np.float64)
+    lon1 = np.asarray(lon1, dtype=np.float64)
+    for start in range(0, len(lat1), chunk_size):
+        stop = start + chunk_size
+        yield start, haversine_matrix(lat1[start:stop], lon1[start:stop], lat2, lon2)
+
+
+def iter_store_blocks(store1, store2, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Like iter_distance_blocks, but over two CoordinateStores"""
+    for start in range(0, len(store1), chunk_size):
+        yield start, store_distance_matrix(store1, store2, start, start + chunk_size)
+
+
+class NpyDistanceSink:
+    """Distance matrix stored in a .npy file, written block by block through a memory map"""
+
+    def __init__(self, path, row_ids, column_labels):
+        self.path = path
+        self.row_ids = id_array(row_ids)
+        self.column_labels = list(column_labels)
+        self.shape = (len(self.row_ids), len(self.column_labels))
+        self._array = np.lib.format.open_memmap(path, mode='w+', dtype=np.float64, shape=self.shape)
+        self._reader = None
+
+    def write(self, start, block):
+        self._array[start:start + len(block)] = block
+
+    def close(self):
+        if self._array is not None:
+            self._array.flush()
+            self._array = None
+
+    def discard(self):
+        """Close the sink and delete its file"""
+        self.close()
+        self._reader = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def iter_blocks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        matrix = np.load(self.path, mmap_mode='r')
+        for start in range(0, self.shape[0], chunk_size):
+            yield start, np.asarray(matrix[start:start + chunk_size])
+
+    def read_rows(self, start, stop):
+        """Rows start:stop of the finished matrix, read straight from the memory map"""
+        if self._reader is None:
+            self._reader = np.load(self.path, mmap_mode='r')
+        return np.asarray(self._reader[start:stop])
+
+
+class ParquetDistanceSink:
+    """Distance matrix stored as a Parquet file, one row group per block"""
+
+    def __init__(self, path, row_ids, column_labels):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self.path = path
+        self.row_ids = id_array(row_ids)
+        self.column_labels = list(column_labels)
+        self.shape = (len(self.row_ids), len(self.column_labels))
+        # Labels may repeat or be non-strings, so the file uses positional column names
+        self._schema = pa.schema([(str(i), pa.float64()) for i in range(self.shape[1])])
+        self._writer = pq.ParquetWriter(path, self._schema)
+        self._reader = None
+        self._group_starts = None
+
+    def write(self, start, block):
+        import pyarrow as pa
+
+        table = pa.Table.from_arrays([block[:, i] for i in range(block.shape[1])], schema=self._schema)
+        self._writer.write_table(table)
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+
+    def discard(self):
+        """Close the sink and delete its file"""
+        self.close()
+        self._reader = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+    def iter_blocks(self, chunk_size=DEFAULT_CHUNK_SIZE):
+        import pyarrow.parquet as pq
+
+        start = 0
+        for batch in pq.ParquetFile(self.path).iter_batches(batch_size=chunk_size):
+            block = np.column_stack([col.to_numpy() for col in batch.columns])
+            yield start, block
+            start += len(block)
+
+    def read_rows(self, start, stop):
+        """Rows start:stop of the finished matrix, reading only the row groups that overlap them"""
+        import pyarrow.parquet as pq
+
+        if self._reader is None:
+            self._reader = pq.ParquetFile(self.path)
+            sizes = [self._reader.metadata.row_group(i).num_rows for i in range(self._reader.num_row_groups)]
+            self._group_starts = np.concatenate([[0], np.cumsum(sizes)])
+        stop = min(stop, self.shape[0])
+        if stop <= start:
+            return np.empty((0, self.shape[1]))
+        first = int(np.searchsorted(self._group_starts, start, side='right')) - 1
+        last = int(np.searchsorted(self._group_starts, stop, side='left'))
+        table = self._reader.read_row_groups(list(range(first, last)))
+        block = np.column_stack([col.to_numpy() for col in table.columns])
+        offset = start - self._group_starts[first]
+        return block[offset:offset + stop - start]
+
+
+def open_distance_sink(path, row_ids, column_labels):
+    """Open a distance sink, choosing the format from the file extension"""
+    if path.endswith('.parquet'):
+        return ParquetDistanceSink(path, row_ids, column_labels)
+    return NpyDistanceSink(path, row_ids, column_labels)
+
+
+def temp_sink_path(suffix='.npy'):
+    """Reserve a temporary file for a distance sink"""
+    fd, path = tempfile.mkstemp(prefix="distance_matrix_", suffix=suffix)
+    os.close(fd)
+    return path
+
+
+def write_distance_matrix(blocks, sink, decimals=2):
+    """Write (start, block) distance blocks straight into sink, keeping peak memory flat"""
+    try:
+        for start, block in blocks:
+            sink.write(start, np.round(block, decimals))
+    finally:
+        sink.close()
+    return sink
+
+
+# Multi-process computation
+DISTANCE_WORKERS_ENV = 'DISTANCE_WORKERS'
+PARALLEL_MIN_CELLS = 50_000_000  # Below this, starting worker processes costs more than the matrix itself
+PARALLEL_JOBS_PER_WORKER = 2  # Row ranges queued per worker, bounding what waits in the parent
+
+
+def distance_workers():
+    """Worker processes for large distance matrices, from the DISTANCE_WORKERS environment variable
+
+    Read when a matrix is computed rather than at import, so a bad value fails that
+    calculation with a clear message instead of stopping the app from starting.
+    Unset means 1 (single process); 'auto' means one per CPU.
+    """
+    value = os.environ.get(DISTANCE_WORKERS_ENV, '').strip()
+    if not value:
+        return 1
+    if value.lower() == 'auto':
+        return os.cpu_count() or 1
+    try:
+        workers = int(value)
+    except ValueError:
+        workers = 0
+    if workers < 1:
+        raise ValueError(f"{DISTANCE_WORKERS_ENV} must be a positive whole number or 'auto', not {value!r}")
+    return workers
+
+
+def _write_rows(path, coords1, coords2, start, decimals):
+    """Worker: compute one row range of the matrix and write it into the .npy file at path"""
+    lat1, lon1, cos_lat1 = coords1
+    lat2, lon2, cos_lat2 = coords2
+    block = _haversine_rad(
+        lat1[:, None], lon1[:, None], cos_lat1[:, None],
+        lat2[None, :], lon2[None, :], cos_lat2[None, :]
+    )
+    matrix = np.load(path, mmap_mode='r+')
+    matrix[start:start + len(block)] = np.round(block, decimals)
+    matrix.flush()
+    return len(block)
+
+
+def parallel_write_distance_matrix(store1, store2, sink, workers, chunk_size=DEFAULT_CHUNK_SIZE, decimals=2,
+                                   progress=None):
+    """write_distance_matrix for store1 x store2, with row ranges computed by a process pool
+
+    Each worker computes chunk_size rows and writes them into the sink's .npy file
+    through its own memory map, so only the coordinates of those rows travel between
+    processes and nothing is gathered in the parent. Every element goes through the
+    same _haversine_rad expression and rounding, so the file is bit-identical to the
+    single-process one. progress, if given, is called in the parent as
+    progress(rows_done, rows_total) after each range; an exception it raises cancels
+    the remaining ranges. The sink is closed on return.
+    """
+    n1 = len(store1)
+    coords2 = store2.radians_block()
+    ranges = iter(range(0, n1, chunk_size))
+    done = 0
+    try:
+        # spawn rather than fork: the GUI apps call this from a worker thread of a Tk process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+            pending = set()
+            try:
+                while True:
+                    # Keep a few ranges queued per worker; building them all up front would hold
+                    # the radians of every row in the parent at once
+                    for start in ranges:
+                        coords1 = store1.radians_block(start, start + chunk_size)
+                        pending.add(pool.submit(_write_rows, sink.path, coords1, coords2, start, decimals))
+                        if len(pending) >= workers * PARALLEL_JOBS_PER_WORKER:
+                            break
+                    if not pending:
+                        break
+                    finished, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        done += future.result()
+                        if progress is not None:
+                            progress(done, n1)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+    finally:
+        sink.close()
+    return sink
+
+
+def fill_distance_sink(store1, store2, sink, workers=1, chunk_size=DEFAULT_CHUNK_SIZE, decimals=2, progress=None):
+    """Compute the store1 x store2 matrix into sink, across worker processes when that pays off
+
+    Matrices of at least PARALLEL_MIN_CELLS cells bound for an .npy sink are split across
+    workers processes; smaller ones, and Parquet sinks (whose row groups are written in
+    order), are computed block by block in this process. progress is called as
+    progress(rows_done, rows_total) either way.
+    """
+    n1 = len(store1)
+    if workers > 1 and isinstance(sink, NpyDistanceSink) and n1 * len(store2) >= PARALLEL_MIN_CELLS:
+        return parallel_write_distance_matrix(store1, store2, sink, workers, chunk_size, decimals, progress)
+
+    def blocks():
+        for start, block in iter_store_blocks(store1, store2, chunk_size):
+            yield start, block
+            if progress is not None:
+                progress(min(start + len(block), n1), n1)
+
+    return write_distance_matrix(blocks(), sink, decimals)
+
+
+def read_distance_frame(sink, id_header, start=0, stop=None):
+    """Materialize rows [start, stop) of a finished sink as a distance table"""
+    stop = sink.shape[0] if stop is None else min(stop, sink.shape[0])
+    return distance_frame(sink.row_ids[start:stop], id_header, sink.column_labels, sink.read_rows(start, stop))
+
+
+# Matrix export
+MATRIX_EXPORT_FORMATS = {'.csv': 'csv', '.parquet': 'parquet', '.feather': 'feather', '.arrow': 'feather', '.xlsx': 'xlsx'}
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMNS = 16384
+
+
+def matrix_export_format(path):
+    """Export format for a file name, from its extension"""
+    matrix_format = MATRIX_EXPORT_FORMATS.get(os.path.splitext(path)[1].lower())
+    if matrix_format is None:
+        raise ValueError(
+            f"Unsupported distance matrix file type: {os.path.basename(path)} "
+            f"(use {', '.join(MATRIX_EXPORT_FORMATS)})"
+        )
+    return matrix_format
+
+
+def _matrix_blocks(matrix, chunk_size):
+    """(row ids, column labels, (start, block) iterator) of a finished sink or a distance table"""
+    if isinstance(matrix, pd.DataFrame):
+        values = matrix.iloc[:, 1:].to_numpy(dtype=np.float64)
+        blocks = ((start, values[start:start + chunk_size]) for start in range(0, len(values), chunk_size))
+        return matrix.iloc[:, 0].to_numpy(), list(matrix.columns[1:]), blocks
+    return matrix.row_ids, matrix.column_labels, matrix.iter_blocks(chunk_size)
+
+
+def _arrow_ids(ids):
+    import pyarrow as pa
+
+    ids = np.asarray(ids)
+    return pa.array(ids if ids.dtype.kind in 'iuf' else ids.astype(str))
+
+
+def _write_arrow(path, matrix_format, id_header, row_ids, labels, indices, blocks):
+    """Stream blocks into a CSV, Parquet or Feather (Arrow IPC) file, one record batch per block"""
+    import pyarrow as pa
+
+    schema = pa.schema(
+        [(str(id_header), _arrow_ids(row_ids[:0]).type)] + [(str(label), pa.float64()) for label in labels]
+    )
+    if matrix_format == 'parquet':
+        import pyarrow.parquet as pq
+
+        writer = pq.ParquetWriter(path, schema)
+    elif matrix_format == 'feather':
+        writer = pa.ipc.new_file(path, schema)
+    else:
+        import pyarrow.csv as pc
+
+        writer = pc.CSVWriter(path, schema, write_options=pc.WriteOptions(quoting_style='needed'))
+    try:
+        for start, block in blocks:
+            columns = np.ascontiguousarray(block[:, indices].T)
+            writer.write_batch(pa.RecordBatch.from_arrays(
+                [_arrow_ids(row_ids[start:start + len(block)])] + [pa.array(column) for column in columns],
+                schema=schema
+            ))
+    finally:
+        writer.close()
+
+
+def _write_excel(path, id_header, row_ids, labels, indices, blocks):
+    """Write an .xlsx sheet row by row, never holding more than one block in memory"""
+    if len(row_ids) + 1 > EXCEL_MAX_ROWS or len(labels) + 1 > EXCEL_MAX_COLUMNS:
+        raise ValueError(
+            f"{len(row_ids):,} rows x {len(labels):,} columns is beyond Excel's "
+            f"{EXCEL_MAX_ROWS:,} x {EXCEL_MAX_COLUMNS:,} sheet limit; export as .parquet, .feather or .csv instead"
+        )
+    header = [str(id_header)] + [str(label) for label in labels]
+    try:
+        import xlsxwriter
+    except ImportError:
+        xlsxwriter = None
+
+    if xlsxwriter is not None:
+        # constant_memory flushes each row to disk once the next one starts
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        sheet = workbook.add_worksheet()
+        sheet.write_row(0, 0, header)
+        for start, block in blocks:
+            ids = np.asarray(row_ids[start:start + len(block)]).tolist()
+            for row, (row_id, values) in enumerate(zip(ids, block[:, indices].tolist()), start + 1):
+                sheet.write(row, 0, row_id)
+                sheet.write_row(row, 1, values)
+        workbook.close()
+    else:
+        from openpyxl import Workbook
+
+        # Write-only workbooks stream rows out instead of keeping a cell object per value
+        workbook = Workbook(write_only=True)
+        sheet = workbook.create_sheet('Sheet1')
+        sheet.append(header)
+        for start, block in blocks:
+            ids = np.asarray(row_ids[start:start + len(block)]).tolist()
+            for row_id, values in zip(ids, block[:, indices].tolist()):
+                sheet.append([row_id] + values)
+        workbook.save(path)
+
+
+def save_distance_matrix(matrix, path, id_header, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Export a finished sink or a distance table to path, in the format of its extension
+
+    CSV, Parquet and Feather (.feather/.arrow) are written through Arrow one block at a
+    time, so a blocked matrix is never materialized. Excel is the slow path: it is
+    written row by row in a constant-memory mode and refused beyond Excel's sheet size.
+    A sink's ids go in an id_header column; a table keeps its own first column.
+    """
+    matrix_format = matrix_export_format(path)
+    row_ids, column_labels, blocks = _matrix_blocks(matrix, chunk_size)
+    if isinstance(matrix, pd.DataFrame):
+        id_header = matrix.columns[0]
+    labels, indices = _unique_columns(column_labels)
+    if matrix_format == 'xlsx':
+        _write_excel(path, id_header, row_ids, labels, indices, blocks)
+    else:
+        _write_arrow(path, matrix_format, id_header, row_ids, labels, indices, blocks)
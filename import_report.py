@@ -0,0 +1,56 @@
+import subprocess
+import sys
+from collections import defaultdict
+
+# Heavy dependencies the apps load on first use rather than at startup
+DEFERRED = ('folium', 'branca', 'matplotlib', 'PIL', 'sklearn', 'scipy', 'html2image', 'tkinterhtml', 'selenium')
+REPORT_ROWS = 12
+
+
+def import_costs(module):
+    """Seconds spent importing each top-level package when module is imported in a fresh interpreter
+
+    Uses python -X importtime and sums the self time of every submodule under its
+    top-level package, so each dependency is charged only for its own code and not for
+    the packages it pulls in. Returns a dict of package -> seconds.
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+        capture_output=True, text=True
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr.strip().splitlines()[-1]}")
+
+    costs = defaultdict(float)
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_us, _, name = line[len('import time:'):].split('|')
+        costs[name.strip().split('.')[0]] += int(self_us) / 1e6
+    return dict(costs)
+
+
+def format_report(module, costs, rows=REPORT_ROWS):
+    total = sum(costs.values())
+    ranked = sorted(costs.items(), key=lambda item: item[1], reverse=True)
+    lines = [f"{module}: {total:.2f} s of imports at startup"]
+    for package, seconds in ranked[:rows]:
+        lines.append(f"  {package:<24} {seconds:6.3f} s  {100 * seconds / total:5.1f}%")
+    rest = sum(seconds for _, seconds in ranked[rows:])
+    if rest:
+        lines.append(f"  {'(other)':<24} {rest:6.3f} s  {100 * rest / total:5.1f}%")
+    loaded = [package for package in DEFERRED if package in costs]
+    deferred = [package for package in DEFERRED if package not in costs]
+    if loaded:
+        lines.append(f"  Loaded at startup: {', '.join(loaded)}")
+    if deferred:
+        lines.append(f"  Deferred until first use: {', '.join(deferred)}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    modules = sys.argv[1:] or ['map_v3', 'map_v4', 'map_v5']
+    for name in modules:
+        print(format_report(name, import_costs(name)))
+        print()
@@ -0,0 +1,451 @@
+import hashlib
+import json
+import os
+import re
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_numeric_dtype
+
+from disk_cache import evict_lru
+
+# Rejection reasons reported by clean_coordinates, indexed by reason code (0 = valid)
+REJECT_REASONS = ('valid', 'missing', 'error', 'non_numeric')
+VALID, MISSING, ERROR, NON_NUMERIC = range(len(REJECT_REASONS))
+
+
+def parse_coordinates(values):
+    """Vectorized coordinate conversion for a whole column
+
+    Same rules as the old per-cell safe_convert: strings have '%' and ',' removed and
+    are stripped before conversion, anything unparseable becomes NaN. Returns the float
+    Series and an int8 array of reason codes (see REJECT_REASONS).
+    """
+    series = pd.Series(values)
+    missing = series.isna().to_numpy().copy()
+
+    if is_numeric_dtype(series):
+        numeric = series.astype(np.float64)
+        error = np.zeros(len(series), dtype=bool)
+    else:
+        text = series.astype(str).str.replace('%', '', regex=False).str.replace(',', '', regex=False).str.strip()
+        numeric = pd.to_numeric(text, errors='coerce').astype(np.float64)
+        numeric[missing] = np.nan
+        missing |= (text == '').to_numpy()
+        # Spreadsheet/geocoder failures such as the "Error Error" rows in lat long.txt
+        error = text.str.contains('error', case=False, regex=False).to_numpy() & ~missing
+
+    unparsed = numeric.isna().to_numpy()
+    reasons = np.select(
+        [missing, error, unparsed],
+        [MISSING, ERROR, NON_NUMERIC],
+        default=VALID
+    ).astype(np.int8)
+    return numeric, reasons
+
+
+def clean_coordinates(df, lat_col='latitude', lon_col='longitude'):
+    """Convert the coordinate columns to float and drop rows that fail to parse
+
+    Returns the cleaned frame and a dict of rejected row counts per reason. A row
+    rejected for both coordinates is counted once, under its latitude reason.
+    """
+    lat, lat_reasons = parse_coordinates(df[lat_col])
+    lon, lon_reasons = parse_coordinates(df[lon_col])
+    reasons = np.where(lat_reasons != VALID, lat_reasons, lon_reasons)
+
+    df = df.assign(**{lat_col: lat.to_numpy(), lon_col: lon.to_numpy()})
+    counts = np.bincount(reasons, minlength=len(REJECT_REASONS))
+    rejected = {
+        REJECT_REASONS[code]: int(counts[code])
+        for code in range(1, len(REJECT_REASONS)) if counts[code]
+    }
+    return df[reasons == VALID], rejected
+
+
+# Offline coordinate back-fill
+URL_COLUMN = 'Expanded URL'
+
+# Google Maps links carry exact coordinates; the separators may be percent-encoded once
+# or twice when the link was wrapped in a redirect such as google.com/sorry?continue=...
+_BANG = r'(?:!|%21|%2521)'
+_EQUALS = r'(?:=|%3D|%253D)'
+_COMMA = r'(?:,|%2C|%252C)'
+_QUERY_START = r'(?:[?&]|%3F|%26|%253F|%2526)'
+_LAT = r'([-+]?\d{1,2}(?:\.\d+)?)'
+_LON = r'([-+]?\d{1,3}(?:\.\d+)?)'
+URL_COORDINATE_PATTERNS = (
+    # Place pin: .../data=!4m6!3m5!...!3d<lat>!4d<lon>
+    re.compile(_BANG + '3d' + _LAT + _BANG + '4d' + _LON, re.IGNORECASE),
+    # Shared location: maps.google.com/?q=<lat>,<lon> (or ll=)
+    re.compile(_QUERY_START + '(?:q|ll)' + _EQUALS + _LAT + _COMMA + r'(?:\+|%20|%2B)?' + _LON, re.IGNORECASE),
+)
+# "lat, lon" pasted into a single cell
+_PAIR_PATTERN = re.compile(r'^\s*' + _LAT + r'\s*[,;\s]\s*' + _LON + r'\s*$')
+
+
+def _extract_pairs(text, patterns):
+    """First (lat, lon) match per row over the given compiled patterns, NaN where none match"""
+    text = pd.Series(text, dtype=object).fillna('').astype(str)
+    lat = pd.Series(np.nan, index=text.index)
+    lon = pd.Series(np.nan, index=text.index)
+    for pattern in patterns:
+        todo = lat.isna().to_numpy()
+        if not todo.any():
+            break
+        found = text[todo].str.extract(pattern)
+        lat[todo] = pd.to_numeric(found[0], errors='coerce')
+        lon[todo] = pd.to_numeric(found[1], errors='coerce')
+
+    valid = lat.between(-90, 90) & lon.between(-180, 180)
+    return lat.where(valid), lon.where(valid)
+
+
+def extract_url_coordinates(urls):
+    """Vectorized extraction of (lat, lon) Series from a column of Google Maps URLs, without network access"""
+    return _extract_pairs(urls, URL_COORDINATE_PATTERNS)
+
+
+def backfill_coordinates(df, lat_col='latitude', lon_col='longitude', url_col=None):
+    """Fill unparseable latitude/longitude cells from data already in the row
+
+    A "lat, lon" pair typed into the latitude cell is split first, then coordinates
+    embedded in url_col are used. Rows that already parse are left untouched.
+    Returns the frame and the number of rows filled.
+    """
+    _, lat_reasons = parse_coordinates(df[lat_col])
+    _, lon_reasons = parse_coordinates(df[lon_col])
+    todo = (lat_reasons != VALID) | (lon_reasons != VALID)
+    if not todo.any():
+        return df, 0
+
+    lat, lon = _extract_pairs(df[lat_col][todo], (_PAIR_PATTERN,))
+    if url_col is not None and url_col in df.columns:
+        url_lat, url_lon = extract_url_coordinates(df[url_col][todo])
+        lat, lon = lat.fillna(url_lat), lon.fillna(url_lon)
+
+    filled = lat.notna()
+    if not filled.any():
+        return df, 0
+    index = filled[filled].index
+    df = df.astype({lat_col: object, lon_col: object})
+    df.loc[index, lat_col] = lat[index]
+    df.loc[index, lon_col] = lon[index]
+    return df, int(filled.sum())
+
+
+def describe_rejections(rejected):
+    """Human readable summary of clean_coordinates rejection counts"""
+    return ", ".join(f"{count} {reason.replace('_', '-')}" for reason, count in rejected.items())
+
+
+# Streaming CSV ingest
+INGEST_CHUNK_SIZE = 100000
+
+
+def _column_key(name):
+    return str(name).strip().lower().replace(' ', '_')
+
+
+class MissingColumnsError(ValueError):
+    """A file lacks requested columns; missing and available list the column names"""
+
+    def __init__(self, missing, available):
+        self.missing = list(missing)
+        self.available = [str(col) for col in available]
+        super().__init__(
+            f"Missing columns: {', '.join(self.missing)}. "
+            f"Available columns: {', '.join(self.available)}"
+        )
+
+
+def _match_columns(available, columns):
+    """Map requested column names onto the available ones, raising MissingColumnsError if any are missing"""
+    wanted = {_column_key(col): col for col in columns}
+    found = {_column_key(col): col for col in available if _column_key(col) in wanted}
+    missing = [wanted[key] for key in wanted if key not in found]
+    if missing:
+        raise MissingColumnsError(missing, available)
+    return {found[key]: wanted[key] for key in found}
+
+
+class RunningCoordinateStats:
+    """Count, bounding box, centroid and lat/lon histograms accumulated one chunk at a time
+
+    Histograms are kept at a fixed bin_width (degrees) so chunks can be merged without
+    knowing the full data range up front.
+    """
+
+    def __init__(self, bin_width=0.01):
+        self.bin_width = bin_width
+        self.rows_read = 0
+        self.count = 0
+        self.backfilled = 0
+        self.rejected = {}
+        self.min_lat = self.min_lon = np.inf
+        self.max_lat = self.max_lon = -np.inf
+        self._sum_lat = 0.0
+        self._sum_lon = 0.0
+        self._lat_bins = {}
+        self._lon_bins = {}
+
+    def update(self, lat, lon, rows_read=None, rejected=None, backfilled=0):
+        """Fold one chunk of valid coordinates (and its rejection and back-fill counts) into the totals"""
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.rows_read += len(lat) if rows_read is None else rows_read
+        self.backfilled += backfilled
+        for reason, count in (rejected or {}).items():
+            self.rejected[reason] = self.rejected.get(reason, 0) + count
+        if len(lat) == 0:
+            return
+
+        self.count += len(lat)
+        self.min_lat = min(self.min_lat, lat.min())
+        self.max_lat = max(self.max_lat, lat.max())
+        self.min_lon = min(self.min_lon, lon.min())
+        self.max_lon = max(self.max_lon, lon.max())
+        self._sum_lat += lat.sum()
+        self._sum_lon += lon.sum()
+        self._add_to_bins(self._lat_bins, lat)
+        self._add_to_bins(self._lon_bins, lon)
+
+    def _add_to_bins(self, bins, values):
+        keys, counts = np.unique(np.floor(values / self.bin_width).astype(np.int64), return_counts=True)
+        for key, count in zip(keys.tolist(), counts.tolist()):
+            bins[key] = bins.get(key, 0) + count
+
+    @property
+    def centroid(self):
+        """(mean latitude, mean longitude) of the valid rows"""
+        if not self.count:
+            return np.nan, np.nan
+        return self._sum_lat / self.count, self._sum_lon / self.count
+
+    @property
+    def bbox(self):
+        """(min_lat, min_lon, max_lat, max_lon)"""
+        return self.min_lat, self.min_lon, self.max_lat, self.max_lon
+
+    def histogram(self, axis='latitude'):
+        """Bin edges and counts of the latitude or longitude histogram, at bin_width resolution"""
+        bins = self._lat_bins if axis == 'latitude' else self._lon_bins
+        if not bins:
+            return np.array([]), np.array([], dtype=np.int64)
+        keys = np.arange(min(bins), max(bins) + 1)
+        counts = np.array([bins.get(key, 0) for key in keys.tolist()], dtype=np.int64)
+        edges = np.append(keys, keys[-1] + 1) * self.bin_width
+        return edges, counts
+
+
+def _find_column(available, name):
+    """The available column matching name like _match_columns does, or None"""
+    if name is None:
+        return None
+    for col in available:
+        if _column_key(col) == _column_key(name):
+            return col
+    return None
+
+
+def ingest_csv(path, columns, lat_col='latitude', lon_col='longitude',
+               chunk_size=INGEST_CHUNK_SIZE, keep_rows=True, stats=None, url_col=URL_COLUMN):
+    """Stream a CSV in chunks, keeping only the requested columns and cleaning coordinates as it goes
+
+    Column names are matched ignoring case, surrounding spaces and space/underscore
+    differences, and returned under the names given in columns. When the file has a
+    url_col, missing coordinates are back-filled from it before cleaning. The long URL
+    strings are only read in a second pass, and only when some rows need them; files
+    whose coordinates are all present never parse that column. Returns the cleaned
+    frame (None when keep_rows is False) and the RunningCoordinateStats for the file.
+    """
+    available = pd.read_csv(path, nrows=0).columns
+    rename = _match_columns(available, columns)
+    url_source = _find_column(available, url_col)
+    # A requested column that also holds the URLs is read in the first pass anyway
+    url_in_chunks = url_source is not None and url_source in rename
+    deferred_url = url_source if url_source is not None and not url_in_chunks else None
+
+    stats = RunningCoordinateStats() if stats is None else stats
+    chunks = []
+    pending = []
+    for chunk in pd.read_csv(path, usecols=list(rename), chunksize=chunk_size):
+        chunk = chunk.rename(columns=rename)
+        rows_read = len(chunk)
+        chunk, backfilled = backfill_coordinates(chunk, lat_col, lon_col, rename[url_source] if url_in_chunks else None)
+        cleaned, rejected = clean_coordinates(chunk, lat_col, lon_col)
+        if deferred_url is not None and len(cleaned) < rows_read:
+            # Rows still without coordinates wait for the URL pass instead of being rejected now
+            pending.append(chunk[~chunk.index.isin(cleaned.index)])
+            rejected = {}
+        chunk = cleaned
+        stats.update(chunk[lat_col], chunk[lon_col], rows_read=rows_read, rejected=rejected, backfilled=backfilled)
+        if keep_rows:
+            chunks.append(chunk[list(columns)])
+
+    if pending:
+        rows = pd.concat(pending)
+        rows[deferred_url] = _read_column_rows(path, deferred_url, rows.index, chunk_size)
+        rows, backfilled = backfill_coordinates(rows, lat_col, lon_col, deferred_url)
+        rows, rejected = clean_coordinates(rows, lat_col, lon_col)
+        stats.update(rows[lat_col], rows[lon_col], rows_read=0, rejected=rejected, backfilled=backfilled)
+        if keep_rows:
+            chunks.append(rows[list(columns)])
+
+    if not keep_rows:
+        return None, stats
+    if not chunks:
+        return pd.DataFrame(columns=list(columns)), stats
+    df = pd.concat(chunks)
+    if pending:
+        # Put the back-filled rows back in file order
+        df = df.sort_index(kind='stable')
+    return df.reset_index(drop=True), stats
+
+
+def _read_column_rows(path, column, rows, chunk_size):
+    """Values of one CSV column at the given row positions, reading no further than the last of them"""
+    rows = np.sort(np.asarray(rows))
+    parts = []
+    reader = pd.read_csv(path, usecols=[column], nrows=int(rows[-1]) + 1, chunksize=chunk_size)
+    for chunk in reader:
+        parts.append(chunk[column][chunk.index.isin(rows)])
+    return pd.concat(parts)
+
+
+# Cached Excel ingest
+CACHE_DIR_NAME = '.ingest_cache'
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+CACHE_VERSION = 2  # Bump when cleaning rules change so old entries stop matching
+
+
+def file_digest(path, block_size=1024 * 1024):
+    """Content hash of a file, read in blocks"""
+    digest = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class IngestCache:
+    """Parquet copies of cleaned input frames, keyed by source file hash and cleaning options
+
+    Entries live in a directory next to the source file. A changed source hashes to a new
+    key, so stale entries are never returned; they simply age out of the LRU once the
+    directory grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @classmethod
+    def for_source(cls, path, max_bytes=CACHE_MAX_BYTES):
+        return cls(os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME), max_bytes)
+
+    def key(self, path, options):
+        payload = json.dumps({'file': file_digest(path), 'options': options, 'version': CACHE_VERSION}, sort_keys=True)
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.parquet")
+
+    def get(self, key):
+        """Cached (frame, info) for key, or None on a miss"""
+        import pyarrow.parquet as pq
+
+        entry = self._entry_path(key)
+        if not os.path.exists(entry):
+            return None
+        table = pq.read_table(entry)
+        info = json.loads((table.schema.metadata or {}).get(b'ingest_info', b'{}'))
+        # Refresh the modification time so eviction sees this entry as recently used
+        os.utime(entry)
+        return table.to_pandas(), info
+
+    def put(self, key, df, info):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        os.makedirs(self.directory, exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'ingest_info'] = json.dumps(info).encode('utf-8')
+        entry = self._entry_path(key)
+        tmp_entry = entry + '.tmp'
+        pq.write_table(table.replace_schema_metadata(metadata), tmp_entry)
+        os.replace(tmp_entry, entry)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        evict_lru(self.directory, self.max_bytes, '.parquet')
+
+
+def read_clean_table(path, columns, lat_col='latitude', lon_col='longitude', project=True, url_col=URL_COLUMN):
+    """Read a whole Excel or CSV file and clean its coordinates, matching columns and back-filling like ingest_csv
+
+    With project=False the other columns are kept under their original names.
+    Returns the cleaned frame and a dict with rows_read, backfilled and rejected counts.
+    """
+    df = pd.read_csv(path) if path.lower().endswith('.csv') else pd.read_excel(path)
+    rename = _match_columns(df.columns, columns)
+    url_source = _find_column(df.columns, url_col)
+    df = df.rename(columns=rename)
+    rows_read = len(df)
+    df, backfilled = backfill_coordinates(df, lat_col, lon_col, rename.get(url_source, url_source))
+    if project:
+        df = df[list(columns)]
+    df, rejected = clean_coordinates(df, lat_col, lon_col)
+    return df.reset_index(drop=True), {'rows_read': rows_read, 'backfilled': backfilled, 'rejected': rejected}
+
+
+def ingest_excel(path, columns, lat_col='latitude', lon_col='longitude', project=True, use_cache=True,
+                 url_col=URL_COLUMN):
+    """read_clean_table through the IngestCache, so repeat loads skip openpyxl entirely
+
+    Returns the cleaned frame and its RunningCoordinateStats. Caching is skipped when
+    pyarrow is unavailable or the cache directory cannot be written.
+    """
+    options = {'columns': list(columns), 'lat_col': lat_col, 'lon_col': lon_col, 'project': project,
+               'url_col': url_col}
+    cache = IngestCache.for_source(path) if use_cache else None
+    cached = None
+    if cache is not None:
+        try:
+            key = cache.key(path, options)
+            cached = cache.get(key)
+        except (ImportError, OSError, ValueError, TypeError):
+            cache = None
+
+    if cached is not None:
+        df, info = cached
+    else:
+        df, info = read_clean_table(path, columns, lat_col, lon_col, project, url_col)
+        if cache is not None:
+            try:
+                cache.put(key, df, info)
+            except (ImportError, OSError, ValueError, TypeError):
+                pass
+    return df, _table_stats(df, info, lat_col, lon_col)
+
+
+def _table_stats(df, info, lat_col, lon_col):
+    stats = RunningCoordinateStats()
+    stats.update(df[lat_col], df[lon_col], rows_read=info['rows_read'], rejected=info['rejected'],
+                 backfilled=info.get('backfilled', 0))
+    return stats
+
+
+def ingest_locations(path, columns, lat_col='latitude', lon_col='longitude'):
+    """Cleaned frame and stats for a small CSV or Excel location table, such as the butcher list
+
+    Both formats get the same column matching, map-link back-filling and coordinate
+    cleaning; Excel files also go through the IngestCache. Columns beyond columns (a
+    butcher name, say) are kept. The frame may be empty when no row has valid
+    coordinates, which callers should reject.
+    """
+    if path.lower().endswith('.csv'):
+        df, info = read_clean_table(path, columns, lat_col, lon_col, project=False)
+        return df, _table_stats(df, info, lat_col, lon_col)
+    return ingest_excel(path, columns, lat_col, lon_col, project=False)
@@ -0,0 +1,241 @@
+import asyncio
+import os
+import sqlite3
+import sys
+import time
+import pandas as pd
+
+from ingest import extract_url_coordinates
+
+# Defaults
+LINK_CACHE_FILE = 'link_cache.sqlite'
+RESOLVE_CONCURRENCY = 16
+RESOLVE_RETRIES = 3
+RESOLVE_BACKOFF = 0.5  # seconds, doubled after every failed attempt
+RESOLVE_TIMEOUT = 20  # seconds per request, redirects included
+USER_AGENT = "Mozilla/5.0 (compatible; customer-distribution-analysis)"
+
+# HTTP statuses worth retrying; any other error status is a permanent failure
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+NO_COORDINATES = "No coordinates in expanded URL"
+
+
+class LinkCache:
+    """On-disk cache of short link -> expanded URL -> coordinates, kept in a SQLite file
+
+    Failed lookups are stored too, with their error, so they can be retried on the next
+    run while successfully resolved links are never requested again.
+    """
+
+    def __init__(self, path=LINK_CACHE_FILE):
+        self.path = path
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS links ("
+            "short_url TEXT PRIMARY KEY, expanded_url TEXT, latitude REAL, longitude REAL, "
+            "status TEXT NOT NULL, error TEXT, attempts INTEGER NOT NULL DEFAULT 0, updated REAL)"
+        )
+        self._conn.commit()
+
+    def get(self, short_url):
+        """Cached row for short_url as a dict, or None"""
+        cur = self._conn.execute(
+            "SELECT short_url, expanded_url, latitude, longitude, status, error, attempts "
+            "FROM links WHERE short_url = ?", (short_url,)
+        )
+        row = cur.fetchone()
+        if row is None:
+            return None
+        keys = ('short_url', 'expanded_url', 'latitude', 'longitude', 'status', 'error', 'attempts')
+        return dict(zip(keys, row))
+
+    def resolved(self, short_urls):
+        """The subset of short_urls that already resolved successfully"""
+        done = set()
+        urls = list(short_urls)
+        # Stay well under SQLite's bound parameter limit
+        for start in range(0, len(urls), 500):
+            batch = urls[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            cur = self._conn.execute(
+                f"SELECT short_url FROM links WHERE status = 'ok' AND short_url IN ({placeholders})", batch
+            )
+            done.update(row[0] for row in cur)
+        return done
+
+    def put(self, result):
+        """Store one resolver result, counting attempts across runs"""
+        self._conn.execute(
+            "INSERT INTO links (short_url, expanded_url, latitude, longitude, status, error, attempts, updated) "
+            "VALUES (:short_url, :expanded_url, :latitude, :longitude, :status, :error, :attempts, :updated) "
+            "ON CONFLICT(short_url) DO UPDATE SET expanded_url = excluded.expanded_url, "
+            "latitude = excluded.latitude, longitude = excluded.longitude, status = excluded.status, "
+            "error = excluded.error, attempts = links.attempts + excluded.attempts, updated = excluded.updated",
+            dict(result, updated=time.time())
+        )
+        self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+def _coordinates_from_chain(urls):
+    """First (lat, lon) found along a redirect chain, or (None, None)"""
+    lat, lon = extract_url_coordinates(urls)
+    found = lat.notna()
+    if not found.any():
+        return None, None
+    first = found.idxmax()
+    return float(lat[first]), float(lon[first])
+
+
+async def _expand(session, short_url, retries, backoff):
+    """Follow the redirects of one short link, retrying transient failures with exponential backoff
+
+    A link is 'ok' only when it ends on a 2xx/3xx response whose URL chain carries
+    coordinates. Other error statuses (404, 410, ...) fail at once; RETRY_STATUSES and
+    connection errors are retried and fail once the retries run out.
+    """
+    import aiohttp
+
+    result = {'short_url': short_url, 'expanded_url': None, 'latitude': None, 'longitude': None,
+              'status': 'failed', 'error': None, 'attempts': 0}
+    for attempt in range(retries + 1):
+        result['attempts'] += 1
+        try:
+            async with session.get(short_url, allow_redirects=True) as response:
+                # Only the redirect chain matters, so the body is never read
+                chain = [str(r.url) for r in response.history] + [str(response.url)]
+                if response.status >= 400:
+                    result['error'] = f"HTTP {response.status}"
+                    if response.status not in RETRY_STATUSES:
+                        return result
+                else:
+                    # Consent/"sorry" pages still carry the target in their URL, so the
+                    # coordinates are looked for along the whole chain
+                    result['expanded_url'] = chain[-1]
+                    result['latitude'], result['longitude'] = _coordinates_from_chain(chain)
+                    if result['latitude'] is None:
+                        result['error'] = NO_COORDINATES
+                    else:
+                        result['status'] = 'ok'
+                        result['error'] = None
+                    return result
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            result['error'] = f"{type(e).__name__}: {e}"
+        if attempt < retries:
+            await asyncio.sleep(backoff * 2 ** attempt)
+    return result
+
+
+async def resolve_links_async(short_urls, cache, concurrency=RESOLVE_CONCURRENCY, retries=RESOLVE_RETRIES,
+                              backoff=RESOLVE_BACKOFF, timeout=RESOLVE_TIMEOUT, session=None, progress=None):
+    """Resolve the short links that are not already in cache, at most concurrency at a time
+
+    All requests share one pooled aiohttp session (pass session to supply your own).
+    Each result is written to the cache as soon as it arrives, so an interrupted run
+    keeps its progress. progress, if given, is called as progress(done, total).
+    Returns the list of results for the links that were requested.
+    """
+    import aiohttp
+
+    short_urls = list(dict.fromkeys(short_urls))
+    done = cache.resolved(short_urls)
+    pending = [url for url in short_urls if url not in done]
+    if not pending:
+        return []
+
+    own_session = session is None
+    if own_session:
+        connector = aiohttp.TCPConnector(limit=concurrency, ttl_dns_cache=300)
+        session = aiohttp.ClientSession(
+            connector=connector,
+            timeout=aiohttp.ClientTimeout(total=timeout),
+            headers={'User-Agent': USER_AGENT}
+        )
+
+    semaphore = asyncio.Semaphore(concurrency)
+    results = []
+
+    async def worker(url):
+        async with semaphore:
+            result = await _expand(session, url, retries, backoff)
+        cache.put(result)
+        results.append(result)
+        if progress is not None:
+            progress(len(results), len(pending))
+
+    try:
+        await asyncio.gather(*(worker(url) for url in pending))
+    finally:
+        if own_session:
+            await session.close()
+    return results
+
+
+def resolve_links(short_urls, cache_path=LINK_CACHE_FILE, **kwargs):
+    """Blocking wrapper around resolve_links_async
+
+    Returns a frame with one row per distinct short link (cached or freshly resolved)
+    with columns short_url, expanded_url, latitude, longitude, status and error.
+    """
+    short_urls = [url for url in dict.fromkeys(short_urls) if isinstance(url, str) and url.strip()]
+    cache = LinkCache(cache_path)
+    try:
+        asyncio.run(resolve_links_async(short_urls, cache, **kwargs))
+        rows = [cache.get(url) for url in short_urls]
+    finally:
+        cache.close()
+    columns = ['short_url', 'expanded_url', 'latitude', 'longitude', 'status', 'error']
+    return pd.DataFrame(rows, columns=columns + ['attempts'])[columns]
+
+
+def resolve_location_column(df, link_col='Location', url_col='Expanded URL', lat_col='Latitude',
+                            lon_col='Longitude', cache_path=LINK_CACHE_FILE, **kwargs):
+    """Fill url_col and missing coordinates of df by resolving the short links in link_col
+
+    Only rows whose coordinates are missing or unparseable are looked up. Returns the
+    updated frame and the resolver results for those rows.
+    """
+    from ingest import VALID, parse_coordinates
+
+    _, lat_reasons = parse_coordinates(df[lat_col])
+    _, lon_reasons = parse_coordinates(df[lon_col])
+    todo = ((lat_reasons != VALID) | (lon_reasons != VALID)) & df[link_col].notna().to_numpy()
+
+    results = resolve_links(df.loc[todo, link_col], cache_path, **kwargs)
+    # Links that expanded without coordinates still fill url_col
+    expanded = results.dropna(subset=['expanded_url']).set_index('short_url')
+    located = results[results['status'] == 'ok'].set_index('short_url')
+
+    df = df.copy()
+    if url_col not in df.columns:
+        df[url_col] = None
+    links = df[link_col]
+    have_url = df[url_col].notna()
+    df.loc[todo & ~have_url, url_col] = links[todo & ~have_url].map(expanded['expanded_url'])
+
+    found = todo & links.isin(located.index).to_numpy()
+    df = df.astype({lat_col: object, lon_col: object})
+    df.loc[found, lat_col] = links[found].map(located['latitude'])
+    df.loc[found, lon_col] = links[found].map(located['longitude'])
+    return df, results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python link_resolver.py <customers.csv> [output.csv]")
+        sys.exit(1)
+    source = sys.argv[1]
+    output = sys.argv[2] if len(sys.argv) == 3 else source
+    cache_file = os.path.join(os.path.dirname(os.path.abspath(source)), LINK_CACHE_FILE)
+
+    def report(done, total):
+        print(f"\rResolved {done}/{total} links", end='', flush=True)
+
+    df, results = resolve_location_column(pd.read_csv(source), cache_path=cache_file, progress=report)
+    print()
+    failed = int((results['status'] != 'ok').sum())
+    located = int(results['latitude'].notna().sum())
+    df.to_csv(output, index=False)
+    print(f"{len(results)} links looked up: {located} located, {failed} failed. Wrote {output}")
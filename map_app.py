@@ -1,8 +1,9 @@
-import pandas as pd
-import folium
 import webbrowser
 from tkinter import Tk, filedialog
 import os
+from ingest import ingest_excel
+from coordinate_store import CoordinateStore, open_coordinate_file
+from map_layers import bulk_markers, heat_rows
 
 # Hide the root Tkinter window
 root = Tk()
@@ -11,7 +12,7 @@ root.withdraw()
 # Ask user to select the Excel file
 file_path = filedialog.askopenfilename(
     title="Select Excel File",
-    filetypes=[("Excel files", "*.xlsx *.xls"), ("All files", "*.*")]
+    filetypes=[("Excel files", "*.xlsx *.xls"), ("Coordinate files", "*.coords"), ("All files", "*.*")]
 )
 
 if not file_path:
@@ -20,26 +21,26 @@ if not file_path:
 
 # Read the Excel file
 try:
-    df = pd.read_excel(file_path)
     required_columns = ['Customer ID', 'Latitude', 'Longitude']
     
-    # Check if required columns exist
-    if not all(col in df.columns for col in required_columns):
-        missing = [col for col in required_columns if col not in df.columns]
-        raise ValueError(f"Missing columns: {', '.join(missing)}")
-        
-    # Add data type validation and conversion
-    df['Latitude'] = pd.to_numeric(df['Latitude'], errors='coerce')
-    df['Longitude'] = pd.to_numeric(df['Longitude'], errors='coerce')
+    if file_path.endswith('.coords'):
+        # Pre-converted binary file: memory-map the arrays instead of parsing; no DataFrame is built
+        points = open_coordinate_file(file_path)
+        stats = points.running_stats()
+    else:
+        # Read, check required columns and convert coordinates, dropping invalid rows.
+        # The cleaned frame is cached next to the source, so repeat runs skip openpyxl.
+        df, stats = ingest_excel(file_path, required_columns, lat_col='Latitude', lon_col='Longitude', project=False)
+        points = CoordinateStore.from_frame(df, 'Customer ID', lat_col='Latitude', lon_col='Longitude') if len(df) else None
     
-    # Remove rows with invalid coordinates
-    initial_count = len(df)
-    df = df.dropna(subset=['Latitude', 'Longitude'])
-    new_count = len(df)
+    initial_count = stats.rows_read
+    new_count = 0 if points is None else len(points)
     
     if new_count == 0:
         raise ValueError("No valid coordinate data remaining after cleaning")
         
+    if stats.backfilled:
+        print(f"Filled {stats.backfilled} rows from coordinates embedded in map links")
     if initial_count != new_count:
         print(f"Removed {initial_count - new_count} rows with invalid coordinates")
 except Exception as e:
@@ -47,21 +48,18 @@ except Exception as e:
     exit()
 
 # Create map centered on the mean of all coordinates
-map_center = [df['Latitude'].mean(), df['Longitude'].mean()]
+# (folium is only imported once a file has been chosen, so the dialog opens without waiting on it)
+import folium
+from folium.plugins import HeatMap
+
+map_center = [points.mean_lat, points.mean_lon]
 customer_map = folium.Map(location=map_center, zoom_start=13)
 
-# Add markers for each customer
-for idx, row in df.iterrows():
-    folium.Marker(
-        location=[row['Latitude'], row['Longitude']],
-        popup=f"Customer ID: {row['Customer ID']}",
-        tooltip=f"ID: {row['Customer ID']}"
-    ).add_to(customer_map)
+# Add markers for each customer, serialized as one data array and built by the browser
+bulk_markers(points, "Customer ID: ", icon=None, cluster=False, tooltip_prefix="ID: ").add_to(customer_map)
 
-# Add a heatmap layer
-from folium.plugins import HeatMap
-heat_data = df[['Latitude', 'Longitude']].values.tolist()
-HeatMap(heat_data, radius=15).add_to(customer_map)
+# Add a heatmap layer, pre-aggregated into a density grid for large data sets
+HeatMap(heat_rows(points), radius=15).add_to(customer_map)
 
 # Save HTML to desktop
 # Modified file saving section with directory creation
@@ -76,37 +74,24 @@ webbrowser.open(html_path)
 
 # Export as image (PNG)
 try:
-    from selenium import webdriver
-    from PIL import Image
-    import time
+    from map_export import MapExporter
     
     print("Exporting as image...")
     
-    # Set up headless browser
-    options = webdriver.ChromeOptions()
-    options.add_argument('--headless')
-    options.add_argument('--disable-gpu')
-    options.add_argument('--window-size=1280,1024')  # Adjust as needed
-    
-    driver = webdriver.Chrome(options=options)
-    driver.get(f'file://{html_path}')
-    
-    # Wait for map to load
-    time.sleep(5)
-    
-    # Save screenshot
+    # Headless browser that waits for the map to finish drawing and crops to the map element
+    exporter = MapExporter(window_size=(1280, 1024))
     img_path = os.path.join(desktop, 'customer_map.png')
-    driver.save_screenshot(img_path)
-    
-    # Crop to map area (adjust these values as needed)
-    img = Image.open(img_path)
-    img = img.crop((300, 100, 900, 800))  # left, top, right, bottom
-    img.save(img_path)
+    try:
+        exporter.export('file://' + os.path.abspath(html_path), img_path)
+    finally:
+        exporter.close()
     
     print(f"Map image saved to your desktop: {img_path}")
-    driver.quit()
     
 except Exception as e:
-    print(f"Couldn't save as image. Error: {e}")
-    print("Note: You need ChromeDriver installed for image export.")
-    print("You can still use the interactive HTML map.")
\ No newline at end of file
+    print(f"Couldn't export through a browser ({e}), drawing the image directly instead")
+    from static_map import render_static_map, save_image
+    
+    img_path = os.path.join(desktop, 'customer_map.png')
+    save_image(render_static_map(points, layers=('density', 'points', 'bbox')), img_path)
+    print(f"Map image saved to your desktop: {img_path}")
\ No newline at end of file
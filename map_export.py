@@ -0,0 +1,183 @@
+import atexit
+import os
+import threading
+import time
+from io import BytesIO
+
+# Defaults
+EXPORT_WINDOW_SIZE = (1200, 800)
+EXPORT_READY_TIMEOUT_S = 30  # Longest wait for tiles and markers before capturing anyway
+READY_POLL_MS = 50
+
+# Run with execute_async_script once the page has loaded. Waits until every Leaflet map on
+# the page has no tiles loading and all images and fonts are in, lets two frames paint,
+# then reports whether the page got ready in time and where the first map sits.
+_READY_SCRIPT = """
+var timeoutMs = arguments[0], pollMs = arguments[1], done = arguments[arguments.length - 1];
+var deadline = Date.now() + timeoutMs;
+
+// Skip Leaflet's tile fade-in so a finished tile is also a fully drawn one
+var style = document.createElement('style');
+style.textContent = '.leaflet-tile { opacity: 1 !important; transition: none !important; }';
+document.head.appendChild(style);
+
+function leafletMaps() {
+    var maps = [];
+    if (!window.L) {
+        return maps;
+    }
+    for (var name in window) {
+        try {
+            if (window[name] instanceof L.Map) {
+                maps.push(window[name]);
+            }
+        } catch (e) {}
+    }
+    return maps;
+}
+
+function loadingTiles(map) {
+    var loading = false;
+    map.eachLayer(function (layer) {
+        if (layer instanceof L.GridLayer && (layer.isLoading ? layer.isLoading() : layer._loading)) {
+            loading = true;
+        }
+    });
+    return loading;
+}
+
+function assetsLoaded() {
+    var images = Array.prototype.every.call(document.images, function (img) { return img.complete; });
+    return images && (!document.fonts || document.fonts.status === 'loaded');
+}
+
+function check() {
+    var maps = leafletMaps();
+    var ready = document.readyState === 'complete' && maps.length > 0 && !maps.some(loadingTiles) && assetsLoaded();
+    if (!ready && Date.now() < deadline) {
+        setTimeout(check, pollMs);
+        return;
+    }
+    requestAnimationFrame(function () {
+        requestAnimationFrame(function () {
+            var element = maps.length ? maps[0].getContainer() : document.body;
+            var rect = element.getBoundingClientRect();
+            done({
+                ready: ready,
+                left: rect.left, top: rect.top, width: rect.width, height: rect.height,
+                scale: window.devicePixelRatio || 1
+            });
+        });
+    });
+}
+check();
+"""
+
+
+def crop_box(bounds, image_size):
+    """Pixel box of the reported map bounds inside a screenshot of image_size"""
+    scale = bounds['scale']
+    width, height = image_size
+    left = max(0, round(bounds['left'] * scale))
+    top = max(0, round(bounds['top'] * scale))
+    right = min(width, round((bounds['left'] + bounds['width']) * scale))
+    bottom = min(height, round((bounds['top'] + bounds['height']) * scale))
+    if right <= left or bottom <= top:
+        return (0, 0, width, height)
+    return (left, top, right, bottom)
+
+
+class MapExporter:
+    """Saves images of map pages with one headless Chrome kept open between exports
+
+    The browser is started by the first export and reused afterwards, so later exports
+    only pay for loading the page. Instead of sleeping for a fixed time, each export
+    waits for the page to report that its tiles and markers are drawn, then crops the
+    screenshot to the map element. Safe to use from worker threads; exports run one at
+    a time.
+    """
+
+    def __init__(self, window_size=EXPORT_WINDOW_SIZE, timeout=EXPORT_READY_TIMEOUT_S):
+        self.window_size = window_size
+        self.timeout = timeout
+        self._driver = None
+        self._lock = threading.Lock()
+        self._close_registered = False
+
+    def _start(self):
+        from selenium import webdriver
+
+        options = webdriver.ChromeOptions()
+        options.add_argument('--headless=new')
+        options.add_argument('--disable-gpu')
+        options.add_argument('--hide-scrollbars')
+        options.add_argument(f'--window-size={self.window_size[0]},{self.window_size[1]}')
+        driver = webdriver.Chrome(options=options)
+        driver.set_script_timeout(self.timeout + 5)
+        if not self._close_registered:
+            atexit.register(self.close)
+            self._close_registered = True
+        return driver
+
+    def export(self, url, path):
+        """Save an image of the map at url to path (format from its extension)
+
+        Returns True if the page reported ready, False if it was captured after the
+        timeout with tiles still loading.
+        """
+        from selenium.common.exceptions import WebDriverException
+
+        with self._lock:
+            try:
+                return self._capture(url, path)
+            except WebDriverException:
+                # The browser may have been closed or crashed since the last export: start a new one
+                self._quit()
+                return self._capture(url, path)
+
+    def _capture(self, url, path):
+        from PIL import Image
+
+        if self._driver is None:
+            self._driver = self._start()
+        self._driver.get(url)
+        bounds = self._driver.execute_async_script(_READY_SCRIPT, self.timeout * 1000, READY_POLL_MS)
+        image = Image.open(BytesIO(self._driver.get_screenshot_as_png()))
+        image = image.crop(crop_box(bounds, image.size))
+        if path.lower().endswith(('.jpg', '.jpeg')):
+            image = image.convert('RGB')
+        image.save(path)
+        return bounds['ready']
+
+    def _quit(self):
+        if self._driver is not None:
+            try:
+                self._driver.quit()
+            except Exception:
+                pass
+            self._driver = None
+
+    def close(self):
+        """Shut the browser down; the next export starts a new one"""
+        with self._lock:
+            self._quit()
+
+
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 3:
+        sys.exit("usage: python map_export.py MAP_URL_OR_HTML IMAGE [IMAGE ...]")
+
+    target = sys.argv[1]
+    url = target if '://' in target else 'file://' + os.path.abspath(target)
+    exporter = MapExporter()
+    try:
+        # Several outputs show the cost of the first export (browser start) against later ones
+        for image_path in sys.argv[2:]:
+            start = time.perf_counter()
+            ready = exporter.export(url, image_path)
+            state = "ready" if ready else "timed out waiting for tiles"
+            print(f"{image_path}: {time.perf_counter() - start:.2f}s ({state})")
+    finally:
+        exporter.close()
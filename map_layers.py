@@ -0,0 +1,311 @@
+import copy
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+from disk_cache import evict_lru
+
+# Coordinates are written with ~0.1 m precision to keep the page small
+COORDINATE_DECIMALS = 6
+
+# Client-side marker factory for FastMarkerCluster: called with one [lat, lon, id] row.
+# Popup and tooltip text go in as text nodes so ids are never interpreted as HTML.
+_CALLBACK = """function (row) {
+    var marker = %(marker)s;
+    marker.bindPopup(document.createTextNode(%(popup)s + row[2]));%(tooltip)s
+    return marker;
+}"""
+_TOOLTIP = """
+    marker.bindTooltip(document.createTextNode(%s + row[2]));"""
+
+
+def _callback(marker, popup_prefix, tooltip_prefix):
+    tooltip = _TOOLTIP % json.dumps(tooltip_prefix) if tooltip_prefix is not None else ''
+    return _CALLBACK % {'marker': marker, 'popup': json.dumps(popup_prefix), 'tooltip': tooltip}
+
+
+def point_rows(store):
+    """[[lat, lon], ...] for every point of a CoordinateStore, rounded for compact serialization"""
+    return np.column_stack([
+        np.round(store.lat, COORDINATE_DECIMALS),
+        np.round(store.lon, COORDINATE_DECIMALS)
+    ]).tolist()
+
+
+def marker_rows(store):
+    """[[lat, lon, id], ...] for every point of a CoordinateStore"""
+    ids = np.asarray(store.ids).tolist()
+    return [[lat, lon, point_id] for (lat, lon), point_id in zip(point_rows(store), ids)]
+
+
+def bulk_markers(store, popup_prefix, color='blue', icon='user', name=None, cluster=True, tooltip_prefix=None):
+    """One layer holding a marker per point, serialized as a single data array and built in the browser
+
+    Replaces a folium.Marker per row (one script block each) with a few bytes per point.
+    icon=None gives Leaflet's default marker. With cluster=False clustering is switched
+    off at every zoom level, but markers are still only added to the page while in view.
+    """
+    from folium.plugins import FastMarkerCluster
+
+    if icon is None:
+        marker = "L.marker(new L.LatLng(row[0], row[1]))"
+    else:
+        icon_options = json.dumps({'icon': icon, 'markerColor': color, 'iconColor': 'white', 'prefix': 'glyphicon'})
+        marker = f"L.marker(new L.LatLng(row[0], row[1]), {{icon: L.AwesomeMarkers.icon({icon_options})}})"
+    options = {} if cluster else {'disableClusteringAtZoom': 1}
+    callback = _callback(marker, popup_prefix, tooltip_prefix)
+    return FastMarkerCluster(marker_rows(store), callback=callback, name=name, **options)
+
+
+def bulk_circle_markers(store, popup_prefix, color='blue', radius=5, name=None):
+    """Like bulk_markers(cluster=False), drawing folium.CircleMarker style circles"""
+    from folium.plugins import FastMarkerCluster
+
+    circle_options = json.dumps({'radius': radius, 'color': color, 'fill': True, 'fillColor': color})
+    callback = _callback(f"L.circleMarker(new L.LatLng(row[0], row[1]), {circle_options})", popup_prefix, None)
+    return FastMarkerCluster(marker_rows(store), callback=callback, name=name, disableClusteringAtZoom=1)
+
+
+# Heatmap density grid
+HEAT_GRID_CELLS = 200  # Cells along the longer side of the customer bounding box
+HEAT_RAW_POINT_LIMIT = 2000  # Up to this many points the heatmap gets them unaggregated
+HEAT_WEIGHT_PERCENTILE = 99  # Cell count that maps to full intensity
+
+
+def _smooth(grid, passes):
+    """Separable [1, 2, 1] / 4 blur, applied passes times, keeping the grid's total weight"""
+    for _ in range(passes):
+        for axis in (0, 1):
+            padded = np.pad(grid, [(1, 1) if a == axis else (0, 0) for a in (0, 1)])
+            lo = padded.take(range(0, grid.shape[axis]), axis=axis)
+            mid = padded.take(range(1, grid.shape[axis] + 1), axis=axis)
+            hi = padded.take(range(2, grid.shape[axis] + 2), axis=axis)
+            grid = (lo + 2 * mid + hi) / 4
+    return grid
+
+
+def density_grid(store, cells=HEAT_GRID_CELLS, smooth=0):
+    """Bin the points of a CoordinateStore into a lat/lon grid
+
+    Returns (lat, lon, count) arrays for the non-empty cells. Each cell is placed at the
+    mean position of its points, so sparse data keeps its exact locations. With smooth > 0
+    the counts are blurred into neighbouring cells; cells that only receive weight from
+    the blur sit at their cell centre.
+    """
+    min_lat, min_lon, max_lat, max_lon = store.bbox
+    cell_deg = max(max_lat - min_lat, max_lon - min_lon) / cells or 1e-6
+    n_lat = int((max_lat - min_lat) / cell_deg) + 1
+    n_lon = int((max_lon - min_lon) / cell_deg) + 1
+
+    row = np.minimum(((store.lat - min_lat) / cell_deg).astype(np.int64), n_lat - 1)
+    col = np.minimum(((store.lon - min_lon) / cell_deg).astype(np.int64), n_lon - 1)
+    cell = row * n_lon + col
+    size = n_lat * n_lon
+    counts = np.bincount(cell, minlength=size).astype(np.float64)
+    sum_lat = np.bincount(cell, weights=store.lat, minlength=size)
+    sum_lon = np.bincount(cell, weights=store.lon, minlength=size)
+
+    # Cell centres for cells that have no points of their own
+    center_lat = min_lat + (np.arange(size) // n_lon + 0.5) * cell_deg
+    center_lon = min_lon + (np.arange(size) % n_lon + 0.5) * cell_deg
+    occupied = counts > 0
+    lat = np.where(occupied, sum_lat / np.where(occupied, counts, 1), center_lat)
+    lon = np.where(occupied, sum_lon / np.where(occupied, counts, 1), center_lon)
+
+    if smooth:
+        counts = _smooth(counts.reshape(n_lat, n_lon), smooth).ravel()
+    keep = counts > 0
+    return lat[keep], lon[keep], counts[keep]
+
+
+def heat_rows(store, cells=HEAT_GRID_CELLS, smooth=0, raw_limit=HEAT_RAW_POINT_LIMIT):
+    """HeatMap data for a CoordinateStore: raw points when there are few, weighted grid cells otherwise
+
+    Cell weights are counts scaled so the HEAT_WEIGHT_PERCENTILE-th busiest cell (and
+    anything busier) reaches full intensity. The payload is bounded by the grid size,
+    however many points there are.
+    """
+    if len(store) <= raw_limit:
+        return point_rows(store)
+    lat, lon, counts = density_grid(store, cells, smooth)
+    weight = np.minimum(counts / np.percentile(counts, HEAT_WEIGHT_PERCENTILE), 1)
+    return np.column_stack([
+        np.round(lat, COORDINATE_DECIMALS),
+        np.round(lon, COORDINATE_DECIMALS),
+        np.round(weight, 3)
+    ]).tolist()
+
+
+# Layer cache and in-page layer switching
+LAYER_CACHE_ENTRIES = 8  # Four visualization layers for each of the last two datasets
+
+
+def _element_copy(element):
+    """Copy of a folium element and its children, free to be added to another map
+
+    Adding an element to a map takes it away from the map it was on, so every map needs
+    its own elements. Attributes such as the point data are shared with the original,
+    not copied; rendering only reads them.
+    """
+    clone = copy.copy(element)
+    clone._parent = None
+    clone._children = OrderedDict()
+    for name, child in element._children.items():
+        clone.add_child(_element_copy(child), name=name)
+    return clone
+
+
+class LayerCache:
+    """Built folium layers keyed by (data fingerprint, layer name), least recently used dropped first
+
+    Building a layer validates and serializes every point into it, so a layer is built
+    once per dataset and every map made from the same data gets a copy of it (sharing
+    the point data). Safe to use from worker threads.
+    """
+
+    def __init__(self, max_entries=LAYER_CACHE_ENTRIES):
+        self.max_entries = max_entries
+        self._layers = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, fingerprint, name, build):
+        """A copy of the cached layer for (fingerprint, name), calling build() to make it on a miss"""
+        key = (fingerprint, name)
+        with self._lock:
+            if key in self._layers:
+                self._layers.move_to_end(key)
+                return _element_copy(self._layers[key])
+        layer = build()
+        with self._lock:
+            self._layers[key] = layer
+            while len(self._layers) > self.max_entries:
+                self._layers.popitem(last=False)
+        return _element_copy(layer)
+
+    def clear(self):
+        with self._lock:
+            self._layers.clear()
+
+
+# Script of the layer_switcher element
+_LAYER_SWITCHER = """
+    {% macro script(this, kwargs) %}
+    (function () {
+        var map = {{ this._parent.get_name() }};
+        var layers = {
+            {%- for key, layer in this.layers %}
+            {{ key|tojson }}: {{ layer.get_name() }},
+            {%- endfor %}
+        };
+        function showSelected() {
+            var selected = window.location.hash.slice(1);
+            if (!layers.hasOwnProperty(selected)) {
+                selected = {{ this.default|tojson }};
+            }
+            for (var key in layers) {
+                if (key === selected) {
+                    map.addLayer(layers[key]);
+                } else {
+                    map.removeLayer(layers[key]);
+                }
+            }
+        }
+        window.addEventListener('hashchange', showSelected);
+        showSelected();
+    })();
+    {% endmacro %}
+"""
+
+
+def layer_switcher(layers, default):
+    """Element that shows exactly one of several map layers, chosen by the page's URL fragment
+
+    Opening map.html#heatmap shows the layer registered as 'heatmap'; without a fragment
+    (or with an unknown one) the default layer is shown. Changing the fragment of an open
+    page switches layers without reloading it.
+    """
+    from branca.element import MacroElement
+    from jinja2 import Template
+
+    element = MacroElement()
+    element._name = 'LayerSwitcher'
+    element._template = Template(_LAYER_SWITCHER)
+    element.layers = list(layers.items())
+    element.default = default
+    return element
+
+
+def frame_fingerprint(df):
+    """Content hash of a DataFrame (values, column names and index), for small frames like the butcher list"""
+    import pandas as pd
+
+    digest = hashlib.blake2b(digest_size=20)
+    digest.update(json.dumps([str(c) for c in df.columns]).encode('utf-8'))
+    digest.update(pd.util.hash_pandas_object(df, index=True).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def map_url(html_path, layer=None):
+    """file:// URL of a saved map, selecting layer through the fragment read by layer_switcher"""
+    url = 'file://' + os.path.abspath(html_path)
+    return url + '#' + layer if layer else url
+
+
+# Rendered map pages
+# Next to this module rather than the working directory, so every launch shares one cache
+RENDER_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.map_cache')
+RENDER_CACHE_MAX_BYTES = 256 * 1024 * 1024
+RENDER_CACHE_VERSION = 2  # Bump when layer serialization changes so old pages stop matching
+
+
+class RenderCache:
+    """Rendered map HTML on disk, keyed by the data shown, the map type and the render options
+
+    Reloading a dataset or going back to an earlier view reads the page back instead of
+    building and serializing every layer again. Like IngestCache, entries are evicted
+    least recently used first once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory=RENDER_CACHE_DIR, max_bytes=RENDER_CACHE_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    def key(self, data, map_type, options):
+        """data is a JSON-serializable fingerprint of every dataset drawn on the map"""
+        payload = json.dumps(
+            {'data': data, 'map_type': map_type, 'options': options, 'version': RENDER_CACHE_VERSION},
+            sort_keys=True
+        )
+        return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, f"{key}.html")
+
+    def get(self, key):
+        """Cached HTML for key, or None on a miss"""
+        entry = self._entry_path(key)
+        try:
+            with open(entry, 'rb') as f:
+                html = f.read().decode('utf8')
+        except FileNotFoundError:
+            return None
+        # Refresh the modification time so eviction sees this entry as recently used
+        os.utime(entry)
+        return html
+
+    def put(self, key, html):
+        os.makedirs(self.directory, exist_ok=True)
+        entry = self._entry_path(key)
+        tmp_entry = f"{entry}.{threading.get_ident()}.tmp"
+        with open(tmp_entry, 'wb') as f:
+            f.write(html.encode('utf8'))
+        os.replace(tmp_entry, entry)
+        self.evict()
+
+    def evict(self):
+        """Delete least recently used entries until the cache fits in max_bytes"""
+        evict_lru(self.directory, self.max_bytes, '.html')
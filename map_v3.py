@@ -1,16 +1,19 @@
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-import pandas as pd
-import folium
-from folium.plugins import MarkerCluster, HeatMap
-from folium.vector_layers import PolyLine
 import webbrowser
 import os
-import math
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-from html2image import Html2Image
 import sys
+import numpy as np
+from distance_engine import (
+    haversine, butcher_labels, distance_frame,
+    open_distance_sink, temp_sink_path, read_distance_frame, save_distance_matrix,
+    iter_store_blocks, fill_distance_sink, distance_workers, DISTANCE_BLOCK_THRESHOLD
+)
+from coordinate_store import CoordinateStore, open_coordinate_file
+from ingest import MissingColumnsError, describe_rejections, ingest_csv, ingest_excel, ingest_locations
+from background import TaskRunner, report_blocks
+from virtual_table import VirtualTable
+from map_layers import LayerCache, RenderCache, bulk_markers, frame_fingerprint, heat_rows, layer_switcher, map_url, point_rows
 
 # Constants
 EARTH_RADIUS_KM = 6371
@@ -20,6 +23,10 @@ MAP_TYPES = {
     "Connected Wireframe": "wireframe",
     "Cluster Markers": "clusters"
 }
+DISTANCE_CHUNK_SIZE = 50_000  # Customers per block in blocked mode
+CUSTOMER_COLUMNS = ['customer_id', 'latitude', 'longitude']  # Columns kept when streaming customer CSVs
+BUTCHER_COLUMNS = ['butcher_id', 'latitude', 'longitude']
+MAP_RENDER_OPTIONS = {'layout': 'map_v3', 'zoom_start': 13, 'tiles': 'OpenStreetMap'}  # Part of the render cache key
 
 class CustomerMappingApp:
     def __init__(self, root):
@@ -31,10 +38,20 @@ class CustomerMappingApp:
         self.customer_df = None
         self.butcher_df = None
         self.distance_df = None
+        self.distance_sink = None
+        self.customer_store = None
+        self.customer_stats = None
+        self.butcher_store = None
         self.current_map = None
+        self.current_map_key = None
+        self.layer_cache = LayerCache()
+        self.render_cache = RenderCache()
         self.temp_html = "temp_map.html"
         self.current_map_type = "markers"
         
+        # Long-running stages run on worker threads
+        self.tasks = TaskRunner(root)
+        
         # Create tabs
         self.tab_control = ttk.Notebook(root)
         
@@ -101,6 +118,14 @@ class CustomerMappingApp:
         )
         btn_export_map.pack(side="left", padx=5)
         
+        # Cancel Button (stops map, distance and insight computations)
+        btn_cancel = ttk.Button(
+            control_frame,
+            text="Cancel",
+            command=self.cancel_tasks
+        )
+        btn_cancel.pack(side="left", padx=5)
+        
         # Map Display
         self.map_display = tk.Canvas(map_frame, bg="white")
         self.map_display.pack(fill="both", expand=True)
@@ -109,11 +134,30 @@ class CustomerMappingApp:
         self.status_label = ttk.Label(map_frame, text="Upload customer data to begin")
         self.status_label.pack(fill="x")
     
+    def cancel_tasks(self):
+        if self.tasks.cancel():
+            self.status_label.config(text="Cancelled")
+    
+    def show_progress(self, text):
+        self.status_label.config(text=text)
+    
     def change_map_type(self, *args):
         self.current_map_type = MAP_TYPES[self.map_type_var.get()]
-        if self.customer_df is not None:
+        if self.customer_store is None:
+            return
+        if not self.tasks.is_running('map') and self.current_map_key == self._map_key():
+            # Every visualization type is a layer of the saved map, so only the visible one changes.
+            # new=0 asks for the existing browser window; browsers that ignore it still open a tab.
+            webbrowser.open(map_url(self.temp_html, self.current_map_type), new=0)
+            self.status_label.config(text=f"Map generated ({self.map_type_var.get()})")
+        else:
             self.plot_customer_map()
     
+    def _map_key(self):
+        """Fingerprint of the data shown on the map"""
+        butchers = frame_fingerprint(self.butcher_df) if self.butcher_df is not None else None
+        return self.customer_store.fingerprint, butchers
+    
     def setup_distance_tab(self):
         # Distance Analysis Frame
         distance_frame = ttk.LabelFrame(self.tab_distance, text="Customer-Butcher Distance Analysis")
@@ -145,7 +189,10 @@ class CustomerMappingApp:
         x_scroll = ttk.Scrollbar(distance_frame, orient="horizontal", command=self.distance_tree.xview)
         x_scroll.pack(side="bottom", fill="x")
         
-        self.distance_tree.configure(yscrollcommand=y_scroll.set, xscrollcommand=x_scroll.set)
+        self.distance_tree.configure(xscrollcommand=x_scroll.set)
+        
+        # Only the visible rows are ever materialized in the Treeview
+        self.distance_table = VirtualTable(self.distance_tree, y_scroll)
     
     def setup_insights_tab(self):
         # Insights Frame
@@ -168,22 +215,10 @@ class CustomerMappingApp:
         self.insights_text = tk.Text(insights_frame, height=10, wrap=tk.WORD)
         self.insights_text.pack(fill="x", pady=5)
     
-    def safe_convert(self, value):
-        """Safely convert values to float, handling various edge cases"""
-        if pd.isna(value):
-            return None
-        try:
-            # Handle percentage signs, commas, etc.
-            if isinstance(value, str):
-                value = value.replace('%', '').replace(',', '').strip()
-            return float(value)
-        except (ValueError, TypeError):
-            return None
-    
     def load_customer_data(self):
         file_path = filedialog.askopenfilename(
             title="Select Customer Data File",
-            filetypes=[("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"), ("All files", "*.*")]
+            filetypes=[("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"), ("Coordinate files", "*.coords"), ("All files", "*.*")]
         )
         
         if not file_path:
@@ -191,34 +226,28 @@ class CustomerMappingApp:
             
         try:
             # Read file
-            if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path)
+            if file_path.endswith('.coords'):
+                # Pre-converted binary file: memory-map the arrays instead of parsing. The
+                # store is the customer data; no DataFrame is built from it.
+                store = open_coordinate_file(file_path)
+                df = None
+                stats = store.running_stats()
             else:
-                df = pd.read_excel(file_path)
-            
-            # Clean column names
-            df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
-            
-            # Check required columns
-            required = {'customer_id', 'latitude', 'longitude'}
-            missing = required - set(df.columns)
-            
-            if missing:
-                messagebox.showerror(
-                    "Missing Columns",
-                    f"These required columns are missing: {', '.join(missing)}\n"
-                    f"Available columns: {', '.join(df.columns)}"
-                )
-                return
-            
-            # Convert coordinates
-            df['latitude'] = df['latitude'].apply(self.safe_convert)
-            df['longitude'] = df['longitude'].apply(self.safe_convert)
+                if file_path.endswith('.csv'):
+                    # Stream in chunks, keeping only the columns the app uses and cleaning as we go
+                    df, stats = ingest_csv(file_path, CUSTOMER_COLUMNS)
+                else:
+                    # Parsed and cleaned frames are cached next to the source file
+                    df, stats = ingest_excel(file_path, CUSTOMER_COLUMNS)
+                
+                # Clean column names
+                df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
+                store = CoordinateStore.from_frame(df, 'customer_id') if len(df) else None
             
-            # Remove invalid rows
-            initial_count = len(df)
-            df = df.dropna(subset=['latitude', 'longitude'])
-            final_count = len(df)
+            # Coordinates were converted and invalid rows removed during ingest
+            initial_count = stats.rows_read
+            rejected = stats.rejected
+            final_count = 0 if store is None else len(store)
             
             if final_count == 0:
                 messagebox.showerror(
@@ -227,16 +256,28 @@ class CustomerMappingApp:
                 )
                 return
             
+            # Results still being computed for the old data are now stale
+            self.tasks.cancel()
             self.customer_df = df
+            self.customer_store = store
+            self.customer_stats = stats
             
             # Update status
             msg = f"Loaded {final_count} customer records"
+            if stats.backfilled:
+                msg += f" ({stats.backfilled} filled from map links)"
             if final_count < initial_count:
-                msg += f" (dropped {initial_count-final_count} invalid records)"
+                msg += f" (dropped {initial_count-final_count} invalid records: {describe_rejections(rejected)})"
             self.status_label.config(text=msg)
             
             self.plot_customer_map()
             
+        except MissingColumnsError as e:
+            messagebox.showerror(
+                "Missing Columns",
+                f"These required columns are missing: {', '.join(e.missing)}\n"
+                f"Available columns: {', '.join(e.available)}"
+            )
         except Exception as e:
             messagebox.showerror(
                 "Loading Error",
@@ -254,34 +295,14 @@ class CustomerMappingApp:
             return
             
         try:
-            # Read file
-            if file_path.endswith('.csv'):
-                df = pd.read_csv(file_path)
-            else:
-                df = pd.read_excel(file_path)
+            # Read file, converting coordinates and removing invalid rows; a missing
+            # required column raises MissingColumnsError
+            df, stats = ingest_locations(file_path, BUTCHER_COLUMNS)
             
             # Clean column names
             df.columns = df.columns.str.strip().str.lower().str.replace(' ', '_')
             
-            # Check required columns
-            required = {'butcher_id', 'latitude', 'longitude'}
-            missing = required - set(df.columns)
-            
-            if missing:
-                messagebox.showerror(
-                    "Missing Columns",
-                    f"These required columns are missing: {', '.join(missing)}\n"
-                    f"Available columns: {', '.join(df.columns)}"
-                )
-                return
-            
-            # Convert coordinates
-            df['latitude'] = df['latitude'].apply(self.safe_convert)
-            df['longitude'] = df['longitude'].apply(self.safe_convert)
-            
-            # Remove invalid rows
-            initial_count = len(df)
-            df = df.dropna(subset=['latitude', 'longitude'])
+            initial_count, rejected = stats.rows_read, stats.rejected
             final_count = len(df)
             
             if final_count == 0:
@@ -291,16 +312,25 @@ class CustomerMappingApp:
                 )
                 return
             
+            # Results still being computed for the old data are now stale
+            self.tasks.cancel()
             self.butcher_df = df
+            self.butcher_store = CoordinateStore.from_frame(df, 'butcher_id')
             
             # Update status
             msg = f"Loaded {final_count} butcher records"
             if final_count < initial_count:
-                msg += f" (dropped {initial_count-final_count} invalid records)"
+                msg += f" (dropped {initial_count-final_count} invalid records: {describe_rejections(rejected)})"
             self.status_label.config(text=msg)
             
             self.plot_customer_map()
             
+        except MissingColumnsError as e:
+            messagebox.showerror(
+                "Missing Columns",
+                f"These required columns are missing: {', '.join(e.missing)}\n"
+                f"Available columns: {', '.join(e.available)}"
+            )
         except Exception as e:
             messagebox.showerror(
                 "Loading Error",
@@ -309,65 +339,106 @@ class CustomerMappingApp:
             self.status_label.config(text="Error loading butcher data")
     
     def plot_customer_map(self):
-        if self.customer_df is None:
+        if self.customer_store is None:
             return
-            
-        try:
-            # Create map centered on mean of customer locations
-            mean_lat = self.customer_df['latitude'].mean()
-            mean_lon = self.customer_df['longitude'].mean()
-            
-            self.current_map = folium.Map(
-                location=[mean_lat, mean_lon],
-                zoom_start=13,
-                tiles='OpenStreetMap',
-                control_scale=True
-            )
-            
-            # Add different visualization types based on selection
-            if self.current_map_type == "markers":
-                self._add_markers()
-            elif self.current_map_type == "heatmap":
-                self._add_heatmap()
-            elif self.current_map_type == "wireframe":
-                self._add_wireframe()
-            elif self.current_map_type == "clusters":
-                self._add_clusters()
-            
-            # Add butcher markers if available (regardless of visualization type)
-            if self.butcher_df is not None:
-                self._add_butcher_markers()
+        
+        map_type = self.current_map_type
+        map_label = self.map_type_var.get()
+        
+        def work(task):
+            # Worker thread: build and render the map, leaving the file and browser to the Tk thread
+            task.progress(f"Building map ({map_label})...")
+            key = self._map_key()
+            render_key = self.render_cache.key(key, map_type, MAP_RENDER_OPTIONS)
+            html = self.render_cache.get(render_key)
+            if html is not None:
+                return key, None, html
+            m = self._build_map(map_type)
+            task.progress(f"Rendering map ({map_label})...")
+            html = m.get_root().render()
+            self.render_cache.put(render_key, html)
+            return key, m, html
+        
+        def done(result):
+            self.current_map_key, self.current_map, html = result
             
             # Save to temporary HTML and display
-            self.current_map.save(self.temp_html)
-            webbrowser.open('file://' + os.path.abspath(self.temp_html))
-            
-            self.status_label.config(text=f"Map generated ({self.map_type_var.get()})")
+            with open(self.temp_html, 'wb') as f:
+                f.write(html.encode('utf8'))
+            webbrowser.open(map_url(self.temp_html, self.current_map_type))
             
-        except Exception as e:
+            self.status_label.config(text=f"Map generated ({map_label})")
+        
+        def failed(e):
             messagebox.showerror(
                 "Mapping Error",
                 f"Could not generate map:\n{str(e)}"
             )
             self.status_label.config(text="Error generating map")
+        
+        self.tasks.start('map', work, done, failed, self.show_progress)
     
-    def _add_markers(self):
+    def _build_map(self, map_type):
+        """Folium map of the loaded data with every visualization type as a layer, map_type shown first"""
+        import folium
+        
+        # Create map centered on mean of customer locations
+        m = folium.Map(
+            location=[self.customer_store.mean_lat, self.customer_store.mean_lon],
+            zoom_start=MAP_RENDER_OPTIONS['zoom_start'],
+            tiles=MAP_RENDER_OPTIONS['tiles'],
+            control_scale=True
+        )
+        
+        # One layer per visualization type, built once per customer dataset
+        builders = {
+            "markers": self._add_markers,
+            "heatmap": self._add_heatmap,
+            "wireframe": self._add_wireframe,
+            "clusters": self._add_clusters
+        }
+        fingerprint = self.customer_store.fingerprint
+        layers = {}
+        for label, kind in MAP_TYPES.items():
+            layers[kind] = self.layer_cache.get(
+                fingerprint, kind, lambda: self._customer_layer(label, builders[kind])
+            )
+            layers[kind].add_to(m)
+        
+        # Add butcher markers if available (regardless of visualization type)
+        if self.butcher_df is not None:
+            butchers = folium.FeatureGroup(name="Butchers").add_to(m)
+            self._add_butcher_markers(butchers)
+        
+        # The page shows the layer named in its URL fragment, map_type by default
+        layer_switcher(layers, map_type).add_to(m)
+        folium.LayerControl().add_to(m)
+        return m
+    
+    def _customer_layer(self, name, add_to_layer):
+        import folium
+        
+        layer = folium.FeatureGroup(name=name)
+        add_to_layer(layer)
+        return layer
+    
+    def _add_markers(self, layer):
         """Add individual markers for each customer"""
-        for idx, row in self.customer_df.iterrows():
-            folium.Marker(
-                location=[row['latitude'], row['longitude']],
-                popup=f"Customer ID: {row['customer_id']}",
-                icon=folium.Icon(color='blue', icon='user')
-            ).add_to(self.current_map)
+        # One data array turned into markers by the browser, with clustering switched off
+        bulk_markers(self.customer_store, "Customer ID: ", cluster=False).add_to(layer)
     
-    def _add_heatmap(self):
+    def _add_heatmap(self, layer):
         """Add heatmap visualization"""
-        heat_data = [[row['latitude'], row['longitude']] for _, row in self.customer_df.iterrows()]
-        HeatMap(heat_data, name="Customer Density", radius=15).add_to(self.current_map)
+        from folium.plugins import HeatMap
+        
+        HeatMap(heat_rows(self.customer_store), name="Customer Density", radius=15).add_to(layer)
     
-    def _add_wireframe(self):
+    def _add_wireframe(self, layer):
         """Add connected lines between customer locations"""
-        locations = [[row['latitude'], row['longitude']] for _, row in self.customer_df.iterrows()]
+        import folium
+        from folium.vector_layers import PolyLine
+        
+        locations = point_rows(self.customer_store)
         
         # Connect all points in sequence
         PolyLine(
@@ -376,13 +447,10 @@ class CustomerMappingApp:
             weight=2,
             opacity=0.7,
             tooltip="Customer Connections"
-        ).add_to(self.current_map)
+        ).add_to(layer)
         
         # Add bounding box (new code)
-        min_lat = self.customer_df['latitude'].min()
-        max_lat = self.customer_df['latitude'].max()
-        min_lon = self.customer_df['longitude'].min()
-        max_lon = self.customer_df['longitude'].max()
+        min_lat, min_lon, max_lat, max_lon = self.customer_store.bbox
         
         folium.Rectangle(
             bounds=[[min_lat, min_lon], [max_lat, max_lon]],
@@ -391,190 +459,110 @@ class CustomerMappingApp:
             fill_color='#ffff00',
             fill_opacity=0.2,
             tooltip=f"Coverage Area: {self.calculate_area():.2f} km²"
-        ).add_to(self.current_map)
+        ).add_to(layer)
 
     def calculate_area(self):
         """Calculate approximate area covered by customers in square kilometers"""
-        min_lat = self.customer_df['latitude'].min()
-        max_lat = self.customer_df['latitude'].max()
-        min_lon = self.customer_df['longitude'].min()
-        max_lon = self.customer_df['longitude'].max()
-        
-        # Convert degrees to kilometers (approx)
-        lat_span = (max_lat - min_lat) * 111  # 1 degree ≈ 111 km
-        lon_span = (max_lon - min_lon) * 111 * math.cos(math.radians((min_lat + max_lat)/2))
-        
-        return abs(lat_span * lon_span)
-
-    def generate_insights(self):
-        if self.customer_df is None:
-            messagebox.showwarning(
-                "No Data",
-                "No customer data available for insights"
-            )
-            return
-            
-        try:
-            # Clear previous content
-            self.insights_text.delete(1.0, tk.END)
-            for widget in self.insights_canvas.winfo_children():
-                widget.destroy()
-            
-            # Basic statistics
-            num_customers = len(self.customer_df)
-            avg_lat = self.customer_df['latitude'].mean()
-            avg_lon = self.customer_df['longitude'].mean()
-            
-            # Geographic spread
-            lat_range = self.customer_df['latitude'].max() - self.customer_df['latitude'].min()
-            lon_range = self.customer_df['longitude'].max() - self.customer_df['longitude'].min()
-            
-            # Prepare insights text
-            insights = [
-                "CUSTOMER BASE INSIGHTS",
-                "="*40,
-                f"Total customers: {num_customers}",
-                f"\nGEOGRAPHIC COVERAGE:",
-                f"Bounding box area: {self.calculate_area():.2f} km²",
-                f"Latitude range: {lat_range:.6f}° (~{lat_range*111:.2f} km)",
-                f"Longitude range: {lon_range:.6f}° (~{lon_range*111*math.cos(math.radians(avg_lat)):.2f} km)",
-                f"\nDENSITY ANALYSIS:",
-                f"Customer density: {num_customers/self.calculate_area():.2f} customers/km²",
-                f"Average distance between customers: {self.avg_customer_distance():.2f} km",
-            ]
+        # 1 degree ≈ 111 km, scaled by the cached cos(latitude) for longitude
+        return self.customer_store.area_km2(km_per_degree=111)
 
-            # New detailed spatial analysis
-            insights.extend([
-                "\nSPATIAL PATTERNS:",
-                f"- Distribution type: {self.identify_distribution_pattern()}",
-                f"- Cluster count: {self.find_cluster_count()}",
-                f"- Outlier locations: {self.find_outlier_count()}",
-                "\nINFRASTRUCTURE ANALYSIS:"
-            ])
-            
-            if self.butcher_df is not None:
-                insights.extend([
-                    f"Butcher coverage density: {len(self.butcher_df)/self.calculate_area():.2f} butchers/km²",
-                    f"Average butcher-customer distance: {self.avg_butcher_distance():.2f} km",
-                    f"Optimal new butcher location: {self.find_optimal_location()}"
-                ])
-            
-            # Add markers at each point
-            for idx, row in self.customer_df.iterrows():
-                folium.CircleMarker(
-                    location=[row['latitude'], row['longitude']],
-                    radius=5,
-                    color='blue',
-                    fill=True,
-                    fill_color='blue',
-                    popup=f"Customer ID: {row['customer_id']}"
-                ).add_to(self.current_map)
-            
-            # Add clusters
-            customer_cluster = MarkerCluster(name="Customers").add_to(self.current_map)
-            
-            for idx, row in self.customer_df.iterrows():
-                folium.Marker(
-                    location=[row['latitude'], row['longitude']],
-                    popup=f"Customer ID: {row['customer_id']}",
-                    icon=folium.Icon(color='blue', icon='user')
-                ).add_to(customer_cluster)
-            
-            # Add butcher markers if available (regardless of visualization type)
-            if self.butcher_df is not None:
-                self._add_butcher_markers()
-            
-            # Save to temporary HTML and display
-            self.current_map.save(self.temp_html)
-            webbrowser.open('file://' + os.path.abspath(self.temp_html))
-            
-            self.status_label.config(text=f"Map generated ({self.map_type_var.get()})")
-            
-        except Exception as e:
-            messagebox.showerror(
-                "Mapping Error",
-                f"Could not generate map:\n{str(e)}"
-            )
-            self.status_label.config(text="Error generating map")
-    
-    def _add_clusters(self):
+    def _add_clusters(self, layer):
         """Add clustered markers"""
-        customer_cluster = MarkerCluster(name="Customers").add_to(self.current_map)
-        
-        for idx, row in self.customer_df.iterrows():
-            folium.Marker(
-                location=[row['latitude'], row['longitude']],
-                popup=f"Customer ID: {row['customer_id']}",
-                icon=folium.Icon(color='blue', icon='user')
-            ).add_to(customer_cluster)
+        # Clustered in the browser from a single data array
+        bulk_markers(self.customer_store, "Customer ID: ", name="Customers").add_to(layer)
     
-    def _add_butcher_markers(self):
+    def _add_butcher_markers(self, layer):
         """Add butcher markers to the map"""
+        import folium
+        
         for idx, row in self.butcher_df.iterrows():
             butcher_name = row.get('butcher_name', row['butcher_id'])
             folium.Marker(
                 location=[row['latitude'], row['longitude']],
                 popup=f"Butcher: {butcher_name}",
                 icon=folium.Icon(color='red', icon='cutlery')
-            ).add_to(self.current_map)
+            ).add_to(layer)
     
     def calculate_distances(self):
-        if self.customer_df is None or self.butcher_df is None:
+        if self.customer_store is None or self.butcher_df is None:
             messagebox.showwarning(
                 "Missing Data",
                 "Please load both customer and butcher data first"
             )
             return
             
-        try:
-            # Calculate haversine distances between all customers and butchers
-            distances = []
-            
-            for _, cust in self.customer_df.iterrows():
-                row = {'customer_id': cust['customer_id']}
-                
-                for _, butcher in self.butcher_df.iterrows():
-                    # Haversine formula
-                    lat1, lon1 = math.radians(cust['latitude']), math.radians(cust['longitude'])
-                    lat2, lon2 = math.radians(butcher['latitude']), math.radians(butcher['longitude'])
-                    
-                    dlat = lat2 - lat1
-                    dlon = lon2 - lon1
-                    
-                    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-                    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-                    
-                    distance_km = EARTH_RADIUS_KM * c
-                    
-                    butcher_name = butcher.get('butcher_name', butcher['butcher_id'])
-                    row[f"dist_to_{butcher_name}"] = round(distance_km, 2)
-                
-                distances.append(row)
-            
-            self.distance_df = pd.DataFrame(distances)
+        # Calculate haversine distances between all customers and butchers
+        butcher_names = butcher_labels(self.butcher_df, 'butcher_name', 'butcher_id')
+        column_labels = [f"dist_to_{name}" for name in butcher_names]
+        customer_store, butcher_store = self.customer_store, self.butcher_store
+        
+        def work(task):
+            # Worker thread: only uses the stores captured above, never self
+            if len(customer_store) * len(butcher_store) > DISTANCE_BLOCK_THRESHOLD:
+                # Too large for memory: compute in customer chunks straight to disk, split across
+                # DISTANCE_WORKERS processes when the matrix is big enough to repay starting them
+                sink = open_distance_sink(temp_sink_path(), customer_store.ids, column_labels)
+                try:
+                    fill_distance_sink(
+                        customer_store, butcher_store, sink, distance_workers(), DISTANCE_CHUNK_SIZE,
+                        progress=lambda done, total: task.progress(f"Calculating distances: {done:,}/{total:,} rows")
+                    )
+                except BaseException:
+                    sink.discard()
+                    raise
+                return None, sink
+            
+            blocks = report_blocks(
+                task,
+                iter_store_blocks(customer_store, butcher_store, DISTANCE_CHUNK_SIZE),
+                len(customer_store),
+                "Calculating distances"
+            )
+            distances = np.vstack([block for _, block in blocks])
+            return distance_frame(customer_store.ids, 'customer_id', column_labels, distances), None
+        
+        def done(result):
+            if self.distance_sink is not None:
+                self.distance_sink.discard()
+            self.distance_df, self.distance_sink = result
             
             # Display in Treeview
             self.display_distance_matrix()
             
-            self.status_label.config(text=f"Calculated distances for {len(self.customer_df)} customers")
-            
-        except Exception as e:
+            self.status_label.config(text=f"Calculated distances for {len(customer_store)} customers")
+        
+        def failed(e):
             messagebox.showerror(
                 "Distance Calculation Error",
                 f"Could not calculate distances:\n{str(e)}"
             )
             self.status_label.config(text="Error calculating distances")
+        
+        def discard(result):
+            # A superseded run may already have written its matrix to disk
+            if result[1] is not None:
+                result[1].discard()
+        
+        self.tasks.start('distances', work, done, failed, self.show_progress, discard)
     
     def display_distance_matrix(self):
-        # Clear existing tree
-        for i in self.distance_tree.get_children():
-            self.distance_tree.delete(i)
-        
-        if self.distance_df is None or self.distance_df.empty:
+        if self.distance_df is None and self.distance_sink is not None:
+            # Blocked mode: rows are read from the on-disk matrix as they scroll into view
+            sink = self.distance_sink
+            display_df = read_distance_frame(sink, 'customer_id', 0, 0)
+            row_count = sink.shape[0]
+            fetch = lambda start, stop: read_distance_frame(sink, 'customer_id', start, stop).values.tolist()
+        else:
+            display_df = self.distance_df
+            row_count = 0 if display_df is None else len(display_df)
+            fetch = lambda start, stop: display_df.iloc[start:stop].values.tolist()
+        
+        if display_df is None or row_count == 0:
+            self.distance_table.clear()
             return
         
         # Set up columns
-        columns = list(self.distance_df.columns)
+        columns = list(display_df.columns)
         self.distance_tree["columns"] = columns
         self.distance_tree["show"] = "headings"
         
@@ -583,12 +571,11 @@ class CustomerMappingApp:
             self.distance_tree.heading(col, text=col.replace('_', ' ').title())
             self.distance_tree.column(col, width=120, anchor=tk.CENTER)
         
-        # Add data rows
-        for _, row in self.distance_df.iterrows():
-            self.distance_tree.insert("", "end", values=list(row))
+        # Add data rows (only the visible window is inserted)
+        self.distance_table.show(row_count, fetch)
     
     def export_distance_matrix(self):
-        if self.distance_df is None:
+        if self.distance_df is None and self.distance_sink is None:
             messagebox.showwarning(
                 "No Data",
                 "No distance data to export"
@@ -596,8 +583,9 @@ class CustomerMappingApp:
             return
             
         file_path = filedialog.asksaveasfilename(
-            defaultextension=".xlsx",
-            filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv"), ("All files", "*.*")],
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("Parquet files", "*.parquet"), ("Feather files", "*.feather"),
+                       ("Excel files (slow)", "*.xlsx"), ("All files", "*.*")],
             title="Save Distance Matrix As"
         )
         
@@ -605,10 +593,9 @@ class CustomerMappingApp:
             return
             
         try:
-            if file_path.endswith('.csv'):
-                self.distance_df.to_csv(file_path, index=False)
-            else:
-                self.distance_df.to_excel(file_path, index=False)
+            # Blocked mode streams from the on-disk matrix; the format follows the file extension
+            matrix = self.distance_df if self.distance_df is not None else self.distance_sink
+            save_distance_matrix(matrix, file_path, 'customer_id', chunk_size=DISTANCE_CHUNK_SIZE)
             
             self.status_label.config(text=f"Distance matrix saved to {os.path.basename(file_path)}")
             messagebox.showinfo(
@@ -623,7 +610,7 @@ class CustomerMappingApp:
             self.status_label.config(text="Error saving distance matrix")
     
     def export_map_image(self):
-        if not hasattr(self, 'current_map') or self.current_map is None:
+        if self.current_map_key is None:
             messagebox.showwarning(
                 "No Map",
                 "No map available to export. Please generate a map first."
@@ -640,51 +627,66 @@ class CustomerMappingApp:
             return
             
         try:
-            hti = Html2Image()
-            
-            # Save screenshot (fix missing closing parenthesis)
-            hti.screenshot(
-                html_file=self.temp_html,
-                save_as=file_path,
-                size=(1200, 800)
-            )  # Added closing parenthesis here
+            try:
+                from html2image import Html2Image
+                hti = Html2Image()
+                
+                hti.screenshot(
+                    url=map_url(self.temp_html, self.current_map_type),
+                    save_as=file_path,
+                    size=(1200, 800)
+                )
+                method = ""
+            except Exception as browser_error:
+                # html2image or Chrome unavailable: draw the map straight to the image instead
+                self._save_static_image(file_path)
+                method = f"\n\nDrawn without a browser ({browser_error})"
             
             self.status_label.config(text=f"Map image saved to {os.path.basename(file_path)}")
             messagebox.showinfo(
                 "Export Successful",
-                f"Map image saved successfully to:\n{file_path}"
+                f"Map image saved successfully to:\n{file_path}{method}"
             )
             
         except Exception as e:
             messagebox.showerror(
                 "Export Error",
-                f"Could not save map image:\n{str(e)}\n\n"
-                "Please ensure you have html2image installed (pip install html2image)"
+                f"Could not save map image:\n{str(e)}"
             )
             self.status_label.config(text="Error saving map image")
     
+    def _save_static_image(self, file_path):
+        """Draw the current map type, butchers and data bounds to file_path with PIL"""
+        from static_map import render_static_map, save_image
+        
+        customers = 'density' if self.current_map_type == 'heatmap' else 'points'
+        names = butcher_labels(self.butcher_df, 'butcher_name', 'butcher_id') if self.butcher_df is not None else None
+        image = render_static_map(self.customer_store, self.butcher_store, names, layers=(customers, 'bbox', 'butchers'))
+        save_image(image, file_path)
+    
     def generate_insights(self):
-        if self.customer_df is None:
+        if self.customer_store is None:
             messagebox.showwarning(
                 "No Data",
                 "No customer data available for insights"
             )
             return
-            
-        try:
-            # Clear previous content
-            self.insights_text.delete(1.0, tk.END)
-            for widget in self.insights_canvas.winfo_children():
-                widget.destroy()
+        
+        customer_store, butcher_df, distance_df = self.customer_store, self.butcher_df, self.distance_df
+        map_label = self.map_type_var.get()
+        
+        def work(task):
+            # Worker thread: builds the insights text from the data captured above
+            task.progress("Generating insights...")
             
             # Basic statistics
-            num_customers = len(self.customer_df)
-            avg_lat = self.customer_df['latitude'].mean()
-            avg_lon = self.customer_df['longitude'].mean()
+            num_customers = len(customer_store)
+            avg_lat = customer_store.mean_lat
+            avg_lon = customer_store.mean_lon
             
             # Geographic spread
-            lat_range = self.customer_df['latitude'].max() - self.customer_df['latitude'].min()
-            lon_range = self.customer_df['longitude'].max() - self.customer_df['longitude'].min()
+            lat_range = customer_store.lat_range
+            lon_range = customer_store.lon_range
             
             # Prepare insights text
             insights = [
@@ -698,16 +700,16 @@ class CustomerMappingApp:
             ]
             
             # Add butcher-related insights if available
-            if self.butcher_df is not None:
+            if butcher_df is not None:
                 insights.extend([
                     f"\nBUTCHER COVERAGE:",
-                    f"Number of butchers: {len(self.butcher_df)}"
+                    f"Number of butchers: {len(butcher_df)}"
                 ])
                 
-                if self.distance_df is not None:
+                if distance_df is not None:
                     # Calculate average distances
-                    dist_cols = [col for col in self.distance_df.columns if col.startswith('dist_to_')]
-                    avg_distances = self.distance_df[dist_cols].mean()
+                    dist_cols = [col for col in distance_df.columns if col.startswith('dist_to_')]
+                    avg_distances = distance_df[dist_cols].mean()
                     
                     insights.append("\nAVERAGE DISTANCES TO BUTCHERS:")
                     for col, dist in avg_distances.items():
@@ -717,11 +719,18 @@ class CustomerMappingApp:
             # Add recommendations based on visualization type
             insights.extend([
                 "\nRECOMMENDATIONS:",
-                f"- Current visualization: {self.map_type_var.get()}",
+                f"- Current visualization: {map_label}",
                 "- Consider opening new butcher shops in areas with high customer density",
                 "- Analyze customer distribution patterns for targeted marketing",
                 "- Use distance matrix to optimize delivery routes"
             ])
+            return insights
+        
+        def done(insights):
+            # Clear previous content
+            self.insights_text.delete(1.0, tk.END)
+            for widget in self.insights_canvas.winfo_children():
+                widget.destroy()
             
             # Display insights
             self.insights_text.insert(tk.END, "\n".join(insights))
@@ -730,27 +739,32 @@ class CustomerMappingApp:
             self.create_visualizations()
             
             self.status_label.config(text="Customer insights generated")
-            
-        except Exception as e:
+        
+        def failed(e):
             messagebox.showerror(
                 "Insights Error",
                 f"Could not generate insights:\n{str(e)}"
             )
             self.status_label.config(text="Error generating insights")
+        
+        self.tasks.start('insights', work, done, failed, self.show_progress)
     
     def create_visualizations(self):
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        
         # Create figure
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(12, 5))
         fig.suptitle("Customer Distribution Analysis")
         
         # Histogram of latitudes
-        ax1.hist(self.customer_df['latitude'], bins=15, color='skyblue', edgecolor='black')
+        ax1.hist(self.customer_store.lat, bins=15, color='skyblue', edgecolor='black')
         ax1.set_title('Latitude Distribution')
         ax1.set_xlabel('Latitude')
         ax1.set_ylabel('Number of Customers')
         
         # Histogram of longitudes
-        ax2.hist(self.customer_df['longitude'], bins=15, color='lightgreen', edgecolor='black')
+        ax2.hist(self.customer_store.lon, bins=15, color='lightgreen', edgecolor='black')
         ax2.set_title('Longitude Distribution')
         ax2.set_xlabel('Longitude')
         ax2.set_ylabel('Number of Customers')
@@ -762,47 +776,9 @@ class CustomerMappingApp:
         canvas.draw()
         canvas.get_tk_widget().pack(fill="both", expand=True)
 
-    def avg_customer_distance(self):
-        """Calculate average distance between all customer pairs"""
-        distances = []
-        points = self.customer_df[['latitude', 'longitude']].values
-        for i in range(len(points)):
-            for j in range(i+1, len(points)):
-                distances.append(self.haversine(*points[i], *points[j]))
-        return np.mean(distances) if distances else 0
-
-    def identify_distribution_pattern(self):
-        """Identify spatial distribution pattern"""
-        from sklearn.neighbors import NearestNeighbors
-        points = self.customer_df[['latitude', 'longitude']].values
-        nbrs = NearestNeighbors(n_neighbors=2).fit(points)
-        distances, _ = nbrs.kneighbors(points)
-        avg_neighbor_dist = np.mean(distances[:,1]) * 111  # Convert degrees to km
-        
-        if avg_neighbor_dist < 1:
-            return "Clustered Urban Distribution"
-        elif avg_neighbor_dist < 5:
-            return "Suburban Spread"
-        return "Rural/Sparse Distribution"
-
-    def find_cluster_count(self):
-        """Estimate number of natural clusters using DBSCAN"""
-        from sklearn.cluster import DBSCAN
-        points = self.customer_df[['latitude', 'longitude']].values
-        clustering = DBSCAN(eps=0.1, min_samples=5).fit(points)
-        return len(set(clustering.labels_)) - (1 if -1 in clustering.labels_ else 0)
-
-    def find_optimal_location(self):
-        """Calculate optimal location using weighted centroid"""
-        if self.butcher_df is None:
-            return "N/A - No butcher data"
-            
-        all_points = pd.concat([
-            self.customer_df[['latitude', 'longitude']],
-            self.butcher_df[['latitude', 'longitude']]
-        ], ignore_index=True)
-        
-        return f"{all_points['latitude'].mean():.6f}°N, {all_points['longitude'].mean():.6f}°E"
+    def haversine(self, lat1, lon1, lat2, lon2):
+        """Calculate the great circle distance between two points in kilometers"""
+        return haversine(lat1, lon1, lat2, lon2)
 
 if __name__ == "__main__":
     root = tk.Tk()
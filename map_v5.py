@@ -1,18 +1,33 @@
 import tkinter as tk
 from tkinter import ttk, filedialog
-import pandas as pd
-import folium
-from folium.plugins import MarkerCluster, HeatMap
-from io import BytesIO
-from PIL import Image, ImageTk
 import webbrowser
 import os
 import math
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+import time
+import numpy as np
+from distance_engine import (
+    haversine, butcher_labels, distance_frame,
+    open_distance_sink, temp_sink_path, read_distance_frame, save_distance_matrix,
+    iter_store_blocks, fill_distance_sink, distance_workers, DISTANCE_BLOCK_THRESHOLD
+)
+from spatial_index import GeoIndex
+from coordinate_store import CoordinateStore, open_coordinate_file
+from ingest import MissingColumnsError, ingest_csv, ingest_excel, ingest_locations
+from background import TaskRunner, report_blocks
+from virtual_table import VirtualTable
+from map_export import MapExporter
+from map_layers import RenderCache, bulk_markers, frame_fingerprint, heat_rows
+from tiles import TileServer, cached_tile_pyramid, tile_layers
 
 # Constants
 EARTH_RADIUS_KM = 6371
+DISTANCE_CHUNK_SIZE = 50_000  # Customers per block in blocked mode
+SERVICE_RADIUS_KM = 5
+TILE_POINT_THRESHOLD = 200_000  # Customers above which the map shows pre-rendered tiles from a local server
+PLOT_MAX_POINTS = 20_000  # Customers drawn in the insights scatter plot; larger sets are thinned evenly
+CUSTOMER_COLUMNS = ['customer id', 'latitude', 'longitude']  # Columns kept when streaming customer CSVs
+BUTCHER_COLUMNS = ['butcher id', 'butcher name', 'latitude', 'longitude']
+MAP_RENDER_OPTIONS = {'layout': 'map_v5', 'zoom_start': 12, 'tiles': 'OpenStreetMap', 'service_radius_km': SERVICE_RADIUS_KM}  # Part of the render cache key
 
 class CustomerMappingApp:
     def __init__(self, root):
@@ -24,6 +39,23 @@ class CustomerMappingApp:
         self.customer_df = None
         self.butcher_df = None
         self.distance_df = None
+        self.distance_sink = None
+        self.customer_store = None
+        self.customer_stats = None
+        self.butcher_store = None
+        self.customer_index = None
+        self.butcher_index = None
+        self.nearest_butcher = None
+        
+        # Rendered map pages, reused when the same data is shown again
+        self.render_cache = RenderCache()
+        self.tile_server = None
+        
+        # Headless browser for image exports, started by the first export and kept open
+        self.exporter = None
+        
+        # Long-running stages run on worker threads
+        self.tasks = TaskRunner(root)
         
         # Create tabs
         self.tab_control = ttk.Notebook(root)
@@ -80,6 +112,14 @@ class CustomerMappingApp:
         )
         btn_export_map.pack(side="left", padx=5)
         
+        # Cancel Button (stops map, distance and insight computations)
+        btn_cancel = ttk.Button(
+            control_frame,
+            text="Cancel",
+            command=self.cancel_tasks
+        )
+        btn_cancel.pack(side="left", padx=5)
+        
         # Map Display
         self.map_display = tk.Canvas(map_frame, bg="white")
         self.map_display.pack(fill="both", expand=True)
@@ -88,6 +128,13 @@ class CustomerMappingApp:
         self.status_label = ttk.Label(map_frame, text="Upload customer data to begin")
         self.status_label.pack(fill="x")
     
+    def cancel_tasks(self):
+        if self.tasks.cancel():
+            self.status_label.config(text="Cancelled")
+    
+    def show_progress(self, text):
+        self.status_label.config(text=text)
+    
     def setup_distance_tab(self):
         # Distance Analysis Frame
         distance_frame = ttk.LabelFrame(self.tab_distance, text="Customer-Butcher Distance Analysis")
@@ -119,7 +166,10 @@ class CustomerMappingApp:
         x_scroll = ttk.Scrollbar(distance_frame, orient="horizontal", command=self.distance_tree.xview)
         x_scroll.pack(side="bottom", fill="x")
         
-        self.distance_tree.configure(yscrollcommand=y_scroll.set, xscrollcommand=x_scroll.set)
+        self.distance_tree.configure(xscrollcommand=x_scroll.set)
+        
+        # Only the visible rows are ever materialized in the Treeview
+        self.distance_table = VirtualTable(self.distance_tree, y_scroll)
     
     def setup_insights_tab(self):
         # Insights Frame
@@ -145,43 +195,54 @@ class CustomerMappingApp:
     def load_customer_data(self):
         file_path = filedialog.askopenfilename(
             title="Select Customer Data File",
-            filetypes=[("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"), ("All files", "*.*")]
+            filetypes=[("Excel files", "*.xlsx *.xls"), ("CSV files", "*.csv"), ("Coordinate files", "*.coords"), ("All files", "*.*")]
         )
         
         if file_path:
             try:
-                if file_path.endswith('.csv'):
-                    self.customer_df = pd.read_csv(file_path)
+                # Results still being computed for the old data are now stale
+                self.tasks.cancel()
+                store = None
+                if file_path.endswith('.coords'):
+                    # Pre-converted binary file: memory-map the arrays instead of parsing. The
+                    # store is the customer data; no DataFrame is built from it.
+                    store = open_coordinate_file(file_path)
+                    self.customer_df = None
+                    stats = store.running_stats()
+                    new_count = len(store)
                 else:
-                    self.customer_df = pd.read_excel(file_path)
-                
-                # Clean column names (remove spaces, make lowercase)
-                self.customer_df.columns = self.customer_df.columns.str.strip().str.lower()
-                
-                # Add numeric conversion and validation
-                self.customer_df['latitude'] = pd.to_numeric(self.customer_df['latitude'], errors='coerce')
-                self.customer_df['longitude'] = pd.to_numeric(self.customer_df['longitude'], errors='coerce')
-                
-                # Remove rows with invalid coordinates
-                initial_count = len(self.customer_df)
-                self.customer_df = self.customer_df.dropna(subset=['latitude', 'longitude'])
-                new_count = len(self.customer_df)
+                    if file_path.endswith('.csv'):
+                        # Stream in chunks, keeping only the columns the app uses and cleaning as we go
+                        self.customer_df, stats = ingest_csv(file_path, CUSTOMER_COLUMNS)
+                    else:
+                        # Parsed and cleaned frames are cached next to the source file
+                        self.customer_df, stats = ingest_excel(file_path, CUSTOMER_COLUMNS)
+                    
+                    # Clean column names (remove spaces, make lowercase)
+                    self.customer_df.columns = self.customer_df.columns.str.strip().str.lower()
+                    new_count = len(self.customer_df)
                 
-                # Check required columns after cleaning
-                required = ['customer id', 'latitude', 'longitude']
-                missing = [col for col in required if col not in self.customer_df.columns]
+                # Invalid coordinates were converted and dropped during ingest
+                initial_count = stats.rows_read
+                self.customer_stats = stats
+                self.nearest_butcher = None
                 
-                if missing:
-                    self.status_label.config(text=f"Missing columns: {', '.join(missing)}")
-                elif new_count == 0:
+                if new_count == 0:
                     self.status_label.config(text="Error: No valid coordinate data found")
                 else:
                     if initial_count != new_count:
-                        self.status_label.config(text=f"Loaded {new_count} valid records (removed {initial_count - new_count} invalid rows)")
+                        msg = f"Loaded {new_count} valid records (removed {initial_count - new_count} invalid rows)"
                     else:
-                        self.status_label.config(text=f"Loaded {len(self.customer_df)} customer records")
+                        msg = f"Loaded {new_count} customer records"
+                    if stats.backfilled:
+                        msg += f", {stats.backfilled} filled from map links"
+                    self.status_label.config(text=msg)
+                    self.customer_store = store if store is not None else CoordinateStore.from_frame(self.customer_df, 'customer id')
+                    self.customer_index = GeoIndex.from_store(self.customer_store)
                     self.plot_customer_map()
                     
+            except MissingColumnsError as e:
+                self.status_label.config(text=f"Missing columns: {', '.join(e.missing)}")
             except Exception as e:
                 self.status_label.config(text=f"Error loading file: {str(e)}")
     
@@ -193,39 +254,108 @@ class CustomerMappingApp:
         
         if file_path:
             try:
-                if file_path.endswith('.csv'):
-                    self.butcher_df = pd.read_csv(file_path)
-                else:
-                    self.butcher_df = pd.read_excel(file_path)
+                # Results still being computed for the old data are now stale
+                self.tasks.cancel()
+                # Read file, converting coordinates and removing invalid rows; a missing
+                # required column raises MissingColumnsError
+                df, stats = ingest_locations(file_path, BUTCHER_COLUMNS)
                 
                 # Clean column names
-                self.butcher_df.columns = self.butcher_df.columns.str.strip().str.lower()
-                
-                # Check required columns
-                required = ['butcher id', 'butcher name', 'latitude', 'longitude']
-                missing = [col for col in required if col not in self.butcher_df.columns]
+                df.columns = df.columns.str.strip().str.lower()
                 
-                if missing:
-                    self.status_label.config(text=f"Missing columns: {', '.join(missing)}")
+                if df.empty:
+                    self.status_label.config(text="Error: No valid coordinate data found")
                 else:
-                    self.status_label.config(text=f"Loaded {len(self.butcher_df)} butcher records")
+                    self.butcher_df = df
+                    self.butcher_store = CoordinateStore.from_frame(self.butcher_df, 'butcher id')
+                    self.butcher_index = GeoIndex.from_store(self.butcher_store)
+                    self.nearest_butcher = None
+                    msg = f"Loaded {len(df)} butcher records"
+                    if stats.rows_read != len(df):
+                        msg += f" (removed {stats.rows_read - len(df)} invalid rows)"
+                    self.status_label.config(text=msg)
                     self.plot_customer_map()  # Update map with butchers
                     
+            except MissingColumnsError as e:
+                self.status_label.config(text=f"Missing columns: {', '.join(e.missing)}")
             except Exception as e:
                 self.status_label.config(text=f"Error loading file: {str(e)}")
     
     def plot_customer_map(self):
-        if self.customer_df is None:
+        if self.customer_store is None:
             return
+        
+        customer_store, customer_index = self.customer_store, self.customer_index
+        butcher_df = self.butcher_df
+        butcher_store = self.butcher_store if butcher_df is not None else None
+        tile_server = None
+        if len(customer_store) > TILE_POINT_THRESHOLD:
+            # Started here rather than in the worker, so overlapping map runs share one server
+            if self.tile_server is None:
+                self.tile_server = TileServer().start()
+            tile_server = self.tile_server
+        
+        def work(task):
+            # Worker thread: only uses the data captured above, leaving the file and browser to the Tk thread
+            task.progress("Building map...")
+            tiles = None
+            if tile_server is not None:
+                # Too many points for one page: render a tile pyramid once per dataset and serve it locally
+                tile_key, manifest = cached_tile_pyramid(
+                    customer_store, butcher_store, radius_km=SERVICE_RADIUS_KM,
+                    progress=lambda done, total: task.progress(f"Rendering map tiles: {done}/{total} tile bands")
+                )
+                tiles = (tile_server, tile_key, manifest)
+            
+            butchers = frame_fingerprint(butcher_df) if butcher_df is not None else None
+            tile_source = tiles[0].tile_url(tiles[1], 'points') if tiles else None
+            render_key = self.render_cache.key(
+                [customer_store.fingerprint, butchers, tile_source], None, MAP_RENDER_OPTIONS
+            )
+            html = self.render_cache.get(render_key)
+            if html is not None:
+                return None, html
+            m = self._build_map(customer_store, customer_index, butcher_df, butcher_store, tiles)
+            task.progress("Rendering map...")
+            html = m.get_root().render()
+            self.render_cache.put(render_key, html)
+            return m, html
+        
+        def done(result):
+            self.current_map, html = result
+            
+            # Save to temporary HTML and display
+            self.temp_html = "temp_map.html"
+            with open(self.temp_html, 'wb') as f:
+                f.write(html.encode('utf8'))
+            
+            # Display in browser (alternative would be to embed in Tkinter)
+            webbrowser.open('file://' + os.path.abspath(self.temp_html))
             
+            self.status_label.config(text="Map generated and opened in browser")
+        
+        def failed(e):
+            self.status_label.config(text=f"Error generating map: {str(e)}")
+        
+        self.tasks.start('map', work, done, failed, self.show_progress)
+    
+    def _build_map(self, customer_store, customer_index, butcher_df, butcher_store, tiles=None):
+        """Folium map with customers, butcher service areas and the customer heatmap
+
+        Butchers are drawn when butcher_df is not None. tiles is (server, pyramid key, manifest) for datasets drawn from a tile pyramid;
+        customer points, density and service areas then come from its tile layers.
+        """
+        import folium
+        from folium.plugins import MarkerCluster, HeatMap
+        
         # Create map centered on mean of customer locations
-        mean_lat = self.customer_df['latitude'].mean()
-        mean_lon = self.customer_df['longitude'].mean()
+        mean_lat = customer_store.mean_lat
+        mean_lon = customer_store.mean_lon
         
-        self.current_map = folium.Map(
+        m = folium.Map(
             location=[mean_lat, mean_lon],
-            zoom_start=12,
-            tiles='OpenStreetMap'
+            zoom_start=MAP_RENDER_OPTIONS['zoom_start'],
+            tiles=MAP_RENDER_OPTIONS['tiles']
         )
         
         # Add geographical center marker (new code)
@@ -233,50 +363,50 @@ class CustomerMappingApp:
             location=[mean_lat, mean_lon],
             popup=f'recommended hub : {mean_lat:.4f}°N, {mean_lon:.4f}°E',
             icon=folium.Icon(color='green', icon='star', prefix='fa')
-        ).add_to(self.current_map)
+        ).add_to(m)
         
-        # Add customer markers with clustering
-        customer_cluster = MarkerCluster(name="Customers").add_to(self.current_map)
-        
-        for idx, row in self.customer_df.iterrows():
-            folium.Marker(
-                location=[row['latitude'], row['longitude']],
-                popup=f"Customer ID: {row['customer id']}",
-                icon=folium.Icon(color='blue', icon='user')
-            ).add_to(customer_cluster)
+        if tiles is not None:
+            for layer in tile_layers(*tiles):
+                layer.add_to(m)
+        else:
+            # Add customer markers with clustering, built in the browser from a single data array
+            bulk_markers(customer_store, "Customer ID: ", name="Customers").add_to(m)
         
         # Add butcher markers and 5km radius circles if available
-        if self.butcher_df is not None:
-            butcher_cluster = MarkerCluster(name="Butchers").add_to(self.current_map)
+        if butcher_df is not None:
+            butcher_cluster = MarkerCluster(name="Butchers").add_to(m)
             
-            for idx, row in self.butcher_df.iterrows():
+            # Customers inside each butcher's service radius, from range queries on the customer index
+            customer_counts = customer_index.count_radius(butcher_store.lat, butcher_store.lon, SERVICE_RADIUS_KM)
+            
+            for (idx, row), customer_count in zip(butcher_df.iterrows(), customer_counts):
                 # Add butcher marker
                 butcher_name = row.get('butcher name', row['butcher id'])
+                popup = f"Butcher: {butcher_name}"
+                if tiles is not None:
+                    # The service area is drawn by the catchment tiles
+                    popup += f" - {customer_count} customers within 5km"
                 folium.Marker(
                     location=[row['latitude'], row['longitude']],
-                    popup=f"Butcher: {butcher_name}",
+                    popup=popup,
                     icon=folium.Icon(color='red', icon='cutlery')
                 ).add_to(butcher_cluster)
+                if tiles is not None:
+                    continue
                 
-                # Add 5km radius circle (approximately 0.045 degrees at equator)
-                # Convert 5km to degrees based on latitude (adjust for Earth's curvature)
-                radius_deg = 5 / (111.32 * math.cos(math.radians(row['latitude'])))
-                
+                # Add 5km radius circle (folium takes the radius in meters directly)
                 folium.Circle(
                     location=[row['latitude'], row['longitude']],
                     radius=5000,  # 5km in meters
-                    popup=f"{butcher_name} - 5km service radius",
+                    popup=f"{butcher_name} - 5km service radius ({customer_count} customers)",
                     color='red',
                     fill=True,
                     fill_color='red',
                     fill_opacity=0.1
-                ).add_to(self.current_map)
+                ).add_to(m)
         
         # Add customer distribution perimeter (bounding box)
-        min_lat = self.customer_df['latitude'].min()
-        max_lat = self.customer_df['latitude'].max()
-        min_lon = self.customer_df['longitude'].min()
-        max_lon = self.customer_df['longitude'].max()
+        min_lat, min_lon, max_lat, max_lon = customer_store.bbox
         
         folium.Rectangle(
             bounds=[[min_lat, min_lon], [max_lat, max_lon]],
@@ -286,71 +416,86 @@ class CustomerMappingApp:
             fill_color='blue',
             fill_opacity=0.05,
             popup="Customer Distribution Area"
-        ).add_to(self.current_map)
+        ).add_to(m)
         
         # Add heatmap
-        heat_data = [[row['latitude'], row['longitude']] for idx, row in self.customer_df.iterrows()]
-        HeatMap(heat_data, name="Heatmap").add_to(self.current_map)
+        if tiles is None:
+            HeatMap(heat_rows(customer_store), name="Heatmap").add_to(m)
         
         # Add layer control
-        folium.LayerControl().add_to(self.current_map)
-        
-        # Save to temporary HTML and display
-        self.temp_html = "temp_map.html"
-        self.current_map.save(self.temp_html)
+        folium.LayerControl().add_to(m)
         
-        # Display in browser (alternative would be to embed in Tkinter)
-        webbrowser.open('file://' + os.path.abspath(self.temp_html))
-        
-        self.status_label.config(text="Map generated and opened in browser")
+        return m
     
     def calculate_distances(self):
-        if self.customer_df is None or self.butcher_df is None:
+        if self.customer_store is None or self.butcher_df is None:
             self.status_label.config(text="Please load both customer and butcher data first")
             return
             
-        try:
-            # Calculate haversine distances between all customers and butchers
-            distances = []
-            
-            for _, cust in self.customer_df.iterrows():
-                row = {'Customer ID': cust['customer id']}
-                
-                for _, butcher in self.butcher_df.iterrows():
-                    # Haversine formula
-                    lat1, lon1 = math.radians(cust['latitude']), math.radians(cust['longitude'])
-                    lat2, lon2 = math.radians(butcher['latitude']), math.radians(butcher['longitude'])
-                    
-                    dlat = lat2 - lat1
-                    dlon = lon2 - lon1
-                    
-                    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-                    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-                    
-                    distance_km = EARTH_RADIUS_KM * c
-                    
-                    butcher_name = butcher.get('butcher name', butcher['butcher id'])
-                    row[f"Dist to {butcher_name} (km)"] = round(distance_km, 2)
-                
-                distances.append(row)
+        # Calculate haversine distances between all customers and butchers
+        butcher_names = butcher_labels(self.butcher_df, 'butcher name', 'butcher id')
+        column_labels = [f"Dist to {name} (km)" for name in butcher_names]
+        customer_store, butcher_store = self.customer_store, self.butcher_store
+        
+        def work(task):
+            # Worker thread: only uses the stores captured above, never self
+            if len(customer_store) * len(butcher_store) > DISTANCE_BLOCK_THRESHOLD:
+                # Too large for memory: compute in customer chunks straight to disk, split across
+                # DISTANCE_WORKERS processes when the matrix is big enough to repay starting them
+                sink = open_distance_sink(temp_sink_path(), customer_store.ids, column_labels)
+                try:
+                    fill_distance_sink(
+                        customer_store, butcher_store, sink, distance_workers(), DISTANCE_CHUNK_SIZE,
+                        progress=lambda done, total: task.progress(f"Calculating distances: {done:,}/{total:,} rows")
+                    )
+                except BaseException:
+                    sink.discard()
+                    raise
+                return None, sink
             
-            self.distance_df = pd.DataFrame(distances)
+            blocks = report_blocks(
+                task,
+                iter_store_blocks(customer_store, butcher_store, DISTANCE_CHUNK_SIZE),
+                len(customer_store),
+                "Calculating distances"
+            )
+            distances = np.vstack([block for _, block in blocks])
+            return distance_frame(customer_store.ids, 'Customer ID', column_labels, distances), None
+        
+        def done(result):
+            if self.distance_sink is not None:
+                self.distance_sink.discard()
+            self.distance_df, self.distance_sink = result
             
             # Display in Treeview
             self.display_distance_matrix()
             
-            self.status_label.config(text=f"Calculated distances for {len(self.customer_df)} customers")
-            
-        except Exception as e:
+            self.status_label.config(text=f"Calculated distances for {len(customer_store)} customers")
+        
+        def failed(e):
             self.status_label.config(text=f"Error calculating distances: {str(e)}")
+        
+        def discard(result):
+            # A superseded run may already have written its matrix to disk
+            if result[1] is not None:
+                result[1].discard()
+        
+        self.tasks.start('distances', work, done, failed, self.show_progress, discard)
     
     def display_distance_matrix(self):
-        # Clear existing tree
-        for i in self.distance_tree.get_children():
-            self.distance_tree.delete(i)
+        if self.distance_df is None and self.distance_sink is not None:
+            # Blocked mode: rows are read from the on-disk matrix as they scroll into view
+            sink = self.distance_sink
+            display_df = read_distance_frame(sink, 'Customer ID', 0, 0)
+            row_count = sink.shape[0]
+            fetch = lambda start, stop: read_distance_frame(sink, 'Customer ID', start, stop).values.tolist()
+        else:
+            display_df = self.distance_df
+            row_count = 0 if display_df is None else len(display_df)
+            fetch = lambda start, stop: display_df.iloc[start:stop].values.tolist()
         
         # Set up columns
-        columns = list(self.distance_df.columns)
+        columns = list(display_df.columns)
         self.distance_tree["columns"] = columns
         self.distance_tree["show"] = "headings"
         
@@ -359,27 +504,26 @@ class CustomerMappingApp:
             self.distance_tree.heading(col, text=col)
             self.distance_tree.column(col, width=100)
         
-        # Add data rows
-        for _, row in self.distance_df.iterrows():
-            self.distance_tree.insert("", "end", values=list(row))
+        # Add data rows (only the visible window is inserted)
+        self.distance_table.show(row_count, fetch)
     
     def export_distance_matrix(self):
-        if self.distance_df is None:
+        if self.distance_df is None and self.distance_sink is None:
             self.status_label.config(text="No distance data to export")
             return
             
         file_path = filedialog.asksaveasfilename(
-            defaultextension=".xlsx",
-            filetypes=[("Excel files", "*.xlsx"), ("CSV files", "*.csv"), ("All files", "*.*")],
+            defaultextension=".csv",
+            filetypes=[("CSV files", "*.csv"), ("Parquet files", "*.parquet"), ("Feather files", "*.feather"),
+                       ("Excel files (slow)", "*.xlsx"), ("All files", "*.*")],
             title="Save Distance Matrix As"
         )
         
         if file_path:
             try:
-                if file_path.endswith('.csv'):
-                    self.distance_df.to_csv(file_path, index=False)
-                else:
-                    self.distance_df.to_excel(file_path, index=False)
+                # Blocked mode streams from the on-disk matrix; the format follows the file extension
+                matrix = self.distance_df if self.distance_df is not None else self.distance_sink
+                save_distance_matrix(matrix, file_path, 'Customer ID', chunk_size=DISTANCE_CHUNK_SIZE)
                 
                 self.status_label.config(text=f"Distance matrix saved to {file_path}")
             except Exception as e:
@@ -396,63 +540,66 @@ class CustomerMappingApp:
             title="Save Map Image As"
         )
         
-        if file_path:
+        if not file_path:
+            return
+        
+        if self.exporter is None:
+            self.exporter = MapExporter()
+        exporter, url = self.exporter, 'file://' + os.path.abspath(self.temp_html)
+        
+        customer_store, butcher_store = self.customer_store, self.butcher_store
+        names = butcher_labels(self.butcher_df, 'butcher name', 'butcher id') if self.butcher_df is not None else None
+        
+        def work(task):
+            # Worker thread: load the page in the shared browser, wait for it to draw, capture
+            task.progress("Exporting map image...")
+            start = time.perf_counter()
             try:
-                # Use selenium to capture the map (alternative methods could be used here)
-                from selenium import webdriver
-                from PIL import Image
-                import time
-                
-                options = webdriver.ChromeOptions()
-                options.add_argument('--headless')
-                options.add_argument('--disable-gpu')
-                options.add_argument('--window-size=1200,800')
-                
-                driver = webdriver.Chrome(options=options)
-                driver.get(f'file://{os.path.abspath(self.temp_html)}')
-                time.sleep(3)  # Wait for map to load
-                
-                driver.save_screenshot(file_path)
-                driver.quit()
-                
-                # Crop to map area
-                img = Image.open(file_path)
-                img = img.crop((100, 100, 1100, 700))  # Adjust as needed
-                img.save(file_path)
-                
-                self.status_label.config(text=f"Map image saved to {file_path}")
-                
+                note = "" if exporter.export(url, file_path) else " (some tiles had not loaded)"
             except Exception as e:
-                self.status_label.config(text=f"Error saving image: {str(e)}. Make sure ChromeDriver is installed.")
+                # selenium or Chrome unavailable: draw the map straight to the image instead
+                from static_map import render_static_map, save_image
+                
+                save_image(render_static_map(customer_store, butcher_store, names, radius_km=SERVICE_RADIUS_KM), file_path)
+                note = f" without a browser ({e})"
+            return note, time.perf_counter() - start
+        
+        def done(result):
+            note, seconds = result
+            self.status_label.config(text=f"Map image saved to {file_path} in {seconds:.1f}s{note}")
+        
+        def failed(e):
+            self.status_label.config(text=f"Error saving image: {str(e)}. Make sure ChromeDriver is installed.")
+        
+        self.tasks.start('export', work, done, failed, self.show_progress)
     
     def generate_insights(self):
-        if self.customer_df is None:
+        if self.customer_store is None:
             self.status_label.config(text="No customer data to analyze")
             return
-            
-        try:
-            # Clear previous content
-            self.insights_text.delete(1.0, tk.END)
-            self.insights_canvas.delete("all")
+        
+        customer_store, customer_index = self.customer_store, self.customer_index
+        butcher_df, butcher_store, butcher_index = self.butcher_df, self.butcher_store, self.butcher_index
+        distance_df, cached_nearest = self.distance_df, self.nearest_butcher
+        
+        def work(task):
+            # Worker thread: builds the insights text from the data captured above
+            task.progress("Generating insights...")
             
             # Basic statistics
-            num_customers = len(self.customer_df)
-            avg_lat = self.customer_df['latitude'].mean()
-            avg_lon = self.customer_df['longitude'].mean()
+            num_customers = len(customer_store)
+            avg_lat = customer_store.mean_lat
+            avg_lon = customer_store.mean_lon
             
             # Density analysis
-            lat_range = self.customer_df['latitude'].max() - self.customer_df['latitude'].min()
-            lon_range = self.customer_df['longitude'].max() - self.customer_df['longitude'].min()
+            lat_range = customer_store.lat_range
+            lon_range = customer_store.lon_range
             
             # Calculate customer distribution area
-            min_lat = self.customer_df['latitude'].min()
-            max_lat = self.customer_df['latitude'].max()
-            min_lon = self.customer_df['longitude'].min()
-            max_lon = self.customer_df['longitude'].max()
+            min_lat, min_lon, max_lat, max_lon = customer_store.bbox
             
-            # Calculate area in square kilometers (approximate)
-            lat_dist = (max_lat - min_lat) * 111.32  # km per degree latitude
-            lon_dist = (max_lon - min_lon) * 111.32 * math.cos(math.radians((min_lat + max_lat) / 2))  # km per degree longitude
+            # Calculate area in square kilometers (approximate, 111.32 km per degree)
+            lat_dist, lon_dist = customer_store.span_km(km_per_degree=111.32)
             customer_area = lat_dist * lon_dist
             
             insights = [
@@ -472,16 +619,20 @@ class CustomerMappingApp:
                 insights.append("- Customer base is geographically concentrated")
                 insights.append("- Single service location may be sufficient")
             
-            if self.butcher_df is not None:
+            if butcher_df is not None:
                 insights.append(f"\nButcher Coverage Analysis:")
-                insights.append(f"Number of butchers: {len(self.butcher_df)}")
+                insights.append(f"Number of butchers: {len(butcher_df)}")
                 
                 # Calculate butcher coverage metrics
                 total_coverage_area = 0
                 butcher_coverage = []
                 outside_coverage = []
                 
-                for _, butcher in self.butcher_df.iterrows():
+                customer_counts = customer_index.count_radius(
+                    butcher_store.lat, butcher_store.lon, SERVICE_RADIUS_KM
+                )
+                
+                for (_, butcher), customer_count in zip(butcher_df.iterrows(), customer_counts):
                     butcher_name = butcher.get('butcher name', butcher['butcher id'])
                     
                     # Calculate 5km radius coverage area
@@ -502,17 +653,17 @@ class CustomerMappingApp:
                             butcher['longitude'] - min_lon,
                             max_lon - butcher['longitude']
                         ) * 111.32  # Convert to km
-                        butcher_coverage.append(f"- {butcher_name}: Inside customer area (5km service radius, {edge_dist:.2f}km from edge)")
+                        butcher_coverage.append(f"- {butcher_name}: Inside customer area (5km service radius, {edge_dist:.2f}km from edge, {customer_count} customers within 5km)")
                     else:
                         # Calculate distance to nearest point of customer distribution
                         nearest_lat = max(min(butcher['latitude'], max_lat), min_lat)
                         nearest_lon = max(min(butcher['longitude'], max_lon), min_lon)
                         
-                        dist = self.haversine(
+                        dist = haversine(
                             butcher['latitude'], butcher['longitude'],
                             nearest_lat, nearest_lon
                         )
-                        outside_coverage.append(f"- {butcher_name}: Outside customer area ({dist:.2f}km from nearest customer, 5km service radius)")
+                        outside_coverage.append(f"- {butcher_name}: Outside customer area ({dist:.2f}km from nearest customer, 5km service radius, {customer_count} customers within 5km)")
                 
                 # Calculate percentage of customer area covered by butchers
                 coverage_percentage = min(100, (total_coverage_area / customer_area) * 100) if customer_area > 0 else 0
@@ -529,44 +680,68 @@ class CustomerMappingApp:
                     insights.append("\nButchers outside customer distribution area:")
                     insights.extend(outside_coverage)
                 
-                if self.distance_df is not None:
-                    avg_distances = self.distance_df.drop('Customer ID', axis=1).mean()
+                if distance_df is not None:
+                    avg_distances = distance_df.drop('Customer ID', axis=1).mean()
                     insights.append("\nAverage distances to butchers:")
                     for butcher, dist in avg_distances.items():
                         insights.append(f"- {butcher}: {dist:.2f} km")
-                        
-                    # Calculate percentage of customers within 5km of any butcher
-                    customers_within_5km = 0
-                    for _, row in self.distance_df.iterrows():
-                        distances = [dist for col, dist in row.items() if col != 'Customer ID']
-                        if any(d <= 5 for d in distances):
-                            customers_within_5km += 1
-                    
-                    coverage_percent = (customers_within_5km / len(self.customer_df)) * 100 if len(self.customer_df) > 0 else 0
-                    insights.append(f"\nCustomer coverage metrics:")
-                    insights.append(f"Customers within 5km of any butcher: {customers_within_5km} ({coverage_percent:.1f}%)")
+                
+                # Calculate percentage of customers within 5km of any butcher
+                customers_within_5km = int(customer_index.within_radius_of_any(
+                    butcher_store.lat, butcher_store.lon, SERVICE_RADIUS_KM
+                ).sum())
+                
+                coverage_percent = (customers_within_5km / len(customer_store)) * 100 if len(customer_store) > 0 else 0
+                insights.append(f"\nCustomer coverage metrics:")
+                insights.append(f"Customers within 5km of any butcher: {customers_within_5km} ({coverage_percent:.1f}%)")
+            
+            # Reduce the plots to histograms and a thinned scatter here, so the Tk thread only draws
+            task.progress("Preparing plots...")
+            nearest = cached_nearest
+            if butcher_df is None:
+                plot = {'latitude': np.histogram(customer_store.lat, bins=15)}
+            else:
+                if nearest is None:
+                    nearest = nearest_butchers(butcher_index, customer_store)
+                step = max(1, -(-len(customer_store) // PLOT_MAX_POINTS))
+                plot = {
+                    'nearest': np.histogram(nearest[0], bins=20),
+                    'customers': (np.asarray(customer_store.lon[::step]), np.asarray(customer_store.lat[::step])),
+                    'butchers': (butcher_store.lon, butcher_store.lat),
+                    'bbox': customer_store.bbox,
+                }
+            return insights, nearest, plot
+        
+        def done(result):
+            insights, nearest, plot = result
+            self.nearest_butcher = nearest
+            
+            # Clear previous content
+            self.insights_text.delete(1.0, tk.END)
+            self.insights_canvas.delete("all")
             
             self.insights_text.insert(tk.END, "\n".join(insights))
             
             # Create visualization plots
-            self.create_coverage_visualization()
+            self.create_coverage_visualization(plot)
             
             self.status_label.config(text="Customer insights generated")
-            
-        except Exception as e:
+        
+        def failed(e):
             self.status_label.config(text=f"Error generating insights: {str(e)}")
+        
+        self.tasks.start('insights', work, done, failed, self.show_progress)
 
-if __name__ == "__main__":
-    root = tk.Tk()
-    app = CustomerMappingApp(root)
-    root.mainloop()
-
-    def create_coverage_visualization(self):
-        """Create visualization of butcher coverage"""
-        if self.butcher_df is None or self.distance_df is None:
+    def create_coverage_visualization(self, plot):
+        """Create visualization of butcher coverage from the plot data prepared by generate_insights"""
+        import matplotlib.pyplot as plt
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        
+        if 'latitude' in plot:
             # Create a simple customer distribution plot if no butcher data
             fig, ax = plt.subplots(figsize=(8, 4))
-            self.customer_df['latitude'].hist(ax=ax, bins=15, alpha=0.7)
+            counts, edges = plot['latitude']
+            ax.hist(edges[:-1], bins=edges, weights=counts, alpha=0.7)
             ax.set_title('Customer Latitude Distribution')
             ax.set_xlabel('Latitude')
             ax.set_ylabel('Number of Customers')
@@ -576,8 +751,8 @@ if __name__ == "__main__":
             fig.suptitle("Butcher Coverage Analysis")
             
             # Plot 1: Distance distribution
-            distance_data = self.distance_df.drop('Customer ID', axis=1).min(axis=1)
-            ax1.hist(distance_data, bins=20, color='skyblue', edgecolor='black')
+            counts, edges = plot['nearest']
+            ax1.hist(edges[:-1], bins=edges, weights=counts, color='skyblue', edgecolor='black')
             ax1.axvline(x=5, color='red', linestyle='--', label='5km service radius')
             ax1.set_title('Distance to Nearest Butcher')
             ax1.set_xlabel('Distance (km)')
@@ -586,23 +761,18 @@ if __name__ == "__main__":
             
             # Plot 2: Coverage map (simplified)
             ax2.scatter(
-                self.customer_df['longitude'], 
-                self.customer_df['latitude'],
+                *plot['customers'],
                 alpha=0.5, s=10, c='blue', label='Customers'
             )
             
             # Plot butchers
             ax2.scatter(
-                self.butcher_df['longitude'],
-                self.butcher_df['latitude'],
+                *plot['butchers'],
                 alpha=1, s=50, c='red', marker='*', label='Butchers'
             )
             
             # Plot customer distribution area
-            min_lat = self.customer_df['latitude'].min()
-            max_lat = self.customer_df['latitude'].max()
-            min_lon = self.customer_df['longitude'].min()
-            max_lon = self.customer_df['longitude'].max()
+            min_lat, min_lon, max_lat, max_lon = plot['bbox']
             
             ax2.add_patch(plt.Rectangle(
                 (min_lon, min_lat),
@@ -625,14 +795,16 @@ if __name__ == "__main__":
 
     def haversine(self, lat1, lon1, lat2, lon2):
         """Calculate the great circle distance between two points in kilometers"""
-        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-        
-        dlat = lat2 - lat1
-        dlon = lon2 - lon1
-        
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.atan2(math.sqrt(a), math.sqrt(1-a))
-        
-        return EARTH_RADIUS_KM * c
+        return haversine(lat1, lon1, lat2, lon2)
+
+def nearest_butchers(butcher_index, customer_store):
+    """Distance (km) and id of the nearest butcher for every customer, from the butcher index"""
+    distances, ids = butcher_index.query_nearest(customer_store.lat, customer_store.lon)
+    # Round like the distance matrix so coverage counts agree with the table
+    return np.round(distances[:, 0], 2), ids[:, 0]
 
 
+if __name__ == "__main__":
+    root = tk.Tk()
+    app = CustomerMappingApp(root)
+    root.mainloop()
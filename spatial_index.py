@@ -0,0 +1,71 @@
+import numpy as np
+
+from coordinate_store import id_array
+from distance_engine import EARTH_RADIUS_KM, DEFAULT_CHUNK_SIZE
+
+
+class GeoIndex:
+    """Ball tree over lat/lon points using the great-circle (haversine) metric
+
+    Answers nearest-neighbour queries in O(log n) per query point, so callers that only
+    need the closest locations never have to build the full distance matrix.
+    """
+
+    def __init__(self, lat, lon, ids=None):
+        from sklearn.neighbors import BallTree
+
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.ids = np.arange(len(lat)) if ids is None else id_array(ids)
+        self.size = len(lat)
+        self._tree = BallTree(np.radians(np.column_stack([lat, lon])), metric='haversine')
+
+    @classmethod
+    def from_frame(cls, df, id_col, lat_col='latitude', lon_col='longitude'):
+        """Build an index from a DataFrame with latitude/longitude columns"""
+        return cls(df[lat_col], df[lon_col], df[id_col])
+
+    @classmethod
+    def from_store(cls, store):
+        """Build an index from a CoordinateStore"""
+        return cls(store.lat, store.lon, store.ids)
+
+    def query_nearest(self, lat, lon, k=1, chunk_size=DEFAULT_CHUNK_SIZE):
+        """Distances (km) and ids of the k nearest indexed points for every query point
+
+        Returns two arrays of shape (n, k), sorted nearest first.
+        """
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        k = min(k, self.size)
+
+        distances = np.empty((len(lat), k))
+        positions = np.empty((len(lat), k), dtype=np.intp)
+        for start in range(0, len(lat), chunk_size):
+            stop = start + chunk_size
+            points = np.radians(np.column_stack([lat[start:stop], lon[start:stop]]))
+            distances[start:stop], positions[start:stop] = self._tree.query(points, k=k)
+
+        return distances * EARTH_RADIUS_KM, self.ids[positions]
+
+    def _radius_query(self, lat, lon, radius_km, **kwargs):
+        points = np.radians(np.column_stack([
+            np.asarray(lat, dtype=np.float64).ravel(),
+            np.asarray(lon, dtype=np.float64).ravel()
+        ]))
+        return self._tree.query_radius(points, r=radius_km / EARTH_RADIUS_KM, **kwargs)
+
+    def query_radius(self, lat, lon, radius_km):
+        """Ids of the indexed points within radius_km of each query point (one array per point)"""
+        return [self.ids[positions] for positions in self._radius_query(lat, lon, radius_km)]
+
+    def count_radius(self, lat, lon, radius_km):
+        """Number of indexed points within radius_km of each query point"""
+        return self._radius_query(lat, lon, radius_km, count_only=True)
+
+    def within_radius_of_any(self, lat, lon, radius_km):
+        """Boolean mask over the indexed points: True where within radius_km of any query point"""
+        mask = np.zeros(self.size, dtype=bool)
+        for positions in self._radius_query(lat, lon, radius_km):
+            mask[positions] = True
+        return mask
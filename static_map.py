@@ -0,0 +1,271 @@
+import os
+from io import BytesIO
+
+import numpy as np
+
+from tiles import (
+    CATCHMENT_EDGE, CATCHMENT_EDGE_PX, CATCHMENT_FILL, CATCHMENT_RADIUS_KM, DENSITY_CELL_PX, DENSITY_RAMP,
+    POINT_COLOR, POINT_RADIUS_PX, TILE_SIZE, MBTiles, mercator_pixels, meters_per_pixel
+)
+
+# Defaults
+STATIC_SIZE = (1200, 800)
+STATIC_PADDING_PX = 40  # Space kept around the data when choosing the zoom level
+STATIC_MAX_ZOOM = 18
+STATIC_LAYERS = ('density', 'points', 'circles', 'bbox', 'butchers')
+BACKGROUND = (242, 239, 233, 255)
+BBOX_COLOR = (90, 90, 90, 255)
+BUTCHER_FILL = (214, 39, 40, 255)
+BUTCHER_EDGE = (255, 255, 255, 255)
+BUTCHER_RADIUS_PX = 6
+LABEL_COLOR = (40, 40, 40, 255)
+
+
+class StaticView:
+    """A width x height window onto the Web Mercator plane at one integer zoom level"""
+
+    def __init__(self, zoom, left, top, width, height):
+        self.zoom = zoom
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+
+    @classmethod
+    def fit(cls, bbox, size=STATIC_SIZE, padding=STATIC_PADDING_PX, max_zoom=STATIC_MAX_ZOOM):
+        """Deepest zoom at which bbox (min_lat, min_lon, max_lat, max_lon) fits inside size, centred"""
+        min_lat, min_lon, max_lat, max_lon = bbox
+        width, height = size
+        for zoom in range(max_zoom, -1, -1):
+            x0, y1 = mercator_pixels(min_lat, min_lon, zoom)
+            x1, y0 = mercator_pixels(max_lat, max_lon, zoom)
+            if x1 - x0 <= width - 2 * padding and y1 - y0 <= height - 2 * padding:
+                break
+        return cls(zoom, (x0 + x1) / 2 - width / 2, (y0 + y1) / 2 - height / 2, width, height)
+
+    def pixels(self, lat, lon):
+        """Image pixel coordinates (x, y) of lat/lon"""
+        x, y = mercator_pixels(np.asarray(lat, dtype=np.float64), np.asarray(lon, dtype=np.float64), self.zoom)
+        return x - self.left, y - self.top
+
+
+class _TileDirectory:
+    """Tile cache laid out as <directory>/<z>/<x>/<y>.png"""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get(self, z, x, y):
+        try:
+            with open(os.path.join(self.directory, str(z), str(x), f"{y}.png"), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def max_zoom(self):
+        """Deepest <z> subdirectory, or None for an empty directory"""
+        try:
+            zooms = [int(name) for name in os.listdir(self.directory) if name.isdigit()]
+        except FileNotFoundError:
+            return None
+        return max(zooms, default=None)
+
+    def close(self):
+        pass
+
+
+def open_tile_source(path):
+    """Tiles from an .mbtiles file (such as a layer of a tiles.py pyramid) or a z/x/y.png directory"""
+    if path.endswith('.mbtiles'):
+        return MBTiles(path, readonly=True)
+    return _TileDirectory(path)
+
+
+def _tile_layer(view, source):
+    """Tiles of source at view.zoom pasted into one transparent image the size of view"""
+    from PIL import Image
+
+    layer = Image.new('RGBA', (view.width, view.height), (0, 0, 0, 0))
+    n = 2 ** view.zoom
+    for tx in range(max(0, int(view.left // TILE_SIZE)), min(n - 1, int((view.left + view.width) // TILE_SIZE)) + 1):
+        for ty in range(max(0, int(view.top // TILE_SIZE)), min(n - 1, int((view.top + view.height) // TILE_SIZE)) + 1):
+            data = source.get(view.zoom, tx, ty)
+            if data is not None:
+                tile = Image.open(BytesIO(data)).convert('RGBA')
+                layer.paste(tile, (round(tx * TILE_SIZE - view.left), round(ty * TILE_SIZE - view.top)))
+    return layer
+
+
+def _draw_tiles(canvas, view, source):
+    """Composite source under the view; past its deepest zoom the parent tiles are scaled up"""
+    from PIL import Image
+
+    max_zoom = source.max_zoom()
+    if max_zoom is None or view.zoom <= max_zoom:
+        canvas.alpha_composite(_tile_layer(view, source))
+        return
+    # Draw the same area at max_zoom, whole pixels around it, then stretch it over the view
+    scale = 2 ** (view.zoom - max_zoom)
+    left, top = int(view.left // scale), int(view.top // scale)
+    right = -int(-(view.left + view.width) // scale)
+    bottom = -int(-(view.top + view.height) // scale)
+    parent = _tile_layer(StaticView(max_zoom, left, top, right - left, bottom - top), source)
+    box = (view.left / scale - left, view.top / scale - top,
+           (view.left + view.width) / scale - left, (view.top + view.height) / scale - top)
+    canvas.alpha_composite(parent.resize((view.width, view.height), Image.BILINEAR, box=box))
+
+
+def _inside(view, x, y):
+    """Integer pixel positions of the points that fall inside the image"""
+    x, y = np.floor(x).astype(np.int64), np.floor(y).astype(np.int64)
+    keep = (x >= 0) & (x < view.width) & (y >= 0) & (y < view.height)
+    return x[keep], y[keep]
+
+
+def _draw_density(canvas, view, store):
+    from PIL import Image
+
+    x, y = _inside(view, *view.pixels(store.lat, store.lon))
+    if not len(x):
+        return
+    cols = -(-view.width // DENSITY_CELL_PX)
+    rows = -(-view.height // DENSITY_CELL_PX)
+    counts = np.bincount((y // DENSITY_CELL_PX) * cols + x // DENSITY_CELL_PX, minlength=rows * cols)
+    level = np.log1p(counts) / np.log1p(counts.max())
+    rgba = np.zeros((rows * cols, 4), dtype=np.uint8)
+    for channel in range(4):
+        rgba[:, channel] = np.interp(level, DENSITY_RAMP[:, 0], DENSITY_RAMP[:, channel + 1])
+    rgba[counts == 0] = 0
+    rgba = rgba.reshape(rows, cols, 4).repeat(DENSITY_CELL_PX, axis=0).repeat(DENSITY_CELL_PX, axis=1)
+    canvas.alpha_composite(Image.fromarray(np.ascontiguousarray(rgba[:view.height, :view.width]), 'RGBA'))
+
+
+def _draw_points(canvas, view, store):
+    from PIL import Image
+
+    x, y = _inside(view, *view.pixels(store.lat, store.lon))
+    hits = np.zeros((view.height + 2 * POINT_RADIUS_PX, view.width + 2 * POINT_RADIUS_PX), dtype=bool)
+    # Each point becomes a (2r + 1) pixel square
+    for dy in range(2 * POINT_RADIUS_PX + 1):
+        for dx in range(2 * POINT_RADIUS_PX + 1):
+            hits[y + dy, x + dx] = True
+    hits = hits[POINT_RADIUS_PX:-POINT_RADIUS_PX or None, POINT_RADIUS_PX:-POINT_RADIUS_PX or None]
+    rgba = np.zeros((view.height, view.width, 4), dtype=np.uint8)
+    rgba[hits] = POINT_COLOR
+    canvas.alpha_composite(Image.fromarray(rgba, 'RGBA'))
+
+
+def _draw_circles(canvas, view, butcher_store, radius_km):
+    """Service areas; overlapping circles share one fill, as on the catchment tiles"""
+    from PIL import Image, ImageDraw
+
+    fill = Image.new('RGBA', canvas.size, (0, 0, 0, 0))
+    edge = Image.new('RGBA', canvas.size, (0, 0, 0, 0))
+    fill_draw, edge_draw = ImageDraw.Draw(fill), ImageDraw.Draw(edge)
+    xs, ys = view.pixels(butcher_store.lat, butcher_store.lon)
+    for lat, x, y in zip(butcher_store.lat, xs, ys):
+        r = radius_km * 1000 / meters_per_pixel(lat, view.zoom)
+        box = (x - r, y - r, x + r, y + r)
+        fill_draw.ellipse(box, fill=CATCHMENT_FILL)
+        edge_draw.ellipse(box, outline=CATCHMENT_EDGE, width=CATCHMENT_EDGE_PX)
+    canvas.alpha_composite(fill)
+    canvas.alpha_composite(edge)
+
+
+def _draw_bbox(canvas, view, store):
+    from PIL import ImageDraw
+
+    min_lat, min_lon, max_lat, max_lon = store.bbox
+    x0, y1 = view.pixels(min_lat, min_lon)
+    x1, y0 = view.pixels(max_lat, max_lon)
+    ImageDraw.Draw(canvas).rectangle((float(x0), float(y0), float(x1), float(y1)), outline=BBOX_COLOR, width=1)
+
+
+def _draw_butchers(canvas, view, butcher_store, labels):
+    from PIL import ImageDraw
+
+    draw = ImageDraw.Draw(canvas)
+    xs, ys = view.pixels(butcher_store.lat, butcher_store.lon)
+    r = BUTCHER_RADIUS_PX
+    for x, y in zip(xs, ys):
+        draw.ellipse((x - r, y - r, x + r, y + r), fill=BUTCHER_FILL, outline=BUTCHER_EDGE, width=2)
+    if labels is not None:
+        for x, y, label in zip(xs, ys, labels):
+            draw.text((x + r + 3, y - r), str(label), fill=LABEL_COLOR)
+
+
+def render_static_map(customer_store, butcher_store=None, butcher_names=None, size=STATIC_SIZE,
+                      radius_km=CATCHMENT_RADIUS_KM, layers=STATIC_LAYERS, tiles=(), view=None):
+    """Draw customers, butchers and service areas to a PIL image, without a browser
+
+    layers picks what is drawn, from STATIC_LAYERS: the customer density grid, customer
+    points, butcher service circles of radius_km, the customer bounding box and butcher
+    markers (labelled with butcher_names if given). tiles is a list of .mbtiles files or
+    z/x/y.png directories composited first, in order, e.g. a cached basemap and layers
+    of a tile pyramid. The view fits the customers and butchers unless one is given.
+    Styling matches the tiles.py pyramid, so tiled and static maps look alike.
+    """
+    from PIL import Image
+
+    if view is None:
+        bbox = customer_store.bbox
+        if butcher_store is not None and len(butcher_store):
+            b = butcher_store.bbox
+            bbox = (min(bbox[0], b[0]), min(bbox[1], b[1]), max(bbox[2], b[2]), max(bbox[3], b[3]))
+        view = StaticView.fit(bbox, size)
+
+    canvas = Image.new('RGBA', (view.width, view.height), BACKGROUND)
+    for path in tiles:
+        source = open_tile_source(path)
+        try:
+            _draw_tiles(canvas, view, source)
+        finally:
+            source.close()
+
+    has_butchers = butcher_store is not None and len(butcher_store) > 0
+    if 'density' in layers:
+        _draw_density(canvas, view, customer_store)
+    if 'points' in layers:
+        _draw_points(canvas, view, customer_store)
+    if 'circles' in layers and has_butchers:
+        _draw_circles(canvas, view, butcher_store, radius_km)
+    if 'bbox' in layers:
+        _draw_bbox(canvas, view, customer_store)
+    if 'butchers' in layers and has_butchers:
+        _draw_butchers(canvas, view, butcher_store, butcher_names)
+    return canvas
+
+
+def save_image(image, path):
+    """Save an RGBA image, flattening it for formats without transparency (JPEG)"""
+    if path.lower().endswith(('.jpg', '.jpeg')):
+        image = image.convert('RGB')
+    image.save(path)
+
+
+if __name__ == "__main__":
+    import argparse
+    import time
+
+    from batch import load_butchers, load_customers
+    from distance_engine import butcher_labels
+
+    parser = argparse.ArgumentParser(description="Draw a customer/butcher map straight to an image file")
+    parser.add_argument('customers', help="customer file (.csv, .xlsx or .coords)")
+    parser.add_argument('output', help="image file (.png or .jpg)")
+    parser.add_argument('--butchers', help="butcher file (.csv or .xlsx)")
+    parser.add_argument('--size', type=int, nargs=2, default=STATIC_SIZE, metavar=('WIDTH', 'HEIGHT'))
+    parser.add_argument('--radius-km', type=float, default=CATCHMENT_RADIUS_KM, help="butcher service radius")
+    parser.add_argument('--layers', nargs='+', choices=STATIC_LAYERS, default=STATIC_LAYERS)
+    parser.add_argument('--tiles', nargs='*', default=[], help=".mbtiles files or z/x/y.png directories to draw underneath")
+    args = parser.parse_args()
+
+    customers, _ = load_customers(args.customers)
+    butchers = names = None
+    if args.butchers:
+        butcher_df, butchers, _ = load_butchers(args.butchers)
+        names = butcher_labels(butcher_df, 'butcher_name', 'butcher_id')
+    start = time.perf_counter()
+    save_image(render_static_map(customers, butchers, names, tuple(args.size), args.radius_km, args.layers, args.tiles),
+               args.output)
+    print(f"{args.output}: {time.perf_counter() - start:.2f}s")
@@ -0,0 +1,43 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+
+import distance_engine
+from coordinate_store import CoordinateStore
+from distance_engine import fill_distance_sink, open_distance_sink
+
+
+class ParallelDistanceTest(unittest.TestCase):
+
+    def setUp(self):
+        rng = np.random.default_rng(7)
+        self.customers = CoordinateStore(rng.uniform(8, 12, 30011), rng.uniform(74, 78, 30011), np.arange(30011))
+        self.butchers = CoordinateStore(rng.uniform(8, 12, 37), rng.uniform(74, 78, 37), np.arange(37))
+        self.labels = [f"dist_to_{i}" for i in range(37)]
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def fill(self, name, workers, chunk_size):
+        sink = open_distance_sink(os.path.join(self.tmp.name, name), self.customers.ids, self.labels)
+        fill_distance_sink(self.customers, self.butchers, sink, workers, chunk_size)
+        return np.load(sink.path)
+
+    def test_workers_match_single_process_bytes(self):
+        expected = self.fill('single.npy', 1, 4096)
+        # Small ranges, several per worker, with a short last one
+        with mock.patch.object(distance_engine, 'PARALLEL_MIN_CELLS', 0):
+            for workers in (2, 3):
+                with self.subTest(workers=workers):
+                    result = self.fill(f"workers{workers}.npy", workers, 2500)
+                    self.assertEqual(result.shape, (30011, 37))
+                    self.assertEqual(result.dtype, expected.dtype)
+                    self.assertEqual(result.tobytes(), expected.tobytes())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from link_resolver import NO_COORDINATES, LinkCache, resolve_links_async
+
+PLACE_PATH = '/maps/place/Shop/data=!4m6!3m5!1s0x0:0x0!8m2!3d10.7512!4d76.6543'
+
+
+class StubServer:
+    """Local HTTP server standing in for the short link host
+
+    /ok and /consent redirect like a shortener, /gone is a dead link, /busy answers 429
+    twice before redirecting and /down always answers 503. hits counts requests per path.
+    """
+
+    def __init__(self):
+        self.hits = {}
+        self._server = None
+        self.base = None
+
+    async def _handle(self, request):
+        path = request.path
+        self.hits[path] = self.hits.get(path, 0) + 1
+        if path == '/ok':
+            raise web.HTTPFound(PLACE_PATH)
+        if path == '/consent':
+            raise web.HTTPFound('/consent-page')
+        if path == '/gone':
+            raise web.HTTPNotFound()
+        if path == '/busy' and self.hits[path] <= 2:
+            raise web.HTTPTooManyRequests()
+        if path == '/busy':
+            raise web.HTTPFound(PLACE_PATH)
+        if path == '/down':
+            raise web.HTTPServiceUnavailable()
+        return web.Response(text="map page")
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_route('GET', '/{tail:.*}', self._handle)
+        self._server = TestServer(app, host='127.0.0.1')
+        await self._server.start_server()
+        self.base = str(self._server.make_url('')).rstrip('/')
+
+    async def stop(self):
+        await self._server.close()
+
+
+class ResolveLinksTest(unittest.IsolatedAsyncioTestCase):
+
+    async def asyncSetUp(self):
+        self.server = StubServer()
+        await self.server.start()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache = LinkCache(os.path.join(self.tmp.name, 'links.sqlite'))
+
+    async def asyncTearDown(self):
+        self.cache.close()
+        self.tmp.cleanup()
+        await self.server.stop()
+
+    async def resolve(self, *paths):
+        urls = [self.server.base + path for path in paths]
+        await resolve_links_async(urls, self.cache, retries=3, backoff=0)
+        return [self.cache.get(url) for url in urls]
+
+    async def test_redirect_with_coordinates_is_ok(self):
+        (result,) = await self.resolve('/ok')
+        self.assertEqual(result['status'], 'ok')
+        self.assertIsNone(result['error'])
+        self.assertEqual((result['latitude'], result['longitude']), (10.7512, 76.6543))
+        self.assertEqual(result['expanded_url'], self.server.base + PLACE_PATH)
+
+    async def test_dead_link_fails_without_retry(self):
+        (result,) = await self.resolve('/gone')
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(result['error'], "HTTP 404")
+        self.assertEqual(result['attempts'], 1)
+        self.assertEqual(self.server.hits['/gone'], 1)
+
+    async def test_link_without_coordinates_is_not_ok(self):
+        (result,) = await self.resolve('/consent')
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(result['error'], NO_COORDINATES)
+        self.assertEqual(result['expanded_url'], self.server.base + '/consent-page')
+        self.assertIsNone(result['latitude'])
+
+    async def test_rate_limited_link_is_retried(self):
+        (result,) = await self.resolve('/busy')
+        self.assertEqual(result['status'], 'ok')
+        self.assertEqual(result['attempts'], 3)
+        self.assertEqual(self.server.hits['/busy'], 3)
+
+    async def test_unavailable_link_fails_after_retries(self):
+        (result,) = await self.resolve('/down')
+        self.assertEqual(result['status'], 'failed')
+        self.assertEqual(result['error'], "HTTP 503")
+        self.assertEqual(result['attempts'], 4)
+
+    async def test_only_failed_links_are_requested_again(self):
+        await self.resolve('/ok', '/gone')
+        await self.resolve('/ok', '/gone')
+        self.assertEqual(self.server.hits['/ok'], 1)
+        self.assertEqual(self.server.hits['/gone'], 2)
+        self.assertEqual(self.cache.get(self.server.base + '/gone')['attempts'], 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
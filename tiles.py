@@ -0,0 +1,588 @@
+import hashlib
+import json
+import math
+import os
+import sqlite3
+import sys
+import threading
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+from multiprocessing import get_context, shared_memory
+import numpy as np
+
+from disk_cache import evict_lru
+
+# Pyramid defaults
+TILE_SIZE = 256
+TILE_MIN_ZOOM = 4
+TILE_MAX_ZOOM = 14
+TILE_LAYERS = ('density', 'points', 'catchments')
+TILE_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.tile_cache')
+TILE_CACHE_MAX_BYTES = 1024 * 1024 * 1024  # Whole pyramids are evicted, least recently used first
+TILE_VERSION = 1  # Bump when tile rendering changes so old pyramids stop matching
+TILE_BAND_TILES = 1024  # Most tiles one rendering job covers, bounding the PNGs it sends back at once
+TILE_JOBS_PER_WORKER = 2  # Jobs kept queued per process; finished bands wait in the parent until stored
+MAX_LATITUDE = 85.0511287798  # Web Mercator cut-off
+EARTH_RADIUS_M = 6378137
+
+# Styling
+DENSITY_CELL_PX = 4  # Density is binned in square cells of this many pixels
+DENSITY_RAMP = np.array([
+    # position, r, g, b, alpha
+    [0.0, 255, 255, 178, 90],
+    [0.5, 253, 141, 60, 170],
+    [1.0, 189, 0, 38, 220]
+])
+POINT_RADIUS_PX = 1  # Points are drawn as (2r + 1) pixel squares
+POINT_COLOR = (33, 113, 181, 220)
+CATCHMENT_RADIUS_KM = 5
+CATCHMENT_FILL = (222, 45, 38, 30)
+CATCHMENT_EDGE = (222, 45, 38, 200)
+CATCHMENT_EDGE_PX = 2
+
+# Local tile server
+TILE_SERVER_HOST = '127.0.0.1'
+TILE_SERVER_PORT = 8765
+
+
+def mercator_pixels(lat, lon, zoom):
+    """Global Web Mercator pixel coordinates (x, y) of lat/lon at zoom"""
+    scale = TILE_SIZE * 2 ** zoom
+    sin_lat = np.sin(np.radians(np.clip(lat, -MAX_LATITUDE, MAX_LATITUDE)))
+    x = (np.asarray(lon) + 180) / 360 * scale
+    y = (0.5 - np.log((1 + sin_lat) / (1 - sin_lat)) / (4 * np.pi)) * scale
+    return x, y
+
+
+def meters_per_pixel(lat, zoom):
+    return math.cos(math.radians(lat)) * 2 * math.pi * EARTH_RADIUS_M / (TILE_SIZE * 2 ** zoom)
+
+
+def _pixel_indices(lat, lon, zoom):
+    """Integer global pixel coordinates, kept inside the world"""
+    x, y = mercator_pixels(lat, lon, zoom)
+    limit = TILE_SIZE * 2 ** zoom - 1
+    return np.clip(x.astype(np.int64), 0, limit), np.clip(y.astype(np.int64), 0, limit)
+
+
+def _tile_groups(px, py, zoom):
+    """(tile x, tile y, local x, local y) for every tile holding at least one of the pixels"""
+    if not len(px):
+        return
+    n = 2 ** zoom
+    tile = (px // TILE_SIZE) * n + py // TILE_SIZE
+    order = np.argsort(tile, kind='stable')
+    tile, px, py = tile[order], px[order], py[order]
+    bounds = np.r_[np.flatnonzero(np.r_[True, tile[1:] != tile[:-1]]), len(tile)]
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        yield int(tile[start] // n), int(tile[start] % n), px[start:stop] % TILE_SIZE, py[start:stop] % TILE_SIZE
+
+
+def _encode_png(rgba):
+    from PIL import Image
+
+    buf = BytesIO()
+    Image.fromarray(rgba, 'RGBA').save(buf, format='PNG')
+    return buf.getvalue()
+
+
+def _dilate(mask, radius):
+    """Grow every set pixel of mask into a (2 * radius + 1) square"""
+    padded = np.pad(mask, radius)
+    grown = np.zeros_like(mask)
+    for dy in range(2 * radius + 1):
+        for dx in range(2 * radius + 1):
+            grown |= padded[dy:dy + TILE_SIZE, dx:dx + TILE_SIZE]
+    return grown
+
+
+def _render_points(px, py, zoom):
+    for tx, ty, lx, ly in _tile_groups(px, py, zoom):
+        hits = np.zeros((TILE_SIZE, TILE_SIZE), dtype=bool)
+        hits[ly, lx] = True
+        rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        rgba[_dilate(hits, POINT_RADIUS_PX)] = POINT_COLOR
+        yield tx, ty, rgba
+
+
+def _density_scale(px, py, zoom):
+    """log1p of the busiest density cell of a zoom level, which every tile of the level is scaled against"""
+    row_length = TILE_SIZE * 2 ** zoom // DENSITY_CELL_PX
+    _, cell_counts = np.unique((py // DENSITY_CELL_PX) * row_length + px // DENSITY_CELL_PX, return_counts=True)
+    return np.log1p(cell_counts.max())
+
+
+def _render_density(px, py, zoom, scale):
+    cells = TILE_SIZE // DENSITY_CELL_PX
+    for tx, ty, lx, ly in _tile_groups(px, py, zoom):
+        counts = np.bincount((ly // DENSITY_CELL_PX) * cells + lx // DENSITY_CELL_PX, minlength=cells * cells)
+        level = np.log1p(counts) / scale if scale else np.ones(len(counts))
+        rgba = np.zeros((cells * cells, 4), dtype=np.uint8)
+        for channel in range(4):
+            rgba[:, channel] = np.interp(level, DENSITY_RAMP[:, 0], DENSITY_RAMP[:, channel + 1])
+        rgba[counts == 0] = 0
+        rgba = rgba.reshape(cells, cells, 4).repeat(DENSITY_CELL_PX, axis=0).repeat(DENSITY_CELL_PX, axis=1)
+        yield tx, ty, rgba
+
+
+def _render_catchments(lat, lon, zoom, radius_km, columns):
+    """Filled circles of radius_km around each point, with an outline, on tile columns [x0, x1)"""
+    cx, cy = mercator_pixels(lat, lon, zoom)
+    radii = np.array([radius_km * 1000 / meters_per_pixel(a, zoom) for a in lat])
+    n = 2 ** zoom
+    x0, x1 = columns
+
+    # Tiles touched by each circle
+    circles = {}
+    for i, (x, y, r) in enumerate(zip(cx, cy, radii)):
+        for tx in range(max(x0, int((x - r) // TILE_SIZE)), min(x1 - 1, n - 1, int((x + r) // TILE_SIZE)) + 1):
+            for ty in range(max(0, int((y - r) // TILE_SIZE)), min(n - 1, int((y + r) // TILE_SIZE)) + 1):
+                circles.setdefault((tx, ty), []).append(i)
+
+    offsets = np.arange(TILE_SIZE) + 0.5
+    for (tx, ty), members in circles.items():
+        gx = tx * TILE_SIZE + offsets[None, :]
+        gy = ty * TILE_SIZE + offsets[:, None]
+        inside = np.zeros((TILE_SIZE, TILE_SIZE), dtype=bool)
+        edge = np.zeros((TILE_SIZE, TILE_SIZE), dtype=bool)
+        for i in members:
+            d = np.hypot(gx - cx[i], gy - cy[i])
+            inside |= d <= radii[i]
+            edge |= (d <= radii[i]) & (d > radii[i] - CATCHMENT_EDGE_PX)
+        if not inside.any():
+            continue
+        rgba = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+        rgba[inside] = CATCHMENT_FILL
+        rgba[edge] = CATCHMENT_EDGE
+        yield tx, ty, rgba
+
+
+def _level_density_scale(zoom, coords_name, count):
+    """Worker: _density_scale of the points at one zoom level"""
+    shm = shared_memory.SharedMemory(name=coords_name)
+    try:
+        lat, lon = np.ndarray((2, count), dtype=np.float64, buffer=shm.buf)
+        scale = _density_scale(*_pixel_indices(lat, lon, zoom), zoom)
+        # The views must go before the segment can be closed
+        del lat, lon
+    finally:
+        shm.close()
+    return scale
+
+
+def _render_band(layer, zoom, columns, coords_name, count, radius_km, scale):
+    """Worker: every non-empty tile of one layer on tile columns [x0, x1) of one zoom level
+
+    Returns the tiles as (z, x, y, png) tuples. Density tiles are scaled by scale, the
+    _density_scale of the whole level, so bands of a level match where they meet.
+    """
+    shm = shared_memory.SharedMemory(name=coords_name)
+    try:
+        lat, lon = np.ndarray((2, count), dtype=np.float64, buffer=shm.buf)
+        if layer == 'catchments':
+            tiles = _render_catchments(lat, lon, zoom, radius_km, columns)
+        else:
+            start, stop = _band_slice(lon, zoom, columns)
+            px, py = _pixel_indices(lat[start:stop], lon[start:stop], zoom)
+            inside = (px >= columns[0] * TILE_SIZE) & (px < columns[1] * TILE_SIZE)
+            px, py = px[inside], py[inside]
+            if layer == 'points':
+                tiles = _render_points(px, py, zoom)
+            else:
+                tiles = _render_density(px, py, zoom, scale)
+        result = [(zoom, tx, ty, _encode_png(rgba)) for tx, ty, rgba in tiles]
+        # The views must go before the segment can be closed
+        del lat, lon, tiles
+    finally:
+        shm.close()
+    return result
+
+
+def _band_slice(lon, zoom, columns):
+    """(start, stop) of the points on tile columns [x0, x1), and a pixel either side, in longitude-sorted lon"""
+    world = TILE_SIZE * 2 ** zoom
+    bounds = np.array(columns, dtype=np.float64) * TILE_SIZE / world * 360 - 180 + [-360 / world, 360 / world]
+    return np.searchsorted(lon, bounds)
+
+
+def _level_bands(x0, y0, x1, y1, zoom):
+    """Tile column ranges [start, stop) holding at most TILE_BAND_TILES tiles each (or a single column)
+
+    The columns covered are those of the pixel boxes (x0[i], y0[i]) - (x1[i], y1[i]) at
+    zoom, and a column counts as many tiles as the boxes over it span rows. Columns no
+    box covers are left out.
+    """
+    n = 2 ** zoom
+    left = np.clip(np.floor_divide(x0, TILE_SIZE).astype(np.int64), 0, n - 1)
+    right = np.clip(np.floor_divide(x1, TILE_SIZE).astype(np.int64), 0, n - 1)
+    top = np.clip(np.floor_divide(y0, TILE_SIZE).astype(np.int64), 0, n - 1)
+    bottom = np.clip(np.floor_divide(y1, TILE_SIZE).astype(np.int64), 0, n - 1)
+    rows = np.zeros(n + 1, dtype=np.int64)
+    np.add.at(rows, left, bottom - top + 1)
+    np.add.at(rows, right + 1, -(bottom - top + 1))
+    rows = np.minimum(np.cumsum(rows[:n]), n)
+
+    bands = []
+    start = stop = tiles = 0
+    for column in np.flatnonzero(rows).tolist():
+        if tiles and (column != stop or tiles + rows[column] > TILE_BAND_TILES):
+            bands.append((start, stop))
+            tiles = 0
+        if not tiles:
+            start = column
+        stop = column + 1
+        tiles += int(rows[column])
+    if tiles:
+        bands.append((start, stop))
+    return bands
+
+
+def _store_bands(store, zoom):
+    """_level_bands over the bounding box of a CoordinateStore"""
+    min_lat, min_lon, max_lat, max_lon = store.bbox
+    x0, y1 = mercator_pixels(min_lat, min_lon, zoom)
+    x1, y0 = mercator_pixels(max_lat, max_lon, zoom)
+    return _level_bands(np.atleast_1d(x0), np.atleast_1d(y0), np.atleast_1d(x1), np.atleast_1d(y1), zoom)
+
+
+def _catchment_bands(store, zoom, radius_km):
+    """_level_bands over the boxes of the radius_km circles drawn by _render_catchments"""
+    cx, cy = mercator_pixels(store.lat, store.lon, zoom)
+    radii = np.array([radius_km * 1000 / meters_per_pixel(a, zoom) for a in store.lat])
+    return _level_bands(cx - radii, cy - radii, cx + radii, cy + radii, zoom)
+
+
+class MBTiles:
+    """One tile layer stored as an MBTiles file (SQLite, rows numbered bottom-up as in TMS)"""
+
+    def __init__(self, path, readonly=False):
+        self.path = path
+        if readonly:
+            self._conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            self._conn = sqlite3.connect(path)
+            self._conn.execute("CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tiles (zoom_level INTEGER, tile_column INTEGER, "
+                "tile_row INTEGER, tile_data BLOB, PRIMARY KEY (zoom_level, tile_column, tile_row))"
+            )
+            self._conn.commit()
+        self._lock = threading.Lock()
+
+    def put_many(self, tiles):
+        """Store (z, x, y, png) tiles addressed the XYZ way"""
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO tiles VALUES (?, ?, ?, ?)",
+            ((z, x, (1 << z) - 1 - y, data) for z, x, y, data in tiles)
+        )
+        self._conn.commit()
+
+    def set_metadata(self, **values):
+        self._conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)", [(k, str(v)) for k, v in values.items()])
+        self._conn.commit()
+
+    def max_zoom(self):
+        """Deepest zoom level stored: the maxzoom metadata, else the deepest tile, else None"""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM metadata WHERE name = 'maxzoom'").fetchone()
+            if row is None:
+                row = self._conn.execute("SELECT MAX(zoom_level) FROM tiles").fetchone()
+        return int(row[0]) if row and row[0] is not None else None
+
+    def get(self, z, x, y):
+        """PNG bytes of tile z/x/y (XYZ addressing), or None"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+                (z, x, (1 << z) - 1 - y)
+            ).fetchone()
+        return row[0] if row else None
+
+    def close(self):
+        self._conn.close()
+
+
+def pyramid_key(customer_store, butcher_store=None, min_zoom=TILE_MIN_ZOOM, max_zoom=TILE_MAX_ZOOM,
+                radius_km=CATCHMENT_RADIUS_KM):
+    payload = json.dumps({
+        'customers': customer_store.fingerprint,
+        'butchers': butcher_store.fingerprint if butcher_store is not None else None,
+        'zoom': [min_zoom, max_zoom], 'radius_km': radius_km, 'version': TILE_VERSION
+    }, sort_keys=True)
+    return hashlib.blake2b(payload.encode('utf-8'), digest_size=20).hexdigest()
+
+
+def build_tile_pyramid(customer_store, directory, butcher_store=None, min_zoom=TILE_MIN_ZOOM,
+                       max_zoom=TILE_MAX_ZOOM, radius_km=CATCHMENT_RADIUS_KM, workers=None, progress=None):
+    """Pre-render customer density, customer points and butcher catchments into MBTiles files
+
+    Writes <layer>.mbtiles in directory for each layer of TILE_LAYERS (catchments only
+    with a butcher_store). Each zoom level of a layer is split into bands of tile columns
+    (see _level_bands) rendered by a pool of processes, a few bands at a time, so memory
+    does not grow with the size of a level; the parent is the only writer of the SQLite
+    files. Only tiles with something on them are stored. A pyramid.json manifest is
+    written last, so an existing manifest means a complete pyramid. progress, if given,
+    is called as progress(bands_done, bands_total). Returns the manifest.
+    """
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(directory, exist_ok=True)
+    stores = {'customers': customer_store}
+    layers = {'density': 'customers', 'points': 'customers'}
+    if butcher_store is not None:
+        stores['butchers'] = butcher_store
+        layers['catchments'] = 'butchers'
+
+    segments = {}
+    sorted_lon = {}
+    files = {}
+    try:
+        # Workers read the coordinates from shared memory instead of receiving a copy per job,
+        # sorted by longitude so the points on a band of tile columns are one slice
+        for name, store in stores.items():
+            segments[name] = shm = shared_memory.SharedMemory(create=True, size=max(len(store) * 16, 1))
+            coords = np.ndarray((2, len(store)), dtype=np.float64, buffer=shm.buf)
+            order = np.argsort(store.lon, kind='stable')
+            coords[0], coords[1] = store.lat[order], store.lon[order]
+            sorted_lon[name] = store.lon[order]
+            del coords, order
+        for layer in layers:
+            files[layer] = MBTiles(os.path.join(directory, f"{layer}.mbtiles"))
+
+        # Deepest levels first: they take longest, so the pool stays busy to the end
+        zooms = range(max_zoom, min_zoom - 1, -1)
+        bands = {}
+        for zoom in zooms:
+            for layer, store in layers.items():
+                if layer == 'catchments':
+                    bands[(layer, zoom)] = _catchment_bands(stores[store], zoom, radius_km)
+                else:
+                    # Skip bands without points, such as the gaps around outlying customers
+                    bands[(layer, zoom)] = [
+                        columns for columns in _store_bands(stores[store], zoom)
+                        if np.subtract(*_band_slice(sorted_lon[store], zoom, columns))
+                    ]
+        total = sum(len(columns) for columns in bands.values())
+        # Density bands wait for the scale of their level; the other layers can start at once
+        queue = deque([('scale', zoom, None) for zoom in zooms])
+        queue.extend(
+            (layer, zoom, columns)
+            for zoom in zooms for layer in layers if layer != 'density'
+            for columns in bands[(layer, zoom)]
+        )
+        scales = {}
+        done = 0
+        # spawn rather than fork: the GUI apps call this from a worker thread of a Tk process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=get_context('spawn')) as pool:
+            pending = {}
+            try:
+                while True:
+                    while queue and len(pending) < workers * TILE_JOBS_PER_WORKER:
+                        job = layer, zoom, columns = queue.popleft()
+                        store = layers['density' if layer == 'scale' else layer]
+                        shm_name, count = segments[store].name, len(stores[store])
+                        if layer == 'scale':
+                            future = pool.submit(_level_density_scale, zoom, shm_name, count)
+                        else:
+                            future = pool.submit(
+                                _render_band, layer, zoom, columns, shm_name, count, radius_km, scales.get(zoom)
+                            )
+                        pending[future] = job
+                    if not pending:
+                        break
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in finished:
+                        layer, zoom, _ = pending.pop(future)
+                        if layer == 'scale':
+                            scales[zoom] = future.result()
+                            # Ahead of the queue, so the deep levels' density bands are not left to last
+                            queue.extendleft(('density', zoom, columns) for columns in reversed(bands[('density', zoom)]))
+                            continue
+                        files[layer].put_many(future.result())
+                        done += 1
+                        if progress is not None:
+                            progress(done, total)
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+
+        min_lat, min_lon, max_lat, max_lon = customer_store.bbox
+        for layer, mbtiles in files.items():
+            mbtiles.set_metadata(
+                name=layer, format='png', type='overlay', minzoom=min_zoom, maxzoom=max_zoom,
+                bounds=f"{min_lon},{min_lat},{max_lon},{max_lat}",
+                center=f"{customer_store.mean_lon},{customer_store.mean_lat},{min_zoom}"
+            )
+    finally:
+        for mbtiles in files.values():
+            mbtiles.close()
+        for shm in segments.values():
+            shm.close()
+            shm.unlink()
+
+    manifest = {'layers': list(layers), 'min_zoom': min_zoom, 'max_zoom': max_zoom, 'bbox': list(customer_store.bbox)}
+    with open(os.path.join(directory, 'pyramid.json'), 'w') as f:
+        json.dump(manifest, f)
+    return manifest
+
+
+def cached_tile_pyramid(customer_store, butcher_store=None, root=TILE_CACHE_DIR, min_zoom=TILE_MIN_ZOOM,
+                        max_zoom=TILE_MAX_ZOOM, radius_km=CATCHMENT_RADIUS_KM, workers=None, progress=None,
+                        max_bytes=TILE_CACHE_MAX_BYTES):
+    """Key and manifest of the pyramid for this data under root, building it only if missing
+
+    Pyramids are evicted whole, least recently used first, once root grows past
+    max_bytes; the one just returned is always kept.
+    """
+    key = pyramid_key(customer_store, butcher_store, min_zoom, max_zoom, radius_km)
+    directory = os.path.join(root, key)
+    try:
+        with open(os.path.join(directory, 'pyramid.json')) as f:
+            manifest = json.load(f)
+        # Refresh the modification time so eviction sees this pyramid as recently used
+        os.utime(directory)
+        return key, manifest
+    except FileNotFoundError:
+        manifest = build_tile_pyramid(
+            customer_store, directory, butcher_store, min_zoom, max_zoom, radius_km, workers, progress
+        )
+    os.utime(directory)
+    evict_lru(root, max_bytes, keep=[directory])
+    return key, manifest
+
+
+class _TileHandler(BaseHTTPRequestHandler):
+    """GET /<pyramid key>/<layer>/<z>/<x>/<y>.png"""
+
+    def do_GET(self):
+        parts = self.path.split('?')[0].strip('/').split('/')
+        data = None
+        if len(parts) == 5 and parts[4].endswith('.png'):
+            try:
+                z, x, y = int(parts[2]), int(parts[3]), int(parts[4][:-4])
+            except ValueError:
+                pass
+            else:
+                mbtiles = self.server.tiles(parts[0], parts[1])
+                data = mbtiles.get(z, x, y) if mbtiles is not None else None
+        if data is None:
+            self.send_response(404)
+            self.send_header('Access-Control-Allow-Origin', '*')
+            self.end_headers()
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'image/png')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('Cache-Control', 'max-age=86400')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TileServer(ThreadingHTTPServer):
+    """Small local HTTP server for every pyramid under root, running on a daemon thread"""
+
+    daemon_threads = True
+
+    def __init__(self, root=TILE_CACHE_DIR, host=TILE_SERVER_HOST, port=TILE_SERVER_PORT):
+        try:
+            super().__init__((host, port), _TileHandler)
+        except OSError:
+            # Port taken (e.g. by another app instance): let the OS pick one
+            super().__init__((host, 0), _TileHandler)
+        self.root = root
+        self._files = {}
+        self._files_lock = threading.Lock()
+        self._thread = None
+
+    def tiles(self, key, layer):
+        """Open MBTiles for key/layer, or None"""
+        if layer not in TILE_LAYERS or not all(c in '0123456789abcdef' for c in key):
+            return None
+        path = os.path.join(self.root, key, f"{layer}.mbtiles")
+        with self._files_lock:
+            if path not in self._files:
+                if not os.path.exists(path):
+                    return None
+                self._files[path] = MBTiles(path, readonly=True)
+            return self._files[path]
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def tile_url(self, key, layer):
+        """Leaflet URL template for one layer of a pyramid"""
+        return f"{self.url}/{key}/{layer}/{{z}}/{{x}}/{{y}}.png"
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+        with self._files_lock:
+            for mbtiles in self._files.values():
+                mbtiles.close()
+            self._files.clear()
+
+
+def tile_layers(server, key, manifest):
+    """folium TileLayers (overlays) for every layer of a pyramid served by server"""
+    import folium
+
+    return [
+        folium.TileLayer(
+            tiles=server.tile_url(key, layer),
+            attr='Customer tiles',
+            name=f"Customer {layer}" if layer != 'catchments' else "Butcher catchments",
+            overlay=True,
+            min_zoom=0,
+            max_native_zoom=manifest['max_zoom'],
+            max_zoom=19
+        )
+        for layer in manifest['layers']
+    ]
+
+
+def _load_store(path, id_col):
+    """CoordinateStore from a .coords, CSV or Excel file"""
+    from coordinate_store import CoordinateStore, open_coordinate_file
+    from ingest import ingest_csv, ingest_excel
+
+    if path.endswith('.coords'):
+        return open_coordinate_file(path)
+    columns = [id_col, 'latitude', 'longitude']
+    df, _ = ingest_csv(path, columns) if path.endswith('.csv') else ingest_excel(path, columns)
+    return CoordinateStore.from_frame(df, id_col)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) not in (2, 3):
+        print("Usage: python tiles.py <customers.csv|.xlsx|.coords> [butchers.csv|.xlsx]")
+        sys.exit(1)
+    customers = _load_store(sys.argv[1], 'customer_id')
+    butchers = _load_store(sys.argv[2], 'butcher_id') if len(sys.argv) == 3 else None
+
+    def report(done, total):
+        print(f"\rRendered {done}/{total} tile bands", end='', flush=True)
+
+    key, manifest = cached_tile_pyramid(customers, butchers, progress=report)
+    print()
+    server = TileServer().start()
+    for layer in manifest['layers']:
+        print(f"{layer}: {server.tile_url(key, layer)}")
+    print("Serving tiles, press Ctrl+C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.stop()
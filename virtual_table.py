@@ -0,0 +1,97 @@
+from tkinter import ttk
+
+# Rows kept in the Treeview beyond the ones that fit, so resizes never show blank space
+BUFFER_ROWS = 10
+DEFAULT_ROW_HEIGHT = 20
+
+
+class VirtualTable:
+    """Window onto a table of any size, shown in an existing ttk.Treeview
+
+    The rows stay in their backing store (a DataFrame, a memory-mapped matrix, ...) and
+    are fetched through fetch(start, stop) -> list of row values. The Treeview only ever
+    holds the visible rows plus a small buffer; scrolling rewrites the values of those
+    items in place instead of inserting or deleting any, so showing and scrolling a
+    table costs the same whatever its size. The scrollbar is driven by the table rather
+    than by the Treeview, since the Treeview never sees the full row count.
+    """
+
+    def __init__(self, tree, y_scroll, buffer_rows=BUFFER_ROWS):
+        self.tree = tree
+        self.y_scroll = y_scroll
+        self.buffer_rows = buffer_rows
+        self.row_count = 0
+        self.top = 0
+        self._fetch = None
+        self._items = []
+
+        y_scroll.configure(command=self.yview)
+        tree.configure(yscrollcommand='')
+        tree.bind('<Configure>', lambda event: self._refresh())
+        tree.bind('<MouseWheel>', self._on_wheel)
+        tree.bind('<Button-4>', lambda event: self._scroll_by(-3))
+        tree.bind('<Button-5>', lambda event: self._scroll_by(3))
+
+    def show(self, row_count, fetch):
+        """Display row_count rows served by fetch(start, stop), starting from the top"""
+        self.row_count = row_count
+        self._fetch = fetch
+        self.top = 0
+        self._refresh()
+
+    def clear(self):
+        self.show(0, None)
+
+    @property
+    def page_size(self):
+        """Rows that fit in the Treeview at its current height"""
+        row_height = ttk.Style().lookup('Treeview', 'rowheight') or DEFAULT_ROW_HEIGHT
+        return max(1, self.tree.winfo_height() // int(row_height))
+
+    def yview(self, *args):
+        """Scrollbar command: 'moveto fraction' or 'scroll n units|pages'"""
+        if not args:
+            return
+        if args[0] == 'moveto':
+            self._scroll_to(int(float(args[1]) * self.row_count))
+        elif args[0] == 'scroll':
+            step = int(args[1])
+            if args[2] == 'pages':
+                step *= self.page_size
+            self._scroll_by(step)
+
+    def _on_wheel(self, event):
+        # Windows reports multiples of 120, macOS small deltas
+        step = -event.delta // 120 if abs(event.delta) >= 120 else -event.delta
+        self._scroll_by(step or (-1 if event.delta > 0 else 1))
+        return 'break'
+
+    def _scroll_by(self, rows):
+        self._scroll_to(self.top + rows)
+        return 'break'
+
+    def _scroll_to(self, top):
+        top = max(0, min(top, self.row_count - self.page_size))
+        if top != self.top:
+            self.top = top
+            self._refresh()
+
+    def _refresh(self):
+        """Rewrite the Treeview items to show rows top .. top + page_size + buffer"""
+        stop = min(self.row_count, self.top + self.page_size + self.buffer_rows)
+        rows = self._fetch(self.top, stop) if self._fetch is not None and stop > self.top else []
+
+        # Reuse existing items, adding or removing only the difference
+        while len(self._items) < len(rows):
+            self._items.append(self.tree.insert('', 'end'))
+        while len(self._items) > len(rows):
+            self.tree.delete(self._items.pop())
+        for item, values in zip(self._items, rows):
+            self.tree.item(item, values=list(values))
+
+        # Keep the Treeview's own view pinned to its first item
+        self.tree.yview_moveto(0)
+        if self.row_count:
+            self.y_scroll.set(self.top / self.row_count, min(1.0, (self.top + self.page_size) / self.row_count))
+        else:
+            self.y_scroll.set(0, 1)